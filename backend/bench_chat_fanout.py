@@ -0,0 +1,212 @@
+"""Chat fan-out benchmark against the real SSE endpoint.
+
+Starts the API with uvicorn (``--workers`` processes) on a scratch
+``<DB_NAME>_bench`` database, seeds one transaction per chat, opens a
+buyer and a seller stream on /api/transactions/{id}/chat/stream for each
+and posts messages through POST /api/transactions/{id}/chat. Every request
+goes through authentication, the membership check, the backlog read and a
+real socket; with several workers most messages reach their streams
+through another process, i.e. by that worker's one shared poller per chat.
+
+    python bench_chat_fanout.py --chats 1000 --workers 2
+
+Holding many streams needs a matching open files limit (ulimit -n).
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# Add current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+from src.config.database import get_client, close_mongo_connection, DB_NAME
+from src.models.user import User
+from src.utils.security import create_access_token
+
+HOST = "127.0.0.1"
+
+def percentile(values, share):
+    return values[max(0, int(len(values) * share) - 1)]
+
+async def read_headers(reader) -> int:
+    """Read a response's status line and headers; returns the status code"""
+    status_line = await reader.readline()
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+    return int(status_line.split()[1])
+
+async def post_message(port: int, transaction_id: str, token: str, text: str):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        body = json.dumps({"message": text}).encode()
+        writer.write(
+            f"POST /api/transactions/{transaction_id}/chat HTTP/1.1\r\nHost: {HOST}\r\n"
+            f"Authorization: Bearer {token}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        status = await read_headers(reader)
+        await reader.read()
+        return status
+    finally:
+        writer.close()
+
+async def open_stream(port: int, transaction_id: str, token: str):
+    """Open an SSE chat stream; returns the connection once the response headers arrived"""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(
+        f"GET /api/transactions/{transaction_id}/chat/stream HTTP/1.1\r\nHost: {HOST}\r\n"
+        f"Authorization: Bearer {token}\r\nAccept: text/event-stream\r\n\r\n".encode()
+    )
+    await writer.drain()
+    status = await read_headers(reader)
+    if status != 200:
+        writer.close()
+        raise RuntimeError(f"Chat stream returned {status}")
+    return reader, writer
+
+async def consume(reader, expected: int, sent_at: dict, latencies: list):
+    """Read chunked SSE events until ``expected`` messages arrived, recording delivery latency"""
+    received = 0
+    buffer = b""
+    while received < expected:
+        size = int((await reader.readline()).strip() or b"0", 16)
+        if size == 0:
+            break
+        buffer += await reader.readexactly(size + 2)
+        *events, buffer = buffer.replace(b"\r\n", b"\n").split(b"\n\n")
+        for event in events:
+            for line in event.split(b"\n"):
+                if line.startswith(b"data: "):
+                    message = json.loads(line[6:])
+                    latencies.append(time.perf_counter() - sent_at[message["message"]])
+                    received += 1
+    return received
+
+async def wait_ready(port: int, server: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("API server exited during startup")
+        try:
+            reader, writer = await asyncio.open_connection(HOST, port)
+            writer.write(f"GET /readyz HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            status = await read_headers(reader)
+            writer.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("API server did not become ready")
+
+async def main(chats: int, messages: int, workers: int, port: int, concurrency: int, keep: bool):
+    """Fan `messages` posts per chat out to a buyer and a seller stream per chat"""
+
+    bench_db = f"{DB_NAME}_bench"
+    client = get_client()
+    db = client[bench_db]
+    server = None
+    connections = []
+    try:
+        # One buyer and one seller per chat, so every stream passes its own membership check
+        buyers = [User(email=f"buyer{i}@bench.dngun.com", username=f"buyer{i}", hashed_password="x") for i in range(chats)]
+        sellers = [User(email=f"seller{i}@bench.dngun.com", username=f"seller{i}", hashed_password="x") for i in range(chats)]
+        transactions = [
+            {"id": str(uuid.uuid4()), "buyer_id": buyer.id, "seller_id": seller.id, "status": "pending",
+             "domain_id": str(uuid.uuid4()), "amount": 1.0, "transaction_fee": 0.1}
+            for buyer, seller in zip(buyers, sellers)
+        ]
+        await db.users.insert_many([user.dict() for user in buyers + sellers])
+        await db.transactions.insert_many([dict(transaction) for transaction in transactions])
+        tokens = {user.id: create_access_token({"sub": user.id}) for user in buyers + sellers}
+
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", HOST, "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            cwd=str(Path(__file__).parent),
+            env={**os.environ, "DB_NAME": bench_db}
+        )
+        await wait_ready(port, server)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        connections = await asyncio.gather(*(
+            limited(open_stream(port, transaction["id"], tokens[transaction[party]]))
+            for transaction in transactions
+            for party in ("buyer_id", "seller_id")
+        ))
+        print(f"📡 {len(connections)} open streams across {chats} chats on {workers} worker(s) "
+              f"in {time.perf_counter() - started:.2f} s")
+        print(f"   Client max RSS grew by {(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024:.1f} MB")
+
+        sent_at = {}
+        latencies = []
+        consumers = [
+            asyncio.create_task(consume(reader, messages, sent_at, latencies))
+            for reader, _ in connections
+        ]
+
+        async def post(transaction: dict, number: int):
+            text = f"{transaction['id']}:{number}"
+            sent_at[text] = time.perf_counter()
+            return await post_message(port, transaction["id"], tokens[transaction["buyer_id"]], text)
+
+        started = time.perf_counter()
+        statuses = []
+        for number in range(messages):
+            statuses += await asyncio.gather(*(limited(post(transaction, number)) for transaction in transactions))
+        posted = time.perf_counter() - started
+        received = await asyncio.gather(*consumers)
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        deliveries = len(latencies)
+        print(f"✉️  {len(statuses)} messages posted in {posted:.2f} s "
+              f"({statuses.count(200)} accepted, {len(statuses) - statuses.count(200)} failed)")
+        print(f"✅ {deliveries} deliveries in {elapsed:.2f} s ({deliveries / elapsed:,.0f}/s)")
+        print(f"   Latency p50={statistics.median(latencies) * 1000:.1f} ms "
+              f"p99={percentile(latencies, 0.99) * 1000:.1f} ms max={latencies[-1] * 1000:.1f} ms")
+
+        expected = len(connections) * messages
+        if sum(received) == expected:
+            return 0
+        print(f"❌ {expected - sum(received)} deliveries missing")
+        return 1
+
+    finally:
+        for _, writer in connections:
+            writer.close()
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if not keep:
+            await client.drop_database(bench_db)
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat fan-out benchmark against the SSE endpoint")
+    parser.add_argument("--chats", type=int, default=1000, help="concurrently open transaction chats")
+    parser.add_argument("--messages", type=int, default=5, help="messages posted to every chat")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--concurrency", type=int, default=200, help="connections opened or posts sent at once")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database afterwards")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(args.chats, args.messages, args.workers, args.port, args.concurrency, args.keep)))
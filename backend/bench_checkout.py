@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# Add current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+from fastapi import HTTPException
+from src.config.database import get_client, close_mongo_connection, DB_NAME
+from src.controllers import payment_controller
+from src.controllers.event_handlers import register_event_handlers
+from src.controllers.payment_controller import PaymentController
+from src.models.domain import Domain
+from src.models.payment import StripeCheckoutRequest
+from src.models.user import User
+from src.utils.circuit_breaker import CircuitBreaker
+from src.utils.events import event_bus
+from src.utils.payment_client import PaymentProviderClient
+from src.utils.payment_providers import FakeCheckoutProvider
+
+def percentile(values: list, fraction: float) -> float:
+    return values[max(0, int(len(values) * fraction) - 1)]
+
+async def main(checkouts: int, latency_ms: float, failure_rate: float, concurrency: int, keep: bool):
+    """Run concurrent domain checkouts end to end against the fake checkout provider"""
+
+    client = get_client()
+    db = client[f"{DB_NAME}_bench"]
+
+    # Webhooks from the fake provider are verified with the same secret the handler uses
+    payment_controller.STRIPE_WEBHOOK_SECRET = payment_controller.STRIPE_WEBHOOK_SECRET or uuid.uuid4().hex
+    provider = FakeCheckoutProvider(
+        db,
+        latency_ms=latency_ms,
+        failure_rate=failure_rate,
+        webhook_secret=payment_controller.STRIPE_WEBHOOK_SECRET,
+        webhook_handler=lambda payload, signature: PaymentController.handle_stripe_webhook(payload, signature, db)
+    )
+    payment_controller.payment_client = PaymentProviderClient(
+        provider,
+        max_concurrency=concurrency,
+        breaker=CircuitBreaker(failure_threshold=5, recovery_timeout=1.0)
+    )
+    # Count provider failures as failures instead of handing out local mock sessions
+    payment_controller.PAYMENT_DEGRADED_MODE = "off"
+    register_event_handlers(event_bus)
+
+    try:
+        seller_id = str(uuid.uuid4())
+        domains = [
+            Domain(
+                name=f"checkout-{uuid.uuid4().hex[:8]}",
+                extension=".com",
+                price=1000.0,
+                category="benchmark",
+                seller_id=seller_id
+            )
+            for _ in range(checkouts)
+        ]
+        await db.domains.insert_many([domain.dict() for domain in domains])
+
+        # Keep the load within the client's bulkhead so rejections point at real trouble
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def checkout(i: int, domain: Domain):
+            user = User(email=f"buyer{i}@bench.dngun.com", username=f"buyer{i}", hashed_password="x")
+            request = StripeCheckoutRequest(domain_id=domain.id, origin_url="http://localhost:3000")
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    session = await PaymentController.create_domain_checkout(request, user, db)
+                    outcome = "created"
+                except HTTPException as e:
+                    session = None
+                    outcome = f"rejected ({e.status_code})"
+                return outcome, session, time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(checkout(i, domain) for i, domain in enumerate(domains)))
+        elapsed = time.perf_counter() - started
+
+        outcomes = {}
+        for outcome, _, _ in results:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        latencies = sorted(latency for _, _, latency in results)
+
+        # Pay every session; the fake provider answers with checkout.session.completed webhooks
+        sessions = [session.session_id for _, session, _ in results if session is not None]
+        webhook_started = time.perf_counter()
+        await asyncio.gather(*(provider.complete_session(session_id) for session_id in sessions))
+        handled = await event_bus.drain(db)
+        webhook_elapsed = time.perf_counter() - webhook_started
+
+        paid = await db.payment_transactions.count_documents({
+            "stripe_session_id": {"$in": sessions}, "payment_status": "paid"
+        })
+        sold = await db.domains.count_documents({"id": {"$in": [d.id for d in domains]}, "status": "sold"})
+
+        print(f"Checkouts: {checkouts} in {elapsed * 1000:.1f} ms ({checkouts / elapsed:.0f}/s)")
+        print(f"   Provider latency {latency_ms:g} ms, failure rate {failure_rate:g}, concurrency {concurrency}")
+        print(f"   Outcomes: {outcomes}")
+        print(f"   Latency p50={statistics.median(latencies) * 1000:.1f} ms "
+              f"p95={percentile(latencies, 0.95) * 1000:.1f} ms max={latencies[-1] * 1000:.1f} ms")
+        print(f"Webhooks: {len(sessions)} sessions paid, {handled} events handled in {webhook_elapsed * 1000:.1f} ms")
+        print(f"   Payments paid: {paid}, domains sold: {sold}")
+        print(f"Provider: {payment_controller.payment_client.metrics()}")
+
+        if paid == len(sessions) and sold == len(sessions):
+            print("✅ Every created checkout was paid and its domain sold")
+            return 0
+        print("❌ Some created checkouts did not complete")
+        return 1
+
+    finally:
+        if not keep:
+            await client.drop_database(f"{DB_NAME}_bench")
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checkout load test against the fake payment provider")
+    parser.add_argument("--checkouts", type=int, default=500, help="concurrent checkouts, one domain each")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="simulated provider latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of provider calls that fail")
+    parser.add_argument("--concurrency", type=int, default=100, help="checkouts (and provider calls) in flight at once")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database afterwards")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(args.checkouts, args.latency_ms, args.failure_rate, args.concurrency, args.keep)))
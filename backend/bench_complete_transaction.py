@@ -0,0 +1,106 @@
+"""Latency of complete_transaction, before and after the transactional rewrite.
+
+Run against a single-node replica set so the multi-document transaction path
+is exercised, e.g.:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27018
+    mongosh --port 27018 --eval "rs.initiate()"
+    MONGO_URL="mongodb://localhost:27018/?replicaSet=rs0&directConnection=true" \\
+        python bench_complete_transaction.py --count 500
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# Add current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+from datetime import datetime
+from src.config.database import get_client, close_mongo_connection, DB_NAME, supports_transactions
+from src.controllers.transaction_controller import complete_transaction
+from src.models.domain import Domain
+from src.models.transaction import Transaction
+from src.models.user import User
+
+async def legacy_complete_transaction(transaction_id: str, current_user: User, db):
+    """The previous six-round-trip completion sequence, kept for comparison"""
+    transaction_data = await db.transactions.find_one({"id": transaction_id})
+    await db.transactions.update_one({"id": transaction_id}, {"$set": {"status": "completed"}})
+    await db.domains.update_one(
+        {"id": transaction_data["domain_id"]},
+        {"$set": {"status": "sold", "updated_at": datetime.utcnow()}}
+    )
+    await db.users.update_one(
+        {"id": transaction_data["seller_id"]},
+        {"$pull": {"domains_for_sale": transaction_data["domain_id"]}}
+    )
+    await db.users.update_one(
+        {"id": transaction_data["buyer_id"]},
+        {"$push": {"domains_owned": transaction_data["domain_id"]}}
+    )
+    return await db.transactions.find_one({"id": transaction_id})
+
+async def seed(db, count: int):
+    """Create one seller and `count` pending transactions against their domains"""
+    seller = User(email="seller@bench.dngun.com", username="bench-seller", hashed_password="x")
+    buyer = User(email="buyer@bench.dngun.com", username="bench-buyer", hashed_password="x")
+
+    domains = [
+        Domain(name=f"done-{uuid.uuid4().hex[:8]}", extension=".com", price=500.0,
+               category="benchmark", seller_id=seller.id, status="pending")
+        for _ in range(count)
+    ]
+    transactions = [
+        Transaction(domain_id=domain.id, buyer_id=buyer.id, seller_id=seller.id,
+                    amount=domain.price, transaction_fee=round(domain.price * 0.1, 2))
+        for domain in domains
+    ]
+
+    seller.domains_for_sale = [domain.id for domain in domains]
+    await db.users.insert_many([seller.dict(), buyer.dict()])
+    await db.domains.insert_many([domain.dict() for domain in domains])
+    await db.transactions.insert_many([transaction.dict() for transaction in transactions])
+
+    return seller, [transaction.id for transaction in transactions]
+
+async def measure(name: str, complete, db, count: int):
+    seller, transaction_ids = await seed(db, count)
+
+    latencies = []
+    for transaction_id in transaction_ids:
+        started = time.perf_counter()
+        await complete(transaction_id, seller, db)
+        latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    print(f"{name:<14} n={count} mean={statistics.mean(latencies) * 1000:.2f} ms "
+          f"p50={statistics.median(latencies) * 1000:.2f} ms "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.2f} ms")
+
+async def main(count: int, keep: bool):
+    client = get_client()
+    db = client[f"{DB_NAME}_bench"]
+
+    try:
+        transactional = await supports_transactions(db)
+        print(f"Multi-document transactions: {'enabled' if transactional else 'unavailable (standalone server)'}")
+
+        await measure("legacy", legacy_complete_transaction, db, count)
+        await measure("transactional", complete_transaction, db, count)
+
+    finally:
+        if not keep:
+            await client.drop_database(f"{DB_NAME}_bench")
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="complete_transaction latency benchmark")
+    parser.add_argument("--count", type=int, default=500, help="transactions completed per variant")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database afterwards")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.count, args.keep))
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# Add current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+from fastapi import HTTPException
+from src.config.database import get_client, close_mongo_connection, DB_NAME
+from src.controllers.transaction_controller import create_transaction
+from src.models.domain import Domain
+from src.models.transaction import TransactionCreate
+from src.models.user import User
+
+async def run_round(db, buyers: int):
+    """Fire `buyers` simultaneous purchases at one freshly listed domain"""
+    seller_id = str(uuid.uuid4())
+    domain = Domain(
+        name=f"race-{uuid.uuid4().hex[:8]}",
+        extension=".com",
+        price=1000.0,
+        category="benchmark",
+        seller_id=seller_id
+    )
+    await db.domains.insert_one(domain.dict())
+
+    users = [
+        User(email=f"buyer{i}@bench.dngun.com", username=f"buyer{i}", hashed_password="x")
+        for i in range(buyers)
+    ]
+
+    async def purchase(user):
+        started = time.perf_counter()
+        try:
+            await create_transaction(TransactionCreate(domain_id=domain.id, amount=domain.price), user, db)
+            outcome = "reserved"
+        except HTTPException as e:
+            outcome = f"rejected ({e.status_code})"
+        except Exception as e:
+            outcome = f"error ({type(e).__name__})"
+        return outcome, time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(purchase(user) for user in users))
+    elapsed = time.perf_counter() - started
+
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    latencies = sorted(latency for _, latency in results)
+    transactions = await db.transactions.count_documents({"domain_id": domain.id})
+
+    return {
+        "outcomes": outcomes,
+        "transactions": transactions,
+        "elapsed": elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "max": latencies[-1]
+    }
+
+async def main(buyers: int, rounds: int, keep: bool):
+    """Check that concurrent purchases of one domain produce exactly one transaction"""
+
+    client = get_client()
+    db = client[f"{DB_NAME}_bench"]
+    double_sells = 0
+
+    try:
+        for round_number in range(1, rounds + 1):
+            result = await run_round(db, buyers)
+            if result["transactions"] != 1:
+                double_sells += 1
+
+            print(f"Round {round_number}: {buyers} buyers in {result['elapsed'] * 1000:.1f} ms")
+            print(f"   Outcomes: {result['outcomes']}")
+            print(f"   Transactions created: {result['transactions']}")
+            print(f"   Latency p50={result['p50'] * 1000:.1f} ms p95={result['p95'] * 1000:.1f} ms max={result['max'] * 1000:.1f} ms")
+
+        if double_sells:
+            print(f"❌ {double_sells}/{rounds} rounds sold the same domain more than once")
+        else:
+            print(f"✅ Every round produced exactly one transaction")
+
+    finally:
+        if not keep:
+            await client.drop_database(f"{DB_NAME}_bench")
+        await close_mongo_connection()
+
+    return double_sells
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent purchase benchmark for create_transaction")
+    parser.add_argument("--buyers", type=int, default=500, help="simultaneous purchases per round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database afterwards")
+    args = parser.parse_args()
+
+    sys.exit(1 if asyncio.run(main(args.buyers, args.rounds, args.keep)) else 0)
@@ -5,7 +5,7 @@ from pathlib import Path
 # Add current directory to Python path
 sys.path.append(str(Path(__file__).parent))
 
-from src.config.database import get_database, client
+from src.config.database import get_database, close_mongo_connection
 
 async def check_users():
     """Check what users exist in the database"""
@@ -49,8 +49,7 @@ async def check_users():
     
     finally:
         # Close database connection
-        if client:
-            client.close()
+        await close_mongo_connection()
 
 if __name__ == "__main__":
     asyncio.run(check_users())
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""Release or refund escrowed payments in bulk, outside the API process.
+
+    python process_escrow_batch.py release --paid-before 2024-06-01 --batch-id payouts-2024-06-01
+    python process_escrow_batch.py refund --payment-ids-file disputed.txt
+
+One NDJSON result per payment (per line item for carts) is written to
+stdout (or --output), the summary to stderr. Payments are released only
+once their escrow transaction completed. Rerun with the same --batch-id to resume a batch that
+was interrupted; a finished batch is not applied again.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Add current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+from fastapi import HTTPException
+from src.config.database import get_database, close_mongo_connection
+from src.config.indexes import ensure_indexes
+from src.controllers.escrow_controller import open_escrow_batch, ESCROW_ACTIONS
+from src.models.payment import EscrowBatchRequest
+
+async def process(args):
+    """Run one escrow batch and write its results"""
+
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        # Get database
+        db = await get_database()
+        await ensure_indexes(db)
+
+        payment_ids = None
+        if args.payment_ids_file:
+            with open(args.payment_ids_file) as f:
+                payment_ids = [line.strip() for line in f if line.strip()]
+
+        request = EscrowBatchRequest(
+            action=args.action,
+            batch_id=args.batch_id,
+            payment_ids=payment_ids,
+            buyer_id=args.buyer_id,
+            seller_id=args.seller_id,
+            paid_before=datetime.fromisoformat(args.paid_before) if args.paid_before else None,
+            max_payments=args.max_payments
+        )
+
+        summary = None
+        async for result in await open_escrow_batch(db, request):
+            if "summary" in result:
+                summary = result["summary"]
+            output.write(json.dumps(result, default=str) + "\n")
+
+        state = "finished" if summary["completed"] else "stopped at --max-payments; rerun to continue"
+        print(f"✅ Escrow batch {summary['batch_id']} ({args.action}) {state}", file=sys.stderr)
+        print(f"   Applied: {summary['applied']}", file=sys.stderr)
+        print(f"   Skipped: {summary['skipped']}", file=sys.stderr)
+
+    except HTTPException as e:
+        print(f"❌ {e.detail}", file=sys.stderr)
+    except Exception as e:
+        print(f"❌ Error processing escrow batch: {e}", file=sys.stderr)
+
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        # Close database connection
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Release or refund escrowed payments in bulk")
+    parser.add_argument("action", choices=list(ESCROW_ACTIONS))
+    parser.add_argument("--batch-id", help="Reuse to resume an interrupted batch")
+    parser.add_argument("--payment-ids-file", help="File with one payment id per line")
+    parser.add_argument("--buyer-id")
+    parser.add_argument("--seller-id")
+    parser.add_argument("--paid-before", help="ISO date; only payments paid before it")
+    parser.add_argument("--max-payments", type=int, help="Stop after this many payments")
+    parser.add_argument("--output", help="Append NDJSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    asyncio.run(process(args))
@@ -0,0 +1,33 @@
+import asyncio
+import sys
+from pathlib import Path
+
+# Add current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+from src.config.database import get_database, close_mongo_connection
+from src.config.indexes import ensure_indexes
+from src.controllers.stats_controller import rebuild_user_stats
+
+async def rebuild():
+    """Recompute the user_stats collection from scratch when the counters have drifted"""
+
+    try:
+        # Get database
+        db = await get_database()
+
+        # $merge on user_id needs the unique index
+        await ensure_indexes(db)
+
+        rebuilt = await rebuild_user_stats(db)
+        print(f"✅ Rebuilt stats for {rebuilt} users")
+
+    except Exception as e:
+        print(f"❌ Error rebuilding user stats: {e}")
+
+    finally:
+        # Close database connection
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(rebuild())
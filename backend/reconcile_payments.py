@@ -0,0 +1,168 @@
+"""Reconcile payments left pending with the checkout provider, outside the API process.
+
+    python reconcile_payments.py --min-age-minutes 60
+    python reconcile_payments.py --fake --fake-payments 5000 --fake-paid-rate 0.3 --fake-latency-ms 200
+
+With --fake, nothing touches the configured database: the script seeds a
+scratch ``<DB_NAME>_bench`` database with pending payments whose sessions
+come from a local FakeCheckoutProvider, pays or expires a share of those
+sessions without delivering their webhooks (as if they were missed),
+reconciles them through the guarded provider client and checks that every
+payment ended up matching its session. The database is dropped afterwards
+unless --keep is given.
+"""
+import argparse
+import asyncio
+import random
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+from src.config.database import get_client, get_database, close_mongo_connection, DB_NAME
+from src.config.indexes import ensure_indexes
+from src.controllers import payment_controller
+from src.controllers.reconciliation_controller import (
+    reconcile_pending_payments,
+    RECONCILE_MIN_AGE_MINUTES,
+    RECONCILE_CONCURRENCY,
+    RECONCILE_RATE_PER_SECOND,
+    RECONCILE_BATCH_SIZE
+)
+from src.models.payment import CheckoutSessionRequest, PaymentTransaction
+from src.utils.payment_client import PaymentProviderClient
+from src.utils.payment_providers import FakeCheckoutProvider
+
+def print_result(result: dict):
+    print(f"✅ Checked {result['checked']} pending payments in {result['duration_ms']} ms")
+    print(f"   Paid: {result['paid']}")
+    print(f"   Expired/canceled: {result['closed']}")
+    print(f"   Unchanged: {result['unchanged']}")
+    print(f"   Errors: {result['errors']}")
+
+async def seed_fake_payments(db, provider: FakeCheckoutProvider, args) -> dict:
+    """Create pending payments backed by fake sessions; returns the session outcome per session id"""
+
+    created_at = datetime.utcnow() - timedelta(minutes=args.min_age_minutes + 1)
+    payments = []
+    for _ in range(args.fake_payments):
+        session = await provider.create_checkout_session(CheckoutSessionRequest(
+            amount=10.0,
+            success_url="http://localhost/payment/success",
+            cancel_url="http://localhost/payment/cancel"
+        ))
+        payments.append(PaymentTransaction(
+            amount=10.0,
+            stripe_session_id=session.session_id,
+            payment_method=provider.payment_method,
+            created_at=created_at,
+            updated_at=created_at
+        ).dict())
+    await db.payment_transactions.insert_many(payments)
+
+    # Close sessions behind the API's back, as if their webhooks never arrived
+    outcomes = {}
+    for payment in payments:
+        session_id = payment["stripe_session_id"]
+        roll = random.random()
+        if roll < args.fake_paid_rate:
+            await provider.complete_session(session_id)
+            outcomes[session_id] = "paid"
+        elif roll < args.fake_paid_rate + args.fake_expired_rate:
+            await provider.expire_session(session_id)
+            outcomes[session_id] = "expired"
+        else:
+            outcomes[session_id] = "pending"
+    return outcomes
+
+async def reconcile_fake(args) -> int:
+    """Run one pass against a seeded scratch database and verify the outcome"""
+
+    bench_db = f"{DB_NAME}_bench"
+    client = get_client()
+    db = client[bench_db]
+    try:
+        await ensure_indexes(db)
+
+        # No webhook handler: session changes only become visible through reconciliation
+        provider = FakeCheckoutProvider(db)
+        outcomes = await seed_fake_payments(db, provider, args)
+        print(f"🌱 Seeded {len(outcomes)} pending payments in {bench_db}")
+
+        provider.latency_ms = args.fake_latency_ms
+        provider.failure_rate = args.fake_error_rate
+        result = await reconcile_pending_payments(
+            db,
+            PaymentProviderClient(provider, max_concurrency=args.concurrency),
+            min_age_minutes=args.min_age_minutes,
+            concurrency=args.concurrency,
+            rate_per_second=args.rate,
+            batch_size=args.batch_size
+        )
+        print_result(result)
+
+        mismatched = 0
+        async for payment in db.payment_transactions.find({}, {"_id": 0, "stripe_session_id": 1, "payment_status": 1}):
+            if payment["payment_status"] != outcomes[payment["stripe_session_id"]]:
+                mismatched += 1
+        if mismatched > result["errors"]:
+            print(f"❌ {mismatched} payments do not match their session ({result['errors']} lookups failed)")
+            return 1
+        return 0
+
+    finally:
+        if not args.keep:
+            await client.drop_database(bench_db)
+        await close_mongo_connection()
+
+async def reconcile(args) -> int:
+    """Run one reconciliation pass (resuming an interrupted one)"""
+
+    try:
+        # Get database
+        db = await get_database()
+        await ensure_indexes(db)
+        if isinstance(payment_controller.checkout_provider, FakeCheckoutProvider):
+            payment_controller.checkout_provider.db = db
+
+        result = await reconcile_pending_payments(
+            db,
+            min_age_minutes=args.min_age_minutes,
+            concurrency=args.concurrency,
+            rate_per_second=args.rate,
+            batch_size=args.batch_size
+        )
+        if result is None:
+            print("⚠️  No checkout provider configured; set STRIPE_API_KEY or use --fake")
+            return 1
+
+        print_result(result)
+        return 0
+
+    except Exception as e:
+        print(f"❌ Error reconciling payments: {e}")
+        return 1
+
+    finally:
+        # Close database connection
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile pending payments with the checkout provider")
+    parser.add_argument("--min-age-minutes", type=float, default=RECONCILE_MIN_AGE_MINUTES)
+    parser.add_argument("--concurrency", type=int, default=RECONCILE_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=RECONCILE_RATE_PER_SECOND, help="Lookups started per second")
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument("--fake", action="store_true",
+                        help="Reconcile seeded payments in a scratch database against a local fake provider")
+    parser.add_argument("--fake-payments", type=int, default=1000, help="pending payments seeded with --fake")
+    parser.add_argument("--fake-paid-rate", type=float, default=0.2)
+    parser.add_argument("--fake-expired-rate", type=float, default=0.5)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    parser.add_argument("--fake-latency-ms", type=float, default=150)
+    parser.add_argument("--keep", action="store_true", help="keep the --fake scratch database afterwards")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(reconcile_fake(args) if args.fake else reconcile(args)))
@@ -0,0 +1,125 @@
+"""Replay signed Stripe checkout webhooks against a local API for load testing.
+
+Events are either read from a JSON lines file (e.g. exported with
+``stripe events list``) or synthesized for pending payments in the database,
+then signed with STRIPE_WEBHOOK_SECRET and posted to the webhook endpoint.
+No network access to Stripe is needed.
+
+    python replay_webhooks.py --limit 1000 --duplicates 3 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Add current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+load_dotenv(Path(__file__).parent / '.env')
+
+from src.config.database import get_database, close_mongo_connection
+from src.utils.webhooks import sign_payload
+
+def checkout_event(session_id: str, event_type: str, amount: float) -> dict:
+    """A minimal checkout.session.* event in Stripe's shape"""
+    return {
+        "id": f"evt_replay_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": event_type,
+        "created": int(time.time()),
+        "data": {"object": {
+            "id": session_id,
+            "object": "checkout.session",
+            "payment_status": "paid" if event_type == "checkout.session.completed" else "unpaid",
+            "status": "expired" if event_type == "checkout.session.expired" else "complete",
+            "amount_total": int(round(amount * 100))
+        }}
+    }
+
+def post_event(url: str, secret: str, event: dict) -> int:
+    payload = json.dumps(event).encode()
+    request = urllib.request.Request(url, data=payload, method="POST", headers={
+        "Content-Type": "application/json",
+        "Stripe-Signature": sign_payload(payload, secret)
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+async def load_events(args) -> list:
+    if args.file:
+        with open(args.file) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    try:
+        # Get database
+        db = await get_database()
+        payments = await db.payment_transactions.find(
+            {"payment_status": "pending"},
+            {"_id": 0, "stripe_session_id": 1, "amount": 1}
+        ).limit(args.limit).to_list(length=args.limit)
+    finally:
+        # Close database connection
+        await close_mongo_connection()
+
+    return [checkout_event(p["stripe_session_id"], args.event_type, p["amount"]) for p in payments]
+
+async def replay(args):
+    secret = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+    if not secret:
+        print("❌ STRIPE_WEBHOOK_SECRET is not set; the API would reject every delivery")
+        return
+
+    events = await load_events(args)
+    if not events:
+        print("⚠️  No events to replay")
+        return
+
+    # Stripe delivers at least once; send each event several times, out of order
+    deliveries = [event for event in events for _ in range(args.duplicates)]
+    random.shuffle(deliveries)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    statuses = {}
+
+    async def deliver(event):
+        async with semaphore:
+            started = time.perf_counter()
+            code = await asyncio.to_thread(post_event, args.url, secret, event)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[code] = statuses.get(code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(deliver(event) for event in deliveries))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"✅ Replayed {len(deliveries)} deliveries of {len(events)} events in {elapsed:.2f}s "
+          f"({len(deliveries) / elapsed:.0f}/s)")
+    print(f"   Status codes: {statuses}")
+    print(f"   Latency p50 {latencies[len(latencies) // 2]:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay signed Stripe webhooks against a local API")
+    parser.add_argument("--url", default="http://localhost:8001/api/payments/webhook/stripe")
+    parser.add_argument("--file", help="JSON lines file of Stripe events to replay instead of synthesizing them")
+    parser.add_argument("--event-type", default="checkout.session.completed",
+                        choices=["checkout.session.completed", "checkout.session.expired",
+                                 "checkout.session.async_payment_failed"])
+    parser.add_argument("--limit", type=int, default=100, help="Pending payments to synthesize events for")
+    parser.add_argument("--duplicates", type=int, default=2, help="Deliveries per event")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(replay(args))
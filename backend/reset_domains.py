@@ -5,7 +5,7 @@ from pathlib import Path
 # Add current directory to Python path
 sys.path.append(str(Path(__file__).parent))
 
-from src.config.database import get_database, client
+from src.config.database import get_database, close_mongo_connection
 from datetime import datetime
 
 async def reset_domains_to_available():
@@ -55,8 +55,7 @@ async def reset_domains_to_available():
     
     finally:
         # Close database connection
-        if client:
-            client.close()
+        await close_mongo_connection()
 
 if __name__ == "__main__":
     asyncio.run(reset_domains_to_available())
\ No newline at end of file
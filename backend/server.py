@@ -1,16 +1,32 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+import asyncio
 import os
 import logging
+import signal
 import sys
+import threading
 from pathlib import Path
 
 # Add current directory to Python path
 sys.path.append(str(Path(__file__).parent))
 
 # Import configuration
-from src.config.database import client, get_database, close_mongo_connection
+from src.config.database import connect_to_mongo, close_mongo_connection, get_database, pool_statistics
+from src.config.indexes import ensure_indexes
+from src.middleware.auth import get_current_admin_user
+from src.models.user import User
+from src.utils.totp import last_used_recorder
+from src.utils.scheduler import scheduler
+from src.utils.events import event_bus
+from src.controllers.event_handlers import register_event_handlers
+from src.controllers import payment_controller
+from src.utils.payment_providers import FakeCheckoutProvider
+from src.controllers.reservation_controller import release_stale_reservations, RESERVATION_SWEEP_INTERVAL_SECONDS
+from src.controllers.reconciliation_controller import reconcile_pending_payments, RECONCILE_INTERVAL_SECONDS
 
 # Import routes
 from src.routes.auth_routes import router as auth_router
@@ -24,11 +40,80 @@ from src.routes.payment_routes import router as payment_router
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Wire domain event handlers to the outbox dispatcher
+register_event_handlers(event_bus)
+
+logger = logging.getLogger(__name__)
+
+# Seconds background work gets to finish on shutdown before it is cancelled
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get('SHUTDOWN_GRACE_SECONDS', '10'))
+# How long /readyz waits for MongoDB to answer a ping
+READINESS_TIMEOUT_SECONDS = float(os.environ.get('READINESS_TIMEOUT_SECONDS', '2'))
+
+def drain_on_stop_signal(app: FastAPI):
+    """Report not ready from the moment SIGTERM/SIGINT arrives.
+
+    Uvicorn waits for open connections to finish before it runs the lifespan
+    shutdown, so the draining flag is set from the signal itself. The
+    server's own handler is chained and still starts the shutdown; uvicorn
+    restores the original handlers when it exits.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+
+    def chain(previous):
+        def handler(signum, frame):
+            app.state.draining = True
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                signal.signal(signum, signal.SIG_DFL)
+                signal.raise_signal(signum)
+        return handler
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, chain(signal.getsignal(signum)))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: the MongoDB client is created here rather than at import, so each
+    # worker process gets its own client bound to its own event loop
+    logger.info(f"Connecting to MongoDB (worker pid {os.getpid()})...")
+    app.state.draining = False
+    drain_on_stop_signal(app)
+    db = connect_to_mongo()
+    await ensure_indexes(db)
+    if isinstance(payment_controller.checkout_provider, FakeCheckoutProvider):
+        payment_controller.checkout_provider.db = db
+    last_used_recorder.start(db)
+    
+    # Outbox dispatch for domain events
+    event_bus.start(db)
+    
+    # Background jobs; the lease keeps each to one worker per interval
+    scheduler.add_job("release_stale_reservations", RESERVATION_SWEEP_INTERVAL_SECONDS, release_stale_reservations, db)
+    scheduler.add_job("reconcile_pending_payments", RECONCILE_INTERVAL_SECONDS, reconcile_pending_payments, db)
+    scheduler.start(lease_db=db)
+    
+    yield
+    
+    # Shutdown: still report not ready (also when stopped without a signal),
+    # let background work finish, then flush buffers
+    app.state.draining = True
+    await scheduler.stop(grace=SHUTDOWN_GRACE_SECONDS)
+    await event_bus.stop(grace=SHUTDOWN_GRACE_SECONDS)
+    if isinstance(payment_controller.checkout_provider, FakeCheckoutProvider):
+        await payment_controller.checkout_provider.drain(timeout=SHUTDOWN_GRACE_SECONDS)
+    await last_used_recorder.stop()
+    logger.info("Closing MongoDB connection...")
+    await close_mongo_connection()
+
 # Create the main app without a prefix
 app = FastAPI(
     title="DNGun API",
     description="Backend API for DNGun.com Domain Marketplace",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Create a router with the /api prefix
@@ -52,6 +137,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Has-More"],
 )
 
 # Configure logging
@@ -59,17 +145,6 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
-logger = logging.getLogger(__name__)
-
-# Startup and shutdown events
-@app.on_event("startup")
-async def startup_db_client():
-    logger.info("Connecting to MongoDB...")
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    logger.info("Closing MongoDB connection...")
-    client.close()
 
 # Root endpoint
 @app.get("/")
@@ -84,3 +159,26 @@ async def root():
 @app.get("/test")
 async def test():
     return {"message": "Test endpoint is working"}
+
+# Connection pool settings and CMAP counters of this worker's MongoDB client (admins only)
+@app.get("/api/db/pool")
+async def db_pool_stats(current_user: User = Depends(get_current_admin_user)):
+    return pool_statistics()
+
+# Liveness: the process is up and serving requests
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+# Readiness: this worker can reach MongoDB and is not shutting down
+@app.get("/readyz")
+async def readyz():
+    if getattr(app.state, "draining", False):
+        return JSONResponse(status_code=503, content={"status": "draining"})
+    try:
+        db = await get_database()
+        await asyncio.wait_for(db.command("ping"), READINESS_TIMEOUT_SECONDS)
+    except Exception as e:
+        logger.warning(f"Readiness check failed: {e}")
+        return JSONResponse(status_code=503, content={"status": "unavailable", "database": "unreachable"})
+    return {"status": "ready", "database": "ok"}
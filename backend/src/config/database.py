@@ -1,8 +1,17 @@
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pydantic import BaseModel
+from pymongo import monitoring
+from typing import Dict, List, Optional
+import importlib.util
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 # Load environment variables
 ROOT_DIR = Path(__file__).parent.parent.parent
 load_dotenv(ROOT_DIR / '.env')
@@ -11,13 +20,235 @@ load_dotenv(ROOT_DIR / '.env')
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 DB_NAME = os.environ.get('DB_NAME', 'dngun_db')
 
-# Database connection instance
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DB_NAME]
+# Wire compressors and the module each needs; zlib ships with Python
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+def _optional_int(name: str) -> Optional[int]:
+    value = os.environ.get(name, '')
+    return int(value) if value else None
+
+class DatabaseSettings(BaseModel):
+    """Connection settings for the Motor client, read from MONGO_* environment variables"""
+    url: str = MONGO_URL
+    name: str = DB_NAME
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    max_idle_time_ms: Optional[int] = None
+    wait_queue_timeout_ms: Optional[int] = None
+    server_selection_timeout_ms: int = 30000
+    connect_timeout_ms: int = 20000
+    socket_timeout_ms: Optional[int] = None
+    compressors: List[str] = ["zstd", "snappy"]
+    app_name: str = "dngun-api"
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        return cls(
+            url=os.environ.get('MONGO_URL', MONGO_URL),
+            name=os.environ.get('DB_NAME', DB_NAME),
+            max_pool_size=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+            min_pool_size=int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+            max_idle_time_ms=_optional_int('MONGO_MAX_IDLE_TIME_MS'),
+            wait_queue_timeout_ms=_optional_int('MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+            server_selection_timeout_ms=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '30000')),
+            connect_timeout_ms=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '20000')),
+            socket_timeout_ms=_optional_int('MONGO_SOCKET_TIMEOUT_MS'),
+            # Comma separated, in order of preference; empty disables compression
+            compressors=[c.strip() for c in os.environ.get('MONGO_COMPRESSORS', 'zstd,snappy').split(',') if c.strip()],
+            app_name=os.environ.get('MONGO_APP_NAME', 'dngun-api')
+        )
+
+    def available_compressors(self) -> List[str]:
+        """Configured compressors whose Python module is installed; the server picks among them"""
+        available = []
+        for compressor in self.compressors:
+            module = COMPRESSOR_MODULES.get(compressor)
+            if module and importlib.util.find_spec(module):
+                available.append(compressor)
+            else:
+                logger.info(f"MongoDB wire compressor {compressor} is not available; skipping it")
+        return available
+
+    def client_options(self) -> dict:
+        options = {
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "connectTimeoutMS": self.connect_timeout_ms,
+            "appname": self.app_name
+        }
+        if self.max_idle_time_ms is not None:
+            options["maxIdleTimeMS"] = self.max_idle_time_ms
+        if self.wait_queue_timeout_ms is not None:
+            options["waitQueueTimeoutMS"] = self.wait_queue_timeout_ms
+        if self.socket_timeout_ms is not None:
+            options["socketTimeoutMS"] = self.socket_timeout_ms
+        compressors = self.available_compressors()
+        if compressors:
+            options["compressors"] = ",".join(compressors)
+        return options
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Connection pool counters per server, fed by the driver's CMAP events.
+
+    Events arrive on the driver's worker threads, so counters are guarded by
+    a lock and check-out wait times are measured per thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pools: Dict[str, Dict[str, float]] = {}
+
+    def _pool(self, address) -> Dict[str, float]:
+        key = f"{address[0]}:{address[1]}"
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = {
+                "open": 0, "checked_out": 0, "wait_queue": 0, "created": 0, "closed": 0,
+                "check_outs": 0, "check_out_failures": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0, "cleared": 0
+            }
+        return pool
+
+    def _count(self, address, **increments):
+        with self._lock:
+            pool = self._pool(address)
+            for field, amount in increments.items():
+                pool[field] += amount
+
+    def _wait_ended(self, address, **increments):
+        started = getattr(self._local, "check_out_started", None)
+        self._local.check_out_started = None
+        waited_ms = (time.monotonic() - started) * 1000 if started is not None else 0.0
+        with self._lock:
+            pool = self._pool(address)
+            pool["wait_queue"] = max(0, pool["wait_queue"] - 1)
+            pool["wait_ms_total"] += waited_ms
+            pool["wait_ms_max"] = max(pool["wait_ms_max"], waited_ms)
+            for field, amount in increments.items():
+                pool[field] += amount
+
+    def pool_created(self, event):
+        self._count(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._count(event.address, cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count(event.address, open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count(event.address, open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._local.check_out_started = time.monotonic()
+        self._count(event.address, wait_queue=1)
+
+    def connection_check_out_failed(self, event):
+        self._wait_ended(event.address, check_out_failures=1)
+
+    def connection_checked_out(self, event):
+        self._wait_ended(event.address, checked_out=1, check_outs=1)
+
+    def connection_checked_in(self, event):
+        self._count(event.address, checked_out=-1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            pools = {}
+            for address, counts in self._pools.items():
+                attempts = counts["check_outs"] + counts["check_out_failures"]
+                pools[address] = {
+                    **{field: value for field, value in counts.items() if field != "wait_ms_total"},
+                    "wait_ms_avg": round(counts["wait_ms_total"] / attempts, 2) if attempts else 0.0,
+                    "wait_ms_max": round(counts["wait_ms_max"], 2)
+                }
+            return pools
+
+pool_stats = PoolStatsListener()
+
+# Database connection instance, created on first use (normally in the app lifespan)
+# so every process gets its own client on its own event loop
+settings: Optional[DatabaseSettings] = None
+client: Optional[AsyncIOMotorClient] = None
+db: Optional[AsyncIOMotorDatabase] = None
+
+def connect_to_mongo(database_settings: Optional[DatabaseSettings] = None) -> AsyncIOMotorDatabase:
+    """Create the Motor client if there is none yet and return the database"""
+    global settings, client, db
+    if client is None:
+        settings = database_settings or DatabaseSettings.from_env()
+        options = settings.client_options()
+        client = AsyncIOMotorClient(settings.url, event_listeners=[pool_stats], **options)
+        db = client[settings.name]
+        logger.info(
+            f"MongoDB client created (maxPoolSize={settings.max_pool_size}, "
+            f"minPoolSize={settings.min_pool_size}, compressors={options.get('compressors', 'none')})"
+        )
+    return db
+
+def get_client() -> AsyncIOMotorClient:
+    connect_to_mongo()
+    return client
 
 # Dependency to get the database
 async def get_database() -> AsyncIOMotorDatabase:
+    if db is None:
+        return connect_to_mongo()
     return db
 
 async def close_mongo_connection():
-    client.close()
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+
+def pool_statistics() -> dict:
+    """Pool settings and live CMAP counters of this process's client"""
+    return {
+        "max_pool_size": settings.max_pool_size if settings else None,
+        "min_pool_size": settings.min_pool_size if settings else None,
+        "max_idle_time_ms": settings.max_idle_time_ms if settings else None,
+        "connected": client is not None,
+        "pools": pool_stats.snapshot()
+    }
+
+_transactions_supported = None
+
+async def supports_transactions(db) -> bool:
+    """Multi-document transactions need a replica set or a sharded cluster.
+
+    Only a successful probe is cached; when ``hello`` fails (e.g. the server
+    is still starting) this call answers False and the next one asks again.
+    """
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = await db.client.admin.command("hello")
+        except Exception as e:
+            logger.warning(f"Could not probe MongoDB for transaction support: {e}")
+            return False
+        _transactions_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+    return _transactions_supported
+
+async def run_in_transaction(db, callback):
+    """Run ``callback(session)`` inside a multi-document transaction.
+
+    The driver retries the callback on transient errors. On a standalone server
+    the callback runs once with ``session=None`` and the writes are not atomic.
+    """
+    if not await supports_transactions(db):
+        return await callback(None)
+
+    async with await db.client.start_session() as session:
+        return await session.with_transaction(callback)
@@ -0,0 +1,85 @@
+import logging
+from pymongo import ASCENDING, DESCENDING
+
+logger = logging.getLogger(__name__)
+
+# (keys, create_index options) the query paths rely on, per collection.
+# create_index is a no-op when an identical index already exists, so this is
+# safe to run on every startup.
+INDEXES = {
+    "transactions": [
+        # Paginated history: one index per branch of the buyer/seller $or
+        ([("buyer_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("seller_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("domain_id", ASCENDING), ("status", ASCENDING)], {}),
+        # Escrow transactions opened for a payment
+        ([("payment_id", ASCENDING)], {"sparse": True}),
+    ],
+    "domains": [
+        # Stale reservation sweep
+        ([("status", ASCENDING), ("updated_at", ASCENDING)], {}),
+        # Cart reservations are claimed and released by cart_id
+        ([("cart_id", ASCENDING)], {"sparse": True}),
+    ],
+    "outbox": [
+        # Dispatch claims by (status, available_at); finished events expire after a week
+        ([("status", ASCENDING), ("available_at", ASCENDING)], {}),
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("processed_at", ASCENDING)], {"expireAfterSeconds": 7 * 24 * 3600}),
+    ],
+    "payment_transactions": [
+        ([("domain_id", ASCENDING), ("payment_status", ASCENDING)], {}),
+        # Paginated payment history: buyers, sellers, and sellers' cart items
+        ([("buyer_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("seller_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("items.seller_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        # Status reads and webhook updates look payments up by checkout session
+        ([("stripe_session_id", ASCENDING)], {}),
+        # Reconciliation streams old pending payments in (created_at, id) order
+        ([("payment_status", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {}),
+        # The reservation sweep expires cart payments by cart_id
+        ([("cart_id", ASCENDING)], {"sparse": True}),
+    ],
+    "checkout_idempotency": [
+        # Records expire at their own expires_at
+        ([("key", ASCENDING)], {"unique": True}),
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    "job_checkpoints": [
+        ([("id", ASCENDING)], {"unique": True}),
+    ],
+    "webhook_events": [
+        # Delivery dedupe; Stripe stops retrying after three days, so a month is plenty
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("received_at", ASCENDING)], {"expireAfterSeconds": 30 * 24 * 3600}),
+    ],
+    "two_factor_auth": [
+        # One enrollment per user; also the $lookup target of the principal load
+        ([("user_id", ASCENDING)], {"unique": True}),
+    ],
+    "totp_used_codes": [
+        # TOTP replay guard: one claim per (user, time step), dropped once the step expires
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    "user_stats": [
+        # One counters document per user; $merge in the rebuild needs it unique
+        ([("user_id", ASCENDING)], {"unique": True}),
+    ],
+    "transaction_chats": [
+        # Incremental chat fetch and stream resume
+        ([("transaction_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)], {}),
+    ],
+    "fake_checkout_sessions": [
+        # Sessions of the fake checkout provider, shared by all workers; purged after a week
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("created_at", ASCENDING)], {"expireAfterSeconds": 7 * 24 * 3600}),
+    ],
+}
+
+async def ensure_indexes(db):
+    """Create the indexes listed in INDEXES"""
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            await db[collection].create_index(keys, **options)
+    logger.info("MongoDB indexes ensured")
@@ -3,7 +3,8 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import List, Optional
 from ..models.domain import Domain, DomainCreate
 from ..models.user import User
-from ..config.database import get_database
+from ..config.database import get_database, run_in_transaction
+from ..utils.events import event_bus
 from datetime import datetime
 
 async def create_domain(domain_data: DomainCreate, current_user: User, db):
@@ -25,14 +26,17 @@ async def create_domain(domain_data: DomainCreate, current_user: User, db):
         description=domain_data.description
     )
     
-    # Insert domain into database
-    await db.domains.insert_one(domain.dict())
+    # Insert domain into database; the domain.created handler adds it to the
+    # seller's domains_for_sale list
+    async def insert(session):
+        await db.domains.insert_one(domain.dict(), session=session)
+        await event_bus.publish(db, "domain.created", {
+            "domain_id": domain.id,
+            "seller_id": current_user.id,
+            "price": domain.price
+        }, session=session)
     
-    # Update user's domains_for_sale list
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$push": {"domains_for_sale": domain.id}}
-    )
+    await run_in_transaction(db, insert)
     
     return domain
 
@@ -78,10 +82,10 @@ async def get_domain_by_id(domain_id: str, db):
             detail="Domain not found"
         )
     
-    # Increment view count
+    # Increment view count (a view is not an edit, so updated_at stays as is)
     await db.domains.update_one(
         {"id": domain_id},
-        {"$inc": {"views": 1}, "$set": {"updated_at": datetime.utcnow()}}
+        {"$inc": {"views": 1}}
     )
     
     domain_data = await db.domains.find_one({"id": domain_id})
@@ -99,10 +103,10 @@ async def get_domain_by_name(name: str, extension: str, db):
             detail="Domain not found"
         )
     
-    # Increment view count
+    # Increment view count (a view is not an edit, so updated_at stays as is)
     await db.domains.update_one(
         {"id": domain_data["id"]},
-        {"$inc": {"views": 1}, "$set": {"updated_at": datetime.utcnow()}}
+        {"$inc": {"views": 1}}
     )
     
     domain_data = await db.domains.find_one({"id": domain_data["id"]})
@@ -0,0 +1,283 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import AsyncIterator
+from fastapi import HTTPException, status
+from pymongo import UpdateOne
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from ..models.payment import EscrowBatchRequest
+
+logger = logging.getLogger(__name__)
+
+ESCROW_BATCH_SIZE = int(os.environ.get('ESCROW_BATCH_SIZE', '500'))
+
+# Batch action -> the status a paid payment (or cart line item) moves to
+ESCROW_ACTIONS = {"release": "released_to_seller", "refund": "refund_pending"}
+
+def settled_cart_status(items: list) -> str:
+    """Payment status of a cart whose line items were all settled"""
+    statuses = {item.get("escrow_status") for item in items}
+    if len(statuses) == 1:
+        return statuses.pop()
+    return "partially_refunded"
+
+def escrow_eligible(action: str, transaction_status) -> bool:
+    """Release only once the escrow transaction completed; never refund a completed one"""
+    if action == "release":
+        return transaction_status == "completed"
+    return transaction_status != "completed"
+
+def escrow_checkpoint_id(batch_id: str) -> str:
+    return f"escrow_batch:{batch_id}"
+
+def escrow_batch_fingerprint(request: EscrowBatchRequest) -> str:
+    """Hash of what a batch does, so a reused batch_id cannot silently change it"""
+    fields = request.dict(exclude={"batch_id", "max_payments"})
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+async def open_escrow_batch(db: AsyncIOMotorDatabase, request: EscrowBatchRequest) -> AsyncIterator[dict]:
+    """Validate an escrow batch and return the iterator that processes it.
+
+    Checks happen here, before anything is streamed, so they can still fail
+    the request: an unknown action or a batch_id reused for a different
+    selection or action is rejected.
+    """
+    if request.action not in ESCROW_ACTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"action must be one of: {', '.join(ESCROW_ACTIONS)}"
+        )
+    if not request.payment_ids and not (request.buyer_id or request.seller_id or request.paid_before):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Select payments by payment_ids, buyer_id, seller_id or paid_before"
+        )
+
+    batch_id = request.batch_id or str(uuid.uuid4())
+    fingerprint = escrow_batch_fingerprint(request)
+    checkpoint = await db.job_checkpoints.find_one({"id": escrow_checkpoint_id(batch_id)}, {"_id": 0})
+    if checkpoint and checkpoint.get("fingerprint") != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="batch_id was already used for a different escrow batch"
+        )
+
+    return run_escrow_batch(db, request, batch_id, fingerprint, checkpoint)
+
+async def run_escrow_batch(
+    db: AsyncIOMotorDatabase,
+    request: EscrowBatchRequest,
+    batch_id: str,
+    fingerprint: str,
+    checkpoint: dict = None,
+    batch_size: int = ESCROW_BATCH_SIZE
+) -> AsyncIterator[dict]:
+    """Move the selected payments out of escrow, yielding one result per settlement and a summary.
+
+    Payments are read in (created_at, id) order and applied ``batch_size``
+    at a time with one conditional bulk_write, so only payments still
+    ``paid`` change. A release needs the payment's escrow transaction to be
+    completed, and a refund one that is not. Cart payments are settled per
+    line item (only the selected seller's items with a seller_id filter),
+    each against its own escrow transaction; the cart's payment status
+    follows once every item is settled. Every change is stamped with the
+    batch id; results are ``applied`` (now or by an earlier run of this
+    batch) or ``skipped`` with the current status. A checkpoint after every
+    bulk write lets a rerun with the same batch_id continue where it
+    stopped; a finished batch only reports its summary again.
+    """
+    started = time.perf_counter()
+    target_status = ESCROW_ACTIONS[request.action]
+    checkpoint_id = escrow_checkpoint_id(batch_id)
+    stats = (checkpoint or {}).get("stats") or {"applied": 0, "skipped": 0}
+
+    if checkpoint and checkpoint.get("status") == "completed":
+        yield {"summary": {"batch_id": batch_id, "action": request.action, **stats, "completed": True}}
+        return
+
+    if request.payment_ids:
+        # Explicit payments are reported whatever their status
+        query = {"id": {"$in": request.payment_ids}}
+    else:
+        query = {"payment_status": "paid"}
+        if request.buyer_id:
+            query["buyer_id"] = request.buyer_id
+        if request.seller_id:
+            # Cart payments name their sellers per line item; carts whose items of
+            # this seller are all settled are done for this selection
+            query["$and"] = [{"$or": [
+                {"seller_id": request.seller_id},
+                {"items": {"$elemMatch": {"seller_id": request.seller_id, "escrow_status": None}}}
+            ]}]
+        if request.paid_before:
+            query["completed_at"] = {"$lt": request.paid_before}
+    if checkpoint and checkpoint.get("last_id"):
+        query["$or"] = [
+            {"created_at": {"$gt": checkpoint["last_created_at"]}},
+            {"created_at": checkpoint["last_created_at"], "id": {"$gt": checkpoint["last_id"]}}
+        ]
+
+    # max_payments bounds this run; the next run of the batch picks up after it
+    remaining = request.max_payments
+
+    completed = True
+    while True:
+        limit = batch_size if remaining is None else min(batch_size, remaining)
+        if limit <= 0:
+            # The batch is done unless the selection has payments beyond this run
+            completed = await db.payment_transactions.find_one(query, {"_id": 1}) is None
+            break
+
+        batch = await db.payment_transactions.find(
+            query, {"_id": 0, "id": 1, "created_at": 1, "payment_status": 1, "items": 1}
+        ).sort([("created_at", 1), ("id", 1)]).limit(limit).to_list(length=limit)
+        if not batch:
+            break
+
+        # Escrow transaction status per payment, and per line item for carts
+        transactions = await db.transactions.find(
+            {"payment_id": {"$in": [payment["id"] for payment in batch]}},
+            {"_id": 0, "payment_id": 1, "domain_id": 1, "status": 1}
+        ).to_list(length=None)
+        transaction_status = {}
+        for transaction in transactions:
+            transaction_status[transaction["payment_id"]] = transaction["status"]
+            transaction_status[(transaction["payment_id"], transaction["domain_id"])] = transaction["status"]
+
+        def selected_items(payment: dict) -> list:
+            if request.seller_id and not request.payment_ids:
+                return [item for item in payment["items"] if item.get("seller_id") == request.seller_id]
+            return payment["items"]
+
+        now = datetime.utcnow()
+        updates = []
+        for payment in batch:
+            if payment["payment_status"] != "paid":
+                continue
+            if not payment.get("items"):
+                if escrow_eligible(request.action, transaction_status.get(payment["id"])):
+                    updates.append(UpdateOne(
+                        {"id": payment["id"], "payment_status": "paid"},
+                        {"$set": {
+                            "payment_status": target_status,
+                            "escrow_batch_id": batch_id,
+                            "updated_at": now
+                        }}
+                    ))
+                continue
+            for item in selected_items(payment):
+                if item.get("escrow_status") or not escrow_eligible(
+                    request.action, transaction_status.get((payment["id"], item["domain_id"]))
+                ):
+                    continue
+                updates.append(UpdateOne(
+                    {"id": payment["id"], "payment_status": "paid",
+                     "items": {"$elemMatch": {"domain_id": item["domain_id"], "escrow_status": None}}},
+                    {"$set": {
+                        "items.$.escrow_status": target_status,
+                        "items.$.escrow_batch_id": batch_id,
+                        "updated_at": now
+                    }}
+                ))
+        if updates:
+            await db.payment_transactions.bulk_write(updates, ordered=False)
+
+        # Read the outcome back: a settlement counts as applied if this batch made it,
+        # including in an earlier run that stopped before its checkpoint
+        outcomes = await db.payment_transactions.find(
+            {"id": {"$in": [payment["id"] for payment in batch]}},
+            {"_id": 0, "id": 1, "payment_status": 1, "escrow_batch_id": 1, "items": 1}
+        ).to_list(length=None)
+        outcomes = {outcome["id"]: outcome for outcome in outcomes}
+
+        # Carts whose last item was just settled leave escrow as a whole
+        finished = [
+            UpdateOne(
+                {"id": outcome["id"], "payment_status": "paid"},
+                {"$set": {"payment_status": settled_cart_status(outcome["items"]), "updated_at": now}}
+            )
+            for outcome in outcomes.values()
+            if outcome["payment_status"] == "paid" and outcome.get("items")
+            and all(item.get("escrow_status") for item in outcome["items"])
+        ]
+        if finished:
+            await db.payment_transactions.bulk_write(finished, ordered=False)
+
+        for payment in batch:
+            outcome = outcomes.get(payment["id"], payment)
+            if not payment.get("items"):
+                applied = outcome.get("escrow_batch_id") == batch_id and outcome["payment_status"] == target_status
+                stats["applied" if applied else "skipped"] += 1
+                result = {
+                    "payment_id": payment["id"],
+                    "result": "applied" if applied else "skipped",
+                    "payment_status": outcome["payment_status"]
+                }
+                if not applied:
+                    result["transaction_status"] = transaction_status.get(payment["id"])
+                yield result
+                continue
+            settled = {item["domain_id"]: item for item in outcome.get("items") or []}
+            for item in selected_items(payment):
+                item = settled.get(item["domain_id"], item)
+                applied = item.get("escrow_batch_id") == batch_id and item.get("escrow_status") == target_status
+                stats["applied" if applied else "skipped"] += 1
+                result = {
+                    "payment_id": payment["id"],
+                    "domain_id": item["domain_id"],
+                    "result": "applied" if applied else "skipped",
+                    "escrow_status": item.get("escrow_status")
+                }
+                if not applied:
+                    result["transaction_status"] = transaction_status.get((payment["id"], item["domain_id"]))
+                yield result
+
+        last = batch[-1]
+        await db.job_checkpoints.update_one(
+            {"id": checkpoint_id},
+            {"$set": {
+                "fingerprint": fingerprint,
+                "status": "running",
+                "last_created_at": last["created_at"],
+                "last_id": last["id"],
+                "stats": stats,
+                "updated_at": now
+            }},
+            upsert=True
+        )
+        query["$or"] = [
+            {"created_at": {"$gt": last["created_at"]}},
+            {"created_at": last["created_at"], "id": {"$gt": last["id"]}}
+        ]
+        if remaining is not None:
+            remaining -= len(batch)
+        if len(batch) < limit:
+            break
+
+    await db.job_checkpoints.update_one(
+        {"id": checkpoint_id},
+        {"$set": {
+            "fingerprint": fingerprint,
+            "status": "completed" if completed else "running",
+            "stats": stats,
+            "updated_at": datetime.utcnow()
+        }},
+        upsert=True
+    )
+
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(
+        f"Escrow batch {batch_id} ({request.action}): {stats['applied']} applied, "
+        f"{stats['skipped']} skipped in {duration_ms} ms"
+    )
+    yield {"summary": {
+        "batch_id": batch_id,
+        "action": request.action,
+        **stats,
+        "completed": completed,
+        "duration_ms": duration_ms
+    }}
@@ -0,0 +1,242 @@
+import logging
+from datetime import datetime
+from collections import Counter
+from pymongo import ReturnDocument, UpdateOne
+from ..models.transaction import Transaction
+from ..utils.events import EventBus
+from .transaction_controller import chat_topic, serialize_mongo_doc
+from ..utils.pubsub import hub
+from . import payment_controller, stats_controller
+
+logger = logging.getLogger(__name__)
+
+# Handlers run at least once per event, so every write below is idempotent.
+
+async def post_system_message(db, transaction_id: str, message_id: str, text: str):
+    """Add a bot message to the transaction chat unless it was already posted"""
+    message = {
+        "id": message_id,
+        "transaction_id": transaction_id,
+        "user_id": None,
+        "username": "DNGun Bot",
+        "message": text,
+        "sender_type": "bot",
+        "timestamp": datetime.utcnow()
+    }
+    result = await db.transaction_chats.update_one(
+        {"id": message_id},
+        {"$setOnInsert": message},
+        upsert=True
+    )
+    if result.upserted_id is not None:
+        hub.publish(chat_topic(transaction_id), serialize_mongo_doc(message))
+
+async def add_domain_to_seller_listings(db, event: dict):
+    payload = event["payload"]
+    await db.users.update_one(
+        {"id": payload["seller_id"]},
+        {"$addToSet": {"domains_for_sale": payload["domain_id"]}}
+    )
+
+def held_for(payload: dict) -> dict:
+    """Filter matching domains still reserved for the paid checkout"""
+    if payload.get("cart_id"):
+        return {"status": "pending", "cart_id": payload["cart_id"]}
+    # Checkouts opened before single domains were held
+    return {"status": "available"}
+
+async def refund_unfulfilled_payment(db, payload: dict):
+    """The payment went through but its reservation was lost; the buyer gets the money back"""
+    logger.warning(f"Payment {payload['payment_id']} lost its reservation before it was paid; refund pending")
+    await db.payment_transactions.update_one(
+        {"id": payload["payment_id"], "payment_status": "paid"},
+        {"$set": {
+            "payment_status": "refund_pending",
+            "refund_reason": "reservation_lost",
+            "updated_at": datetime.utcnow()
+        }}
+    )
+    payment_controller.payment_status_cache.pop(payload["session_id"])
+
+async def mark_paid_domain_sold(db, event: dict):
+    """Sell the domain of a paid checkout if it is still held for it, otherwise refund"""
+    payload = event["payload"]
+    if not payload.get("domain_id"):
+        return
+    result = await db.domains.update_one(
+        {"id": payload["domain_id"], **held_for(payload)},
+        {"$set": {"status": "sold", "sold_payment_id": payload["payment_id"], "updated_at": datetime.utcnow()},
+         "$unset": {"cart_id": ""}}
+    )
+    if result.modified_count:
+        await stats_controller.apply_stats(db, payload.get("seller_id"), {"listings": -1}, f"{event['id']}:sold")
+    elif not await db.domains.find_one({"id": payload["domain_id"], "sold_payment_id": payload["payment_id"]}, {"_id": 1}):
+        await refund_unfulfilled_payment(db, payload)
+
+async def open_escrow_transaction(db, event: dict):
+    """Create the escrow transaction for a paid checkout and tell both parties"""
+    payload = event["payload"]
+    if not (payload.get("domain_id") and payload.get("buyer_id") and payload.get("seller_id")):
+        # Anonymous checkouts have no buyer account to attach an escrow to
+        return
+    if not await db.domains.find_one({"id": payload["domain_id"], "sold_payment_id": payload["payment_id"]}, {"_id": 1}):
+        # Not sold to this payment; it is being refunded
+        return
+
+    transaction = Transaction(
+        domain_id=payload["domain_id"],
+        buyer_id=payload["buyer_id"],
+        seller_id=payload["seller_id"],
+        amount=payload["amount"],
+        payment_method="stripe_checkout",
+        transaction_fee=round(payload["amount"] * 0.1, 2)
+    )
+    transaction_data = await db.transactions.find_one_and_update(
+        {"payment_id": payload["payment_id"]},
+        {"$setOnInsert": {**transaction.dict(), "payment_id": payload["payment_id"]}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    await stats_controller.apply_party_stats(db, [payload], {
+        "buyer": {"pending_deals": 1},
+        "seller": {"pending_deals": 1}
+    }, f"{event['id']}:escrow")
+
+    await db.payment_transactions.update_one(
+        {"id": payload["payment_id"]},
+        {"$set": {"transaction_id": transaction_data["id"]}}
+    )
+
+    await post_system_message(
+        db,
+        transaction_data["id"],
+        f"payment-completed-{payload['payment_id']}",
+        f"Payment of ${payload['amount']:.2f} for {payload.get('domain_name') or 'the domain'} received and held in escrow. "
+        "The seller can now start the domain transfer."
+    )
+
+async def mark_paid_cart_domains_sold(db, event: dict):
+    """Sell every domain of a paid cart with one update; all of them or, if a hold was lost, none"""
+    payload = event["payload"]
+    if not payload.get("items"):
+        return
+    domain_ids = [item["domain_id"] for item in payload["items"]]
+    await db.domains.update_many(
+        {"id": {"$in": domain_ids}, **held_for(payload)},
+        {"$set": {"status": "sold", "sold_payment_id": payload["payment_id"], "updated_at": datetime.utcnow()},
+         "$unset": {"cart_id": ""}}
+    )
+    sold = await db.domains.count_documents({"id": {"$in": domain_ids}, "sold_payment_id": payload["payment_id"]})
+    if sold < len(domain_ids):
+        # Part of the cart went elsewhere; give back what was sold and refund the whole payment
+        await db.domains.update_many(
+            {"id": {"$in": domain_ids}, "sold_payment_id": payload["payment_id"]},
+            {"$set": {"status": "available", "updated_at": datetime.utcnow()}, "$unset": {"sold_payment_id": ""}}
+        )
+        await refund_unfulfilled_payment(db, payload)
+        return
+    
+    # Deduplicated per seller, so a redelivery does not count the sales twice
+    listings_sold = Counter(item["seller_id"] for item in payload["items"])
+    for seller_id, count in listings_sold.items():
+        await stats_controller.apply_stats(db, seller_id, {"listings": -count}, f"{event['id']}:sold:{seller_id}")
+
+async def open_cart_escrow_transactions(db, event: dict):
+    """Create one escrow transaction per domain of a paid cart and tell both parties"""
+    payload = event["payload"]
+    if not (payload.get("items") and payload.get("buyer_id")):
+        return
+
+    if await db.domains.count_documents(
+        {"id": {"$in": [item["domain_id"] for item in payload["items"]]}, "sold_payment_id": payload["payment_id"]}
+    ) < len(payload["items"]):
+        # The cart was not sold to this payment; it is being refunded
+        return
+
+    items = [item for item in payload["items"] if item.get("seller_id")]
+    operations = []
+    for item in items:
+        transaction = Transaction(
+            domain_id=item["domain_id"],
+            buyer_id=payload["buyer_id"],
+            seller_id=item["seller_id"],
+            amount=item["amount"],
+            payment_method="stripe_checkout",
+            transaction_fee=round(item["amount"] * 0.1, 2)
+        )
+        operations.append(UpdateOne(
+            {"payment_id": payload["payment_id"], "domain_id": item["domain_id"]},
+            {"$setOnInsert": {**transaction.dict(), "payment_id": payload["payment_id"]}},
+            upsert=True
+        ))
+    if not operations:
+        return
+    await db.transactions.bulk_write(operations, ordered=False)
+
+    transactions = await db.transactions.find(
+        {"payment_id": payload["payment_id"]},
+        {"_id": 0, "id": 1, "domain_id": 1, "buyer_id": 1, "seller_id": 1}
+    ).to_list(length=None)
+    await stats_controller.apply_party_stats(db, transactions, {
+        "buyer": {"pending_deals": 1},
+        "seller": {"pending_deals": 1}
+    }, f"{event['id']}:escrow")
+
+    names = {item["domain_id"]: item["domain_name"] for item in items}
+    for transaction in transactions:
+        await post_system_message(
+            db,
+            transaction["id"],
+            f"payment-completed-{payload['payment_id']}-{transaction['domain_id']}",
+            f"Payment for {names.get(transaction['domain_id'], 'the domain')} received as part of a cart and held in escrow. "
+            "The seller can now start the domain transfer."
+        )
+
+async def expire_checkout_sessions(db, event: dict):
+    """Expire the provider sessions of payments whose reservation was released.
+
+    A session the provider will not expire was paid before the sweep got to
+    it; that payment is recorded like a late webhook would, which queues
+    its refund since the hold is gone.
+    Provider errors fail the event so the outbox retries it.
+    """
+    provider = payment_controller.payment_client.provider
+    if provider is None:
+        return
+    for payment in event["payload"]["payments"]:
+        session_id = payment.get("stripe_session_id")
+        if not session_id or payment.get("payment_method") != provider.payment_method:
+            # Mock sessions only exist locally
+            continue
+        if await payment_controller.payment_client.expire_checkout_session(session_id):
+            continue
+        checkout_status = await payment_controller.payment_client.get_checkout_status(session_id)
+        if checkout_status.payment_status == "paid":
+            logger.warning(f"Checkout session {session_id} was paid after its reservation expired")
+            await payment_controller.PaymentController.mark_payment_paid(session_id, db)
+
+async def notify_transaction_completed(db, event: dict):
+    payload = event["payload"]
+    await post_system_message(
+        db,
+        payload["transaction_id"],
+        f"transaction-completed-{payload['transaction_id']}",
+        "The seller confirmed the transfer. This transaction is complete."
+    )
+
+def register_event_handlers(bus: EventBus):
+    bus.register("domain.created", add_domain_to_seller_listings)
+    bus.register("payment.completed", mark_paid_domain_sold)
+    bus.register("payment.completed", open_escrow_transaction)
+    bus.register("payment.completed", mark_paid_cart_domains_sold)
+    bus.register("payment.completed", open_cart_escrow_transactions)
+    bus.register("transaction.completed", notify_transaction_completed)
+    bus.register("payments.expired", expire_checkout_sessions)
+    
+    # Keep user_stats counters in step
+    bus.register("domain.created", stats_controller.count_new_listing)
+    bus.register("transaction.created", stats_controller.count_opened_deal)
+    bus.register("transaction.completed", stats_controller.count_completed_deal)
+    bus.register("transactions.expired", stats_controller.count_expired_deals)
+    bus.register("transaction.status_changed", stats_controller.count_status_change)
+    bus.register("payment.completed", stats_controller.count_payment)
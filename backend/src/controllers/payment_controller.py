@@ -3,42 +3,512 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Optional
 import os
 from datetime import datetime
-
-from emergentintegrations.payments.stripe.checkout import (
-    StripeCheckout, 
-    CheckoutSessionResponse, 
-    CheckoutStatusResponse, 
-    CheckoutSessionRequest
-)
+import hashlib
+import json
+import uuid
+import logging
+import time
+from datetime import timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 from ..models.payment import (
     PaymentTransaction, 
     PaymentTransactionCreate,
     StripeCheckoutRequest,
     StripeCheckoutResponse,
-    PaymentStatusResponse
+    PaymentStatusResponse,
+    CheckoutSessionRequest,
+    CheckoutSessionResponse,
+    CheckoutStatusResponse,
+    CartItem,
+    CartCheckoutRequest,
+    CartCheckoutResponse,
+    PaymentSummary
 )
 from ..models.domain import Domain
 from ..models.user import User
-from ..config.database import get_database
+from ..config.database import get_database, run_in_transaction
 from ..controllers.domain_controller import get_domain_by_id
+from ..controllers.reservation_controller import reserve_cart_domains, release_cart_reservations
+from ..utils.events import event_bus
+from ..utils.pagination import encode_cursor, before_cursor_filter, page_sort, merge_descending
+from ..utils.webhooks import verify_signature
+from ..utils.cache import TTLCache
+from ..utils.singleflight import SingleFlight
+from ..utils.pubsub import hub
+from ..utils.circuit_breaker import CircuitBreaker
+from ..utils.security import derive_secret
+from ..utils.payment_client import PaymentProviderClient, PaymentProviderError
+from ..utils.payment_providers import StripeCheckoutProvider, FakeCheckoutProvider
+
+logger = logging.getLogger(__name__)
 
 # Initialize Stripe
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY', 'sk_test_placeholder')
 
-# Only initialize Stripe if we have a valid key
-if STRIPE_API_KEY and STRIPE_API_KEY != 'sk_test_placeholder' and not STRIPE_API_KEY.endswith('_key'):
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY)
+# With a webhook secret configured, Stripe pushes payment state to us and
+# status reads are served from the local record
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+STRIPE_WEBHOOK_TOLERANCE_SECONDS = float(os.environ.get('STRIPE_WEBHOOK_TOLERANCE_SECONDS', '300'))
+
+STRIPE_CONFIGURED = bool(
+    STRIPE_API_KEY and STRIPE_API_KEY != 'sk_test_placeholder' and not STRIPE_API_KEY.endswith('_key')
+)
+
+# Checkout provider: stripe, or fake for local runs, integration tests and load tests.
+# The fake is opt-in (PAYMENT_PROVIDER=fake); stripe without a valid key leaves no
+# provider configured, which degraded mode below covers.
+PAYMENT_PROVIDER = os.environ.get('PAYMENT_PROVIDER', 'stripe')
+
+if PAYMENT_PROVIDER == 'fake':
+    # The fake signs its webhooks like Stripe, so it always runs in webhook mode.
+    # Its sessions are stored in MongoDB once the app has connected (see server.py).
+    STRIPE_WEBHOOK_SECRET = STRIPE_WEBHOOK_SECRET or derive_secret("fake-checkout-webhooks")
+    checkout_provider = FakeCheckoutProvider(
+        latency_ms=float(os.environ.get('FAKE_CHECKOUT_LATENCY_MS', '0')),
+        failure_rate=float(os.environ.get('FAKE_CHECKOUT_FAILURE_RATE', '0')),
+        webhook_secret=STRIPE_WEBHOOK_SECRET,
+        # Unset: webhooks are handled in process (see deliver_fake_webhook)
+        webhook_url=os.environ.get('FAKE_CHECKOUT_WEBHOOK_URL') or None,
+        webhook_delay_ms=float(os.environ.get('FAKE_CHECKOUT_WEBHOOK_DELAY_MS', '0'))
+    )
+    print("⚠️  WARNING: Using the fake checkout provider. No real payments will be taken.")
+elif PAYMENT_PROVIDER == 'stripe' and STRIPE_CONFIGURED:
+    checkout_provider = StripeCheckoutProvider(STRIPE_API_KEY)
 else:
-    stripe_checkout = None
+    checkout_provider = None
     print("⚠️  WARNING: Stripe API key not configured properly. Payment functionality will be limited.")
 
+# All provider calls go through the guarded client
+payment_client = PaymentProviderClient(
+    checkout_provider,
+    create_timeout=float(os.environ.get('PAYMENT_CREATE_TIMEOUT_SECONDS', '10')),
+    status_timeout=float(os.environ.get('PAYMENT_STATUS_TIMEOUT_SECONDS', '5')),
+    max_concurrency=int(os.environ.get('PAYMENT_MAX_CONCURRENCY', '20')),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get('PAYMENT_BREAKER_FAILURES', '5')),
+        recovery_timeout=float(os.environ.get('PAYMENT_BREAKER_RESET_SECONDS', '30'))
+    )
+)
+
+async def deliver_fake_webhook(payload: bytes, signature: str):
+    """In-process webhook delivery for the fake provider"""
+    db = await get_database()
+    await PaymentController.handle_stripe_webhook(payload, signature, db)
+
+if isinstance(checkout_provider, FakeCheckoutProvider) and checkout_provider.webhook_url is None:
+    checkout_provider.webhook_handler = deliver_fake_webhook
+
+# What to do when the provider cannot be used:
+#   off   - fail with 503 (status reads too)
+#   local - fail checkouts with 503, answer status reads from the local record
+#   mock  - hand out mock checkout sessions and answer status reads locally
+# Defaults to mock only when no provider is configured, i.e. stripe without a
+# valid key (local demo setups); with a real or fake provider it defaults to off.
+PAYMENT_DEGRADED_MODE = os.environ.get('PAYMENT_DEGRADED_MODE', 'mock' if checkout_provider is None else 'off')
+
+# History pages load only what PaymentSummary shows unless details are asked for
+PAYMENT_SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in PaymentSummary.__fields__}}
+
+# Upper bound on domains bought through one cart checkout
+CART_MAX_DOMAINS = int(os.environ.get('CART_MAX_DOMAINS', '100'))
+
+# Statuses a payment can only reach after it was paid
+POST_PAYMENT_STATUSES = ["paid", "released_to_seller", "refund_pending", "partially_refunded"]
+
+# Statuses of payments closed unpaid; their reservations have been released
+CLOSED_PAYMENT_STATUSES = ["expired", "canceled", "failed"]
+
+# Statuses that never change again through Stripe, so they are always served from the local record
+TERMINAL_PAYMENT_STATUSES = POST_PAYMENT_STATUSES + CLOSED_PAYMENT_STATUSES
+
+PAYMENT_STATUS_CACHE_TTL = float(os.environ.get('PAYMENT_STATUS_CACHE_TTL', '3'))
+
+# session id -> PaymentStatusResponse for payments still in flight
+payment_status_cache = TTLCache(maxsize=10000, ttl=PAYMENT_STATUS_CACHE_TTL)
+payment_status_flight = SingleFlight()
+
+# Explicit Idempotency-Key responses are replayed for a day, like Stripe's own keys
+CHECKOUT_IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('CHECKOUT_IDEMPOTENCY_TTL_SECONDS', '86400'))
+# A signed-in buyer's open session for a domain is reused for this long
+CHECKOUT_REUSE_WINDOW_SECONDS = float(os.environ.get('CHECKOUT_REUSE_WINDOW_SECONDS', '1800'))
+# How long a claimed key blocks duplicates while its session is being created
+CHECKOUT_IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get('CHECKOUT_IDEMPOTENCY_LEASE_SECONDS', '30'))
+CHECKOUT_IDEMPOTENCY_CACHE_TTL = float(os.environ.get('CHECKOUT_IDEMPOTENCY_CACHE_TTL', '60'))
+
+# idempotency key -> completed checkout_idempotency record
+checkout_idempotency_cache = TTLCache(maxsize=10000, ttl=CHECKOUT_IDEMPOTENCY_CACHE_TTL)
+
+PAYMENT_STREAM_POLL_SECONDS = float(os.environ.get('PAYMENT_STREAM_POLL_SECONDS', '3'))
+PAYMENT_STREAM_MAX_SECONDS = float(os.environ.get('PAYMENT_STREAM_MAX_SECONDS', '600'))
+
+# Checkout session events the webhook acts on; everything else is acknowledged and ignored
+STRIPE_PAID_EVENTS = ["checkout.session.completed", "checkout.session.async_payment_succeeded"]
+STRIPE_CLOSED_EVENTS = {
+    "checkout.session.expired": "expired",
+    "checkout.session.async_payment_failed": "failed"
+}
+
+def payment_status_from_record(payment_record: dict) -> PaymentStatusResponse:
+    return PaymentStatusResponse(
+        payment_id=payment_record["id"],
+        stripe_session_id=payment_record["stripe_session_id"],
+        payment_status=payment_record["payment_status"],
+        stripe_payment_status=payment_record.get("stripe_payment_status", "unpaid"),
+        amount=payment_record["amount"],
+        currency=payment_record["currency"],
+        domain_name=payment_record.get("domain_name"),
+        created_at=payment_record["created_at"],
+        completed_at=payment_record.get("completed_at"),
+        metadata=payment_record.get("metadata")
+    )
+
+def seller_share(payment: dict, seller_id: str) -> dict:
+    """A cart payment as one of its sellers sees it: their line items, with their total as amount"""
+    items = [item for item in payment["items"] if item.get("seller_id") == seller_id]
+    share = {**payment, "items": items, "amount": round(sum(item["amount"] for item in items), 2)}
+    if len(items) == 1:
+        share.update(domain_id=items[0]["domain_id"], domain_name=items[0]["domain_name"])
+    else:
+        share["domain_name"] = f"{len(items)} domains"
+    return share
+
+def provider_unavailable(error: PaymentProviderError, action: str) -> HTTPException:
+    if error.reason == "provider_error":
+        return HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Failed to {action}: {error}"
+        )
+    headers = {"Retry-After": str(max(1, int(error.retry_after)))} if error.retry_after else None
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"Payment service unavailable: {error}",
+        headers=headers
+    )
+
+def checkout_fingerprint(request: StripeCheckoutRequest) -> str:
+    """Hash of the parameters that decide which checkout session a request gets"""
+    fields = {
+        "domain_id": request.domain_id,
+        "amount": request.amount,
+        "currency": request.currency,
+        "origin_url": request.origin_url
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+async def insert_held_payment(db, payment_transaction: PaymentTransaction):
+    """Insert a checkout's payment record, releasing its hold if that fails"""
+    try:
+        await db.payment_transactions.insert_one(payment_transaction.dict())
+    except Exception:
+        # No payment will ever buy the domains through this hold
+        await release_cart_reservations(db, [payment_transaction.cart_id])
+        raise
+
+def payment_topic(session_id: str) -> str:
+    return f"payment_status:{session_id}"
+
+def publish_payment_status(payment_record: dict):
+    """Push a payment's current status to clients streaming it"""
+    hub.publish(payment_topic(payment_record["stripe_session_id"]), payment_status_from_record(payment_record))
+
 class PaymentController:
     
+    @staticmethod
+    async def mark_payment_paid(
+        session_id: str,
+        db = None,
+        stripe_payment_status: str = "paid",
+        session = None
+    ) -> Optional[dict]:
+        """Move a pending payment to paid and queue its side effects in the same transaction.
+        
+        A payment closed in the meantime has lost its reservation, so the money
+        it took is marked for refund instead (refund_pending). Pass ``session``
+        to join a transaction the caller already started. Returns the updated
+        record, or None if the payment was already paid.
+        """
+        async def apply(session):
+            now = datetime.utcnow()
+            payment_record = await db.payment_transactions.find_one_and_update(
+                {"stripe_session_id": session_id, "payment_status": "pending"},
+                {"$set": {
+                    "payment_status": "paid",
+                    "stripe_payment_status": stripe_payment_status,
+                    "completed_at": now,
+                    "updated_at": now
+                }},
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+            if payment_record:
+                if payment_record.get("cart_id"):
+                    # Restart the hold clock so the reservation sweep keeps the domains
+                    # until the handlers below have sold them
+                    await db.domains.update_many(
+                        {"cart_id": payment_record["cart_id"], "status": "pending"},
+                        {"$set": {"updated_at": now}},
+                        session=session
+                    )
+                # Domain status, escrow record and bot notification are handled
+                # by the payment.completed event handlers
+                await event_bus.publish(db, "payment.completed", {
+                    "payment_id": payment_record["id"],
+                    "session_id": session_id,
+                    "domain_id": payment_record.get("domain_id"),
+                    "domain_name": payment_record.get("domain_name"),
+                    "buyer_id": payment_record.get("buyer_id"),
+                    "seller_id": payment_record.get("seller_id"),
+                    "amount": payment_record["amount"],
+                    "currency": payment_record["currency"],
+                    "cart_id": payment_record.get("cart_id"),
+                    "items": payment_record.get("items")
+                }, session=session)
+                return payment_record
+            
+            payment_record = await db.payment_transactions.find_one_and_update(
+                {"stripe_session_id": session_id, "payment_status": {"$in": CLOSED_PAYMENT_STATUSES}},
+                {"$set": {
+                    "payment_status": "refund_pending",
+                    "refund_reason": "paid_after_close",
+                    "stripe_payment_status": stripe_payment_status,
+                    "completed_at": now,
+                    "updated_at": now
+                }},
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+            if payment_record:
+                logger.warning(f"Checkout session {session_id} was paid after its payment was closed; refund pending")
+            return payment_record
+        
+        if session is not None:
+            return await apply(session)
+        payment_record = await run_in_transaction(db, apply)
+        payment_status_cache.pop(session_id)
+        if payment_record:
+            publish_payment_status(payment_record)
+        return payment_record
+    
+    @staticmethod
+    async def handle_stripe_webhook(
+        payload: bytes,
+        signature: Optional[str],
+        db = None
+    ) -> dict:
+        """Verify and apply a Stripe webhook delivery exactly once per event id"""
+        
+        if not STRIPE_WEBHOOK_SECRET:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Webhooks not configured. Please set STRIPE_WEBHOOK_SECRET environment variable."
+            )
+        
+        if not verify_signature(payload, signature, STRIPE_WEBHOOK_SECRET, STRIPE_WEBHOOK_TOLERANCE_SECONDS):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid webhook signature"
+            )
+        
+        try:
+            event = json.loads(payload)
+            event_id = event["id"]
+            event_type = event["type"]
+            checkout_session = event["data"]["object"]
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Malformed webhook payload"
+            )
+        
+        # Stripe retries deliveries; skip events we already applied
+        if await db.webhook_events.find_one({"id": event_id}, {"_id": 1}):
+            return {"received": True, "duplicate": True}
+        
+        async def apply(session):
+            # Claim the event id first; the unique index turns a concurrent delivery into DuplicateKeyError
+            await db.webhook_events.insert_one({
+                "id": event_id,
+                "type": event_type,
+                "stripe_session_id": checkout_session.get("id"),
+                "received_at": datetime.utcnow()
+            }, session=session)
+            
+            try:
+                await PaymentController._apply_checkout_event(event_type, checkout_session, db, session)
+            except Exception:
+                if session is None:
+                    # No transaction to roll back; release the claim so Stripe's retry is applied
+                    await db.webhook_events.delete_one({"id": event_id})
+                raise
+        
+        try:
+            await run_in_transaction(db, apply)
+        except DuplicateKeyError:
+            return {"received": True, "duplicate": True}
+        
+        session_id = checkout_session.get("id")
+        payment_status_cache.pop(session_id)
+        if hub.subscriber_count(payment_topic(session_id)):
+            payment_record = await db.payment_transactions.find_one({"stripe_session_id": session_id})
+            if payment_record:
+                publish_payment_status(payment_record)
+        return {"received": True, "duplicate": False}
+    
+    @staticmethod
+    async def _apply_checkout_event(event_type: str, checkout_session: dict, db, session=None):
+        session_id = checkout_session.get("id")
+        stripe_payment_status = checkout_session.get("payment_status", "unpaid")
+        
+        if event_type in STRIPE_PAID_EVENTS and stripe_payment_status in ("paid", "no_payment_required"):
+            await PaymentController.mark_payment_paid(session_id, db, stripe_payment_status, session=session)
+        elif event_type in STRIPE_PAID_EVENTS:
+            # Delayed payment methods complete the session before the money arrives
+            await db.payment_transactions.update_one(
+                {"stripe_session_id": session_id, "payment_status": "pending"},
+                {"$set": {"stripe_payment_status": stripe_payment_status, "updated_at": datetime.utcnow()}},
+                session=session
+            )
+        elif event_type in STRIPE_CLOSED_EVENTS:
+            payment_record = await db.payment_transactions.find_one_and_update(
+                {"stripe_session_id": session_id, "payment_status": "pending"},
+                {"$set": {
+                    "payment_status": STRIPE_CLOSED_EVENTS[event_type],
+                    "stripe_payment_status": stripe_payment_status,
+                    "updated_at": datetime.utcnow()
+                }},
+                projection={"_id": 0, "cart_id": 1},
+                session=session
+            )
+            if payment_record and payment_record.get("cart_id"):
+                await release_cart_reservations(db, [payment_record["cart_id"]], session=session)
+        else:
+            logger.info(f"Ignoring Stripe webhook event {event_type}")
+    
     @staticmethod
     async def create_domain_checkout(
         request: StripeCheckoutRequest,
-        current_user: Optional[User] = None,
+        current_user: User,
+        db = None,
+        idempotency_key: Optional[str] = None
+    ) -> StripeCheckoutResponse:
+        """Create a checkout session, or return the one an earlier identical request created.
+        
+        Requests are deduplicated by the client's Idempotency-Key and by
+        (buyer, domain) while that session is open, so a fresh key per click
+        still reuses the buyer's open session.
+        """
+        if current_user is None:
+            # The domain is held for the buyer while the session is open
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Sign in to buy a domain"
+            )
+        
+        keys = []
+        if idempotency_key:
+            keys.append((f"key:{current_user.id}:{idempotency_key}", True))
+        if request.domain_id:
+            keys.append((f"open:{current_user.id}:{request.domain_id}", False))
+        if not keys:
+            return await PaymentController._create_domain_checkout(request, current_user, db)
+        
+        fingerprint = checkout_fingerprint(request)
+        claimed = []
+        try:
+            for key, explicit in keys:
+                response = await PaymentController._claim_checkout_key(key, fingerprint, explicit, db)
+                if response is not None:
+                    break
+                claimed.append((key, explicit))
+            else:
+                response = await PaymentController._create_domain_checkout(request, current_user, db)
+        except Exception:
+            # Let a retry with the same keys try again
+            for key, _ in claimed:
+                await db.checkout_idempotency.delete_one({"key": key, "status": "in_progress"})
+            raise
+        
+        # Keys claimed before a replay point at the replayed session from now on
+        now = datetime.utcnow()
+        for key, explicit in claimed:
+            ttl = CHECKOUT_IDEMPOTENCY_TTL_SECONDS if explicit else CHECKOUT_REUSE_WINDOW_SECONDS
+            record = {
+                "key": key,
+                "fingerprint": fingerprint,
+                "status": "completed",
+                "response": response.dict(),
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=ttl)
+            }
+            await db.checkout_idempotency.update_one({"key": key}, {"$set": record}, upsert=True)
+            checkout_idempotency_cache.set(key, record)
+        return response
+    
+    @staticmethod
+    async def _claim_checkout_key(key: str, fingerprint: str, explicit: bool, db) -> Optional[StripeCheckoutResponse]:
+        """Return the stored response for ``key``, or claim the key and return None"""
+        
+        for _ in range(3):
+            now = datetime.utcnow()
+            record = checkout_idempotency_cache.get(key)
+            if record is None:
+                record = await db.checkout_idempotency.find_one({"key": key, "expires_at": {"$gt": now}})
+            
+            if record is not None and record["status"] == "completed":
+                if explicit and record["fingerprint"] != fingerprint:
+                    raise HTTPException(
+                        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                        detail="Idempotency-Key was already used with different request parameters"
+                    )
+                
+                # Replay only while the session can still be paid, whichever key found it
+                response = StripeCheckoutResponse(**record["response"])
+                if await db.payment_transactions.find_one(
+                    {"stripe_session_id": response.session_id, "payment_status": "pending"}, {"_id": 1}
+                ):
+                    return response
+                
+                # That session is no longer open; start a new one
+                checkout_idempotency_cache.pop(key)
+                await db.checkout_idempotency.update_one(
+                    {"key": key, "created_at": record["created_at"]},
+                    {"$set": {"expires_at": now}}
+                )
+            elif record is not None:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A checkout for this request is already being created"
+                )
+            
+            # Claim the key; the filter only matches an expired record, so a live
+            # one makes the upsert collide on the unique key and we read it again
+            try:
+                await db.checkout_idempotency.update_one(
+                    {"key": key, "expires_at": {"$lte": now}},
+                    {"$set": {
+                        "key": key,
+                        "fingerprint": fingerprint,
+                        "status": "in_progress",
+                        "created_at": now,
+                        "expires_at": now + timedelta(seconds=CHECKOUT_IDEMPOTENCY_LEASE_SECONDS)
+                    }, "$unset": {"response": ""}},
+                    upsert=True
+                )
+                return None
+            except DuplicateKeyError:
+                continue
+        
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A checkout for this request is already being created"
+        )
+    
+    @staticmethod
+    async def _create_domain_checkout(
+        request: StripeCheckoutRequest,
+        current_user: User,
         db = None
     ) -> StripeCheckoutResponse:
         """Create a Stripe checkout session for domain purchase"""
@@ -64,6 +534,12 @@ class PaymentController:
                 detail="Domain is not available for purchase"
             )
         
+        if domain.seller_id == current_user.id or domain.id in current_user.domains_owned:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="You cannot buy your own domain"
+            )
+        
         # Use domain price from database (SECURITY: Never trust frontend amounts)
         amount = float(domain.price)
         currency = request.currency
@@ -76,7 +552,7 @@ class PaymentController:
         metadata = {
             "domain_id": domain.id,
             "domain_name": f"{domain.name}{domain.extension}",
-            "buyer_id": current_user.id if current_user else "anonymous",
+            "buyer_id": current_user.id,
             "seller_id": domain.seller_id or "",
             "marketplace": "dngun",
             "type": "domain_purchase"
@@ -85,95 +561,240 @@ class PaymentController:
         if request.metadata:
             metadata.update(request.metadata)
         
+        checkout_request = CheckoutSessionRequest(
+            amount=amount,
+            currency=currency,
+            success_url=success_url,
+            cancel_url=cancel_url,
+            metadata=metadata
+        )
+        
+        # Hold the domain like a one-domain cart; the payment only buys it while
+        # the hold is still there
+        hold_id = str(uuid.uuid4())
+        await reserve_cart_domains(db, [domain.id], hold_id)
+        
         # Create Stripe checkout session
         try:
-            # Check if Stripe is properly configured
-            if not stripe_checkout:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="Payment service not configured. Please set STRIPE_API_KEY environment variable."
-                )
+            session: CheckoutSessionResponse = await payment_client.create_checkout_session(checkout_request)
+        except PaymentProviderError as e:
+            if PAYMENT_DEGRADED_MODE != "mock":
+                await release_cart_reservations(db, [hold_id])
+                raise provider_unavailable(e, "create checkout session")
             
-            checkout_request = CheckoutSessionRequest(
-                amount=amount,
-                currency=currency,
-                success_url=success_url,
-                cancel_url=cancel_url,
-                metadata=metadata
+            logger.warning(f"Payment provider unavailable ({e.reason}); creating a mock checkout session")
+            return await PaymentController._create_mock_checkout(
+                request, domain, amount, currency, metadata, current_user, hold_id, db
             )
-            
-            session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
-            
-            # Create payment transaction record BEFORE redirecting user
-            payment_transaction = PaymentTransaction(
-                stripe_session_id=session.session_id,
-                amount=amount,
-                currency=currency,
-                domain_id=domain.id,
-                domain_name=f"{domain.name}{domain.extension}",
-                buyer_id=current_user.id if current_user else None,
-                seller_id=domain.seller_id,
-                payment_method="stripe_checkout",
-                payment_status="pending",
-                stripe_payment_status="unpaid",
-                metadata=metadata
+        
+        # Create payment transaction record BEFORE redirecting user
+        payment_transaction = PaymentTransaction(
+            stripe_session_id=session.session_id,
+            amount=amount,
+            currency=currency,
+            domain_id=domain.id,
+            domain_name=f"{domain.name}{domain.extension}",
+            buyer_id=current_user.id,
+            seller_id=domain.seller_id,
+            payment_method=payment_client.provider.payment_method,
+            payment_status="pending",
+            stripe_payment_status="unpaid",
+            metadata=metadata,
+            cart_id=hold_id
+        )
+        
+        await insert_held_payment(db, payment_transaction)
+        
+        return StripeCheckoutResponse(
+            checkout_url=session.url,
+            session_id=session.session_id,
+            amount=amount,
+            currency=currency,
+            domain_name=f"{domain.name}{domain.extension}"
+        )
+    
+    @staticmethod
+    async def create_cart_checkout(
+        request: CartCheckoutRequest,
+        current_user: User,
+        db = None
+    ) -> CartCheckoutResponse:
+        """Reserve every domain in the cart and open one checkout session for the total.
+        
+        The reservation is all or nothing. The provider only takes a total, so
+        the per-domain line items are kept on the payment record; once it is
+        paid the payment.completed handlers sell the domains in one update and
+        open an escrow transaction per domain. An expired session releases the
+        reservations again.
+        """
+        domain_ids = list(dict.fromkeys(request.domain_ids))
+        if not domain_ids:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cart is empty"
             )
-            
-            await db.payment_transactions.insert_one(payment_transaction.dict())
-            
-            return StripeCheckoutResponse(
-                checkout_url=session.url,
-                session_id=session.session_id,
-                amount=amount,
-                currency=currency,
-                domain_name=f"{domain.name}{domain.extension}"
+        if len(domain_ids) > CART_MAX_DOMAINS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"A cart can hold at most {CART_MAX_DOMAINS} domains"
             )
-            
-        except Exception as e:
-            # For demo purposes, create a mock checkout session
-            if "Invalid API Key" in str(e) or not stripe_checkout:
-                # Create a unique session ID with timestamp
-                import time
-                timestamp = str(int(time.time()))[-6:]  # Last 6 digits of timestamp
-                mock_session_id = f"cs_test_mock_{domain.id[:8]}_{timestamp}"
-                
-                # Instead of fake Stripe URL, redirect to our internal mock checkout
-                mock_checkout_url = f"{request.origin_url}/#/mock-stripe-checkout?session_id={mock_session_id}"
-                
-                # Create a mock payment transaction for testing
-                payment_transaction = PaymentTransaction(
-                    stripe_session_id=mock_session_id,
-                    amount=amount,
-                    currency=currency,
-                    domain_id=domain.id,
-                    domain_name=f"{domain.name}{domain.extension}",
-                    buyer_id=current_user.id if current_user else None,
-                    seller_id=domain.seller_id,
-                    payment_method="stripe_checkout_mock",
-                    payment_status="pending",
-                    stripe_payment_status="unpaid",
-                    metadata={**metadata, "mock": "true", "demo": "true"}
-                )
-                
-                await db.payment_transactions.insert_one(payment_transaction.dict())
-                
-                return StripeCheckoutResponse(
-                    checkout_url=mock_checkout_url,
-                    session_id=mock_session_id,
-                    amount=amount,
-                    currency=currency,
-                    domain_name=f"{domain.name}{domain.extension}"
-                )
-            
+        
+        # Nobody buys their own listings or domains they already own
+        own = await db.domains.find(
+            {"id": {"$in": domain_ids}, "seller_id": current_user.id}, {"_id": 0, "id": 1}
+        ).to_list(length=None)
+        own_ids = {domain["id"] for domain in own} | set(current_user.domains_owned)
+        own_ids = [domain_id for domain_id in domain_ids if domain_id in own_ids]
+        if own_ids:
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to create checkout session: {str(e)}"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"You cannot buy your own domains: {', '.join(own_ids)}"
+            )
+        
+        cart_id = str(uuid.uuid4())
+        domains = await reserve_cart_domains(db, domain_ids, cart_id)
+        
+        # Prices come from the database (SECURITY: Never trust frontend amounts)
+        items = [
+            CartItem(
+                domain_id=domain["id"],
+                domain_name=f"{domain['name']}{domain['extension']}",
+                seller_id=domain.get("seller_id"),
+                amount=float(domain["price"])
             )
+            for domain in domains
+        ]
+        amount = round(sum(item.amount for item in items), 2)
+        currency = request.currency
+        
+        metadata = {
+            **(request.metadata or {}),
+            "cart_id": cart_id,
+            "domain_count": str(len(items)),
+            "buyer_id": current_user.id,
+            "marketplace": "dngun",
+            "type": "cart_purchase"
+        }
+        
+        checkout_request = CheckoutSessionRequest(
+            amount=amount,
+            currency=currency,
+            success_url=f"{request.origin_url}/payment/success?session_id={{CHECKOUT_SESSION_ID}}",
+            cancel_url=f"{request.origin_url}/buy-domain",
+            metadata=metadata
+        )
+        
+        try:
+            session: CheckoutSessionResponse = await payment_client.create_checkout_session(checkout_request)
+            session_id, checkout_url = session.session_id, session.url
+            payment_method = payment_client.provider.payment_method
+        except PaymentProviderError as e:
+            if PAYMENT_DEGRADED_MODE != "mock":
+                await release_cart_reservations(db, [cart_id])
+                raise provider_unavailable(e, "create checkout session")
+            
+            logger.warning(f"Payment provider unavailable ({e.reason}); creating a mock cart checkout session")
+            session_id = f"cs_test_mock_cart_{uuid.uuid4().hex}"
+            checkout_url = f"{request.origin_url}/#/mock-stripe-checkout?session_id={session_id}"
+            payment_method = "stripe_checkout_mock"
+            metadata = {**metadata, "mock": "true", "demo": "true"}
+        
+        payment_transaction = PaymentTransaction(
+            stripe_session_id=session_id,
+            amount=amount,
+            currency=currency,
+            domain_name=f"{len(items)} domains",
+            buyer_id=current_user.id,
+            payment_method=payment_method,
+            payment_status="pending",
+            stripe_payment_status="unpaid",
+            metadata=metadata,
+            cart_id=cart_id,
+            items=items
+        )
+        
+        await insert_held_payment(db, payment_transaction)
+        
+        return CartCheckoutResponse(
+            checkout_url=checkout_url,
+            session_id=session_id,
+            cart_id=cart_id,
+            amount=amount,
+            currency=currency,
+            items=items
+        )
+    
+    @staticmethod
+    async def _create_mock_checkout(
+        request: StripeCheckoutRequest,
+        domain: Domain,
+        amount: float,
+        currency: str,
+        metadata: dict,
+        current_user: User,
+        hold_id: str,
+        db
+    ) -> StripeCheckoutResponse:
+        """Degraded mode: a local checkout session completed through /payments/mock/complete"""
+        
+        # Create a unique session ID; a timestamp alone collides when two
+        # checkouts for the domain start within the same second
+        timestamp = str(int(time.time()))[-6:]  # Last 6 digits of timestamp
+        mock_session_id = f"cs_test_mock_{domain.id[:8]}_{timestamp}{uuid.uuid4().hex[:6]}"
+        
+        # Instead of fake Stripe URL, redirect to our internal mock checkout
+        mock_checkout_url = f"{request.origin_url}/#/mock-stripe-checkout?session_id={mock_session_id}"
+        
+        # Create a mock payment transaction for testing
+        payment_transaction = PaymentTransaction(
+            stripe_session_id=mock_session_id,
+            amount=amount,
+            currency=currency,
+            domain_id=domain.id,
+            domain_name=f"{domain.name}{domain.extension}",
+            buyer_id=current_user.id,
+            seller_id=domain.seller_id,
+            payment_method="stripe_checkout_mock",
+            payment_status="pending",
+            stripe_payment_status="unpaid",
+            metadata={**metadata, "mock": "true", "demo": "true"},
+            cart_id=hold_id
+        )
+        
+        await insert_held_payment(db, payment_transaction)
+        
+        return StripeCheckoutResponse(
+            checkout_url=mock_checkout_url,
+            session_id=mock_session_id,
+            amount=amount,
+            currency=currency,
+            domain_name=f"{domain.name}{domain.extension}"
+        )
     
     @staticmethod
     async def check_payment_status(
         session_id: str,
         db = None
+    ) -> PaymentStatusResponse:
+        """Check payment status, sharing one lookup between concurrent pollers of a session"""
+        
+        cached = payment_status_cache.get(session_id)
+        if cached is not None:
+            return cached
+        
+        payment_status = await payment_status_flight.do(
+            session_id, PaymentController._fetch_payment_status, session_id, db
+        )
+        
+        # Terminal statuses come from the local record anyway; only cache the in-flight ones
+        if payment_status.payment_status not in TERMINAL_PAYMENT_STATUSES:
+            payment_status_cache.set(session_id, payment_status)
+        return payment_status
+    
+    @staticmethod
+    async def _fetch_payment_status(
+        session_id: str,
+        db = None
     ) -> PaymentStatusResponse:
         """Check payment status from Stripe and update database"""
         
@@ -185,107 +806,156 @@ class PaymentController:
                 detail="Payment session not found"
             )
         
+        # A finished payment cannot change at Stripe any more, and webhooks keep
+        # the record current, so neither needs a round trip
+        if payment_record["payment_status"] in TERMINAL_PAYMENT_STATUSES or STRIPE_WEBHOOK_SECRET:
+            return payment_status_from_record(payment_record)
+        
+        # Mock sessions only exist locally
+        if payment_record.get("payment_method") == "stripe_checkout_mock":
+            return payment_status_from_record(payment_record)
+        
+        # Check status with Stripe
         try:
-            # Check if Stripe is properly configured
-            if not stripe_checkout:
-                # For demo/testing, return the actual status from database instead of mock
-                return PaymentStatusResponse(
-                    payment_id=payment_record["id"],
-                    stripe_session_id=session_id,
-                    payment_status=payment_record["payment_status"],
-                    stripe_payment_status=payment_record.get("stripe_payment_status", "unpaid"),
-                    amount=payment_record["amount"],
-                    currency=payment_record["currency"],
-                    domain_name=payment_record.get("domain_name"),
-                    created_at=payment_record["created_at"],
-                    completed_at=payment_record.get("completed_at"),
-                    metadata=payment_record.get("metadata")
-                )
+            checkout_status: CheckoutStatusResponse = await payment_client.get_checkout_status(session_id)
+        except PaymentProviderError as e:
+            if PAYMENT_DEGRADED_MODE == "off":
+                raise provider_unavailable(e, "check payment status")
             
-            # Check status with Stripe
-            checkout_status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
-            
-            # Update payment record with latest status
+            # Degraded: the local record is the best answer we have
+            return payment_status_from_record(payment_record)
+        
+        # Update payment record with latest status
+        updated_record = None
+        if checkout_status.payment_status == "paid":
+            # Records the payment and queues its side effects (only once per successful payment)
+            updated_record = await PaymentController.mark_payment_paid(session_id, db, checkout_status.payment_status)
+        
+        if updated_record is None:
             update_data = {
                 "stripe_payment_status": checkout_status.payment_status,
                 "updated_at": datetime.utcnow()
             }
             
             # Determine our internal payment status
-            if checkout_status.payment_status == "paid":
-                update_data["payment_status"] = "paid"
-                update_data["completed_at"] = datetime.utcnow()
-                
-                # Mark domain as sold (only once per successful payment)
-                if payment_record["payment_status"] != "paid":
-                    await db.domains.update_one(
-                        {"id": payment_record["domain_id"]},
-                        {"$set": {"status": "sold", "updated_at": datetime.utcnow()}}
-                    )
-                    
-                    # TODO: Create main transaction record for escrow system
-                    # TODO: Notify transaction bot about successful payment
-                    
-            elif checkout_status.status == "expired":
+            if checkout_status.status == "expired":
                 update_data["payment_status"] = "expired"
             elif checkout_status.status == "canceled":
                 update_data["payment_status"] = "canceled"
             
-            # Update payment transaction
-            await db.payment_transactions.update_one(
+            # Update payment transaction and get the updated record
+            updated_record = await db.payment_transactions.find_one_and_update(
                 {"stripe_session_id": session_id},
-                {"$set": update_data}
-            )
-            
-            # Get updated record
-            updated_record = await db.payment_transactions.find_one({"stripe_session_id": session_id})
-            
-            return PaymentStatusResponse(
-                payment_id=updated_record["id"],
-                stripe_session_id=session_id,
-                payment_status=updated_record["payment_status"],
-                stripe_payment_status=checkout_status.payment_status,
-                amount=checkout_status.amount_total / 100,  # Convert from cents
-                currency=checkout_status.currency,
-                domain_name=updated_record.get("domain_name"),
-                created_at=updated_record["created_at"],
-                completed_at=updated_record.get("completed_at"),
-                metadata=updated_record.get("metadata")
+                {"$set": update_data},
+                return_document=ReturnDocument.AFTER
             )
+            if updated_record["payment_status"] != payment_record["payment_status"]:
+                publish_payment_status(updated_record)
+        
+        return PaymentStatusResponse(
+            payment_id=updated_record["id"],
+            stripe_session_id=session_id,
+            payment_status=updated_record["payment_status"],
+            stripe_payment_status=checkout_status.payment_status,
+            amount=checkout_status.amount_total / 100,  # Convert from cents
+            currency=checkout_status.currency,
+            domain_name=updated_record.get("domain_name"),
+            created_at=updated_record["created_at"],
+            completed_at=updated_record.get("completed_at"),
+            metadata=updated_record.get("metadata")
+        )
+    
+    @staticmethod
+    async def stream_payment_status(
+        session_id: str,
+        db = None,
+        max_seconds: float = PAYMENT_STREAM_MAX_SECONDS
+    ):
+        """Yield the payment's status now and again whenever it changes, until it is terminal.
+        
+        Status changes are pushed by mark_payment_paid, the webhook and status
+        checks in this process. Changes made at Stripe, or by another worker
+        process, are not pushed here, so the stream also re-checks every
+        PAYMENT_STREAM_POLL_SECONDS (coalesced with every other poller of the
+        session; with webhooks this only reads the local record). Yields None
+        when there is nothing new so the caller can ping the client.
+        """
+        # Subscribe before the first read so no transition is missed in between
+        subscription = hub.subscribe(payment_topic(session_id))
+        try:
+            current = await PaymentController.check_payment_status(session_id, db)
+            yield current
             
-        except Exception as e:
-            # For demo purposes with invalid Stripe keys, return mock status
-            if "Invalid API Key" in str(e) or not stripe_checkout:
-                return PaymentStatusResponse(
-                    payment_id=payment_record["id"],
-                    stripe_session_id=session_id,
-                    payment_status=payment_record["payment_status"],
-                    stripe_payment_status=payment_record.get("stripe_payment_status", "unpaid"),
-                    amount=payment_record["amount"],
-                    currency=payment_record["currency"],
-                    domain_name=payment_record.get("domain_name"),
-                    created_at=payment_record["created_at"],
-                    completed_at=payment_record.get("completed_at"),
-                    metadata=payment_record.get("metadata")
-                )
+            deadline = time.monotonic() + max_seconds
+            while current.payment_status not in TERMINAL_PAYMENT_STATUSES and time.monotonic() < deadline:
+                batch = await subscription.next_batch(timeout=PAYMENT_STREAM_POLL_SECONDS)
+                if subscription.overflowed or not batch:
+                    subscription.overflowed = False
+                    batch = [await PaymentController.check_payment_status(session_id, db)]
                 
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to check payment status: {str(e)}"
-            )
+                latest = batch[-1] if batch else current
+                if (latest.payment_status, latest.stripe_payment_status) == (current.payment_status, current.stripe_payment_status):
+                    yield None
+                    continue
+                
+                current = latest
+                yield current
+        finally:
+            hub.unsubscribe(subscription)
     
     @staticmethod
     async def get_user_payments(
         user_id: str,
-        db = None
-    ) -> list:
-        """Get user's payment history"""
+        db = None,
+        role: str = "buyer",
+        status_filter: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        detail: bool = False
+    ):
+        """Page through the user's payments, newest first.
         
-        payments = await db.payment_transactions.find(
-            {"buyer_id": user_id}
-        ).sort("created_at", -1).to_list(length=100)
+        ``role`` is buyer (payments made) or seller (payments received, including
+        cart payments with one of the seller's domains; those show only the
+        seller's line items and their share as the amount). Rows are
+        PaymentSummary unless ``detail`` asks for full records. Returns the page
+        and a cursor for the next one (None on the last page).
+        """
+        if role not in ("buyer", "seller"):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="role must be 'buyer' or 'seller'"
+            )
+        
+        # Each field is served by its own (field, created_at, id) index; a
+        # seller's direct and cart payments are merged in created_at order
+        fields = ["buyer_id"] if role == "buyer" else ["seller_id", "items.seller_id"]
+        projection = {"_id": 0} if detail else PAYMENT_SUMMARY_PROJECTION
+        cursors = []
+        for field in fields:
+            query = {field: user_id, **before_cursor_filter(cursor)}
+            if status_filter:
+                query["payment_status"] = status_filter
+            # Cart rows need their line items to work out the seller's share
+            field_projection = {**projection, "items": 1} if field == "items.seller_id" and not detail else projection
+            cursors.append(db.payment_transactions.find(query, field_projection).sort(page_sort()).limit(limit + 1))
+        
+        payments = await merge_descending(
+            cursors,
+            limit + 1,
+            key=lambda doc: (doc["created_at"], doc["id"])
+        )
         
-        return [PaymentTransaction(**payment) for payment in payments]
+        next_cursor = None
+        if len(payments) > limit:
+            payments = payments[:limit]
+            next_cursor = encode_cursor(payments[-1]["created_at"], payments[-1]["id"])
+        
+        if role == "seller":
+            payments = [seller_share(payment, user_id) if payment.get("items") else payment for payment in payments]
+        
+        model = PaymentTransaction if detail else PaymentSummary
+        return [model(**payment) for payment in payments], next_cursor
     
     @staticmethod
     async def initiate_escrow_release(
@@ -295,41 +965,48 @@ class PaymentController:
     ):
         """Release payment from escrow to seller after domain transfer confirmation"""
         
-        payment_record = await db.payment_transactions.find_one({"id": payment_id})
+        payment_record = await db.payment_transactions.find_one({"id": payment_id}, {"_id": 0, "items": 1})
         if not payment_record:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Payment not found"
             )
+        if payment_record.get("items"):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cart payments are settled per item through /payments/escrow/batch"
+            )
+        
+        # Same rule as the batch: release a completed escrow transaction, refund any other
+        transaction = await db.transactions.find_one({"payment_id": payment_id}, {"_id": 0, "status": 1})
+        completed = (transaction or {}).get("status") == "completed"
+        if completed != domain_transfer_confirmed:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Escrow transaction not completed" if domain_transfer_confirmed
+                else "Escrow transaction already completed"
+            )
         
-        if payment_record["payment_status"] != "paid":
+        # Only a paid payment can leave escrow; the condition makes concurrent calls apply once
+        target_status = "released_to_seller" if domain_transfer_confirmed else "refund_pending"
+        payment_record = await db.payment_transactions.find_one_and_update(
+            {"id": payment_id, "payment_status": "paid"},
+            {"$set": {
+                "payment_status": target_status,
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        if not payment_record:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Payment not completed"
             )
         
         if domain_transfer_confirmed:
-            # Update payment status to released
-            await db.payment_transactions.update_one(
-                {"id": payment_id},
-                {"$set": {
-                    "payment_status": "released_to_seller",
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-            
             # TODO: Implement actual payout to seller
             # This would integrate with Stripe Connect or similar for seller payouts
             
             return {"status": "success", "message": "Payment released to seller"}
         else:
             # Handle dispute or refund scenario
-            await db.payment_transactions.update_one(
-                {"id": payment_id},
-                {"$set": {
-                    "payment_status": "refund_pending",
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-            
-            return {"status": "pending", "message": "Refund initiated"}
\ No newline at end of file
+            return {"status": "pending", "message": "Refund initiated"}
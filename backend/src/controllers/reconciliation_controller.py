@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from . import payment_controller
+from .payment_controller import PaymentController, payment_status_cache
+from .reservation_controller import release_cart_reservations
+from ..utils.ratelimit import RateLimiter
+from ..utils.circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_INTERVAL_SECONDS = float(os.environ.get('RECONCILE_INTERVAL_SECONDS', '300'))
+RECONCILE_MIN_AGE_MINUTES = float(os.environ.get('RECONCILE_MIN_AGE_MINUTES', '60'))
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', '8'))
+RECONCILE_RATE_PER_SECOND = float(os.environ.get('RECONCILE_RATE_PER_SECOND', '20'))
+RECONCILE_BATCH_SIZE = int(os.environ.get('RECONCILE_BATCH_SIZE', '200'))
+
+CHECKPOINT_ID = "reconcile_pending_payments"
+
+# Checkout status at the provider -> our payment status, for sessions that ended unpaid
+CLOSED_CHECKOUT_STATUSES = {"expired": "expired", "canceled": "canceled"}
+
+async def load_checkpoint(db):
+    return await db.job_checkpoints.find_one({"id": CHECKPOINT_ID}, {"_id": 0})
+
+async def save_checkpoint(db, last_payment: dict, stats: dict):
+    await db.job_checkpoints.update_one(
+        {"id": CHECKPOINT_ID},
+        {"$set": {
+            "last_created_at": last_payment["created_at"],
+            "last_id": last_payment["id"],
+            "stats": stats,
+            "updated_at": datetime.utcnow()
+        }},
+        upsert=True
+    )
+
+async def clear_checkpoint(db):
+    await db.job_checkpoints.delete_one({"id": CHECKPOINT_ID})
+
+async def reconcile_pending_payments(
+    db: AsyncIOMotorDatabase,
+    provider = None,
+    min_age_minutes: float = RECONCILE_MIN_AGE_MINUTES,
+    concurrency: int = RECONCILE_CONCURRENCY,
+    rate_per_second: float = RECONCILE_RATE_PER_SECOND,
+    batch_size: int = RECONCILE_BATCH_SIZE
+):
+    """Ask the checkout provider about payments left pending and apply what it reports.
+
+    Pending payments older than ``min_age_minutes`` are streamed in
+    (created_at, id) order. Each batch is looked up with at most
+    ``concurrency`` requests in flight and ``rate_per_second`` started per
+    second. Payments found paid go through mark_payment_paid, so they get
+    the usual side effects. Expired and canceled sessions are written with
+    one conditional bulk_write. A checkpoint after each batch lets an
+    interrupted pass resume where it stopped. A finished pass clears it.
+
+    ``provider`` needs an async ``get_checkout_status(session_id)`` that
+    returns an object with ``status`` and ``payment_status``. It defaults to
+    the guarded client of the configured provider.
+    """
+    if provider is None and payment_controller.payment_client.configured:
+        provider = payment_controller.payment_client
+    if provider is None:
+        logger.info("Payment reconciliation skipped: no checkout provider configured")
+        return None
+
+    started = time.perf_counter()
+    stats = {"checked": 0, "paid": 0, "closed": 0, "unchanged": 0, "errors": 0, "aborted": False}
+
+    query = {
+        "payment_status": "pending",
+        # Mock sessions only exist locally
+        "payment_method": {"$ne": "stripe_checkout_mock"},
+        "created_at": {"$lt": datetime.utcnow() - timedelta(minutes=min_age_minutes)}
+    }
+    checkpoint = await load_checkpoint(db)
+    if checkpoint:
+        query["$or"] = [
+            {"created_at": {"$gt": checkpoint["last_created_at"]}},
+            {"created_at": checkpoint["last_created_at"], "id": {"$gt": checkpoint["last_id"]}}
+        ]
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate_per_second)
+
+    async def lookup(payment: dict):
+        async with semaphore:
+            await limiter.acquire()
+            try:
+                return payment, await provider.get_checkout_status(payment["stripe_session_id"])
+            except Exception as e:
+                logger.warning(f"Reconciliation lookup for {payment['stripe_session_id']} failed: {e}")
+                return payment, None
+
+    async def apply(batch: list):
+        results = await asyncio.gather(*(lookup(payment) for payment in batch))
+        now = datetime.utcnow()
+        updates = []
+        cart_ids = []
+
+        for payment, checkout_status in results:
+            stats["checked"] += 1
+            if checkout_status is None:
+                stats["errors"] += 1
+            elif checkout_status.payment_status == "paid":
+                if await PaymentController.mark_payment_paid(payment["stripe_session_id"], db, "paid"):
+                    stats["paid"] += 1
+                else:
+                    stats["unchanged"] += 1
+            elif checkout_status.status in CLOSED_CHECKOUT_STATUSES:
+                updates.append(UpdateOne(
+                    {"id": payment["id"], "payment_status": "pending"},
+                    {"$set": {
+                        "payment_status": CLOSED_CHECKOUT_STATUSES[checkout_status.status],
+                        "stripe_payment_status": checkout_status.payment_status,
+                        "updated_at": now
+                    }}
+                ))
+                payment_status_cache.pop(payment["stripe_session_id"])
+                if payment.get("cart_id"):
+                    cart_ids.append(payment["cart_id"])
+            else:
+                stats["unchanged"] += 1
+
+        if updates:
+            result = await db.payment_transactions.bulk_write(updates, ordered=False)
+            stats["closed"] += result.modified_count
+            stats["unchanged"] += len(updates) - result.modified_count
+
+        if cart_ids:
+            # Free the domains of carts whose payment is now closed, not of any paid meanwhile
+            closed_carts = await db.payment_transactions.find(
+                {"cart_id": {"$in": cart_ids}, "payment_status": {"$in": list(CLOSED_CHECKOUT_STATUSES.values())}},
+                {"_id": 0, "cart_id": 1}
+            ).to_list(length=None)
+            await release_cart_reservations(db, [payment["cart_id"] for payment in closed_carts])
+
+        await save_checkpoint(db, batch[-1], stats)
+
+    cursor = db.payment_transactions.find(
+        query,
+        {"_id": 0, "id": 1, "stripe_session_id": 1, "created_at": 1, "cart_id": 1}
+    ).sort([("created_at", 1), ("id", 1)]).batch_size(batch_size)
+
+    def provider_down() -> bool:
+        breaker = getattr(provider, "breaker", None)
+        return breaker is not None and breaker.state == CircuitBreaker.OPEN
+
+    batch = []
+    aborted = False
+    async for payment in cursor:
+        batch.append(payment)
+        if len(batch) >= batch_size:
+            if provider_down():
+                aborted = True
+                break
+            await apply(batch)
+            batch = []
+    if batch and not aborted:
+        if provider_down():
+            aborted = True
+        else:
+            await apply(batch)
+
+    if aborted:
+        # Keep the checkpoint; the next run resumes here once the provider recovers
+        logger.warning("Payment reconciliation paused: payment provider circuit is open")
+    else:
+        # The pass is complete; the next one starts from the oldest pending payment again
+        await clear_checkpoint(db)
+
+    stats["aborted"] = aborted
+    stats["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(
+        f"Payment reconciliation checked {stats['checked']} payments: {stats['paid']} paid, "
+        f"{stats['closed']} closed, {stats['errors']} errors in {stats['duration_ms']} ms"
+    )
+    return stats
@@ -0,0 +1,166 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from .transaction_controller import transaction_membership_cache
+from ..utils.events import event_bus
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_HOLD_MINUTES = float(os.environ.get('RESERVATION_HOLD_MINUTES', '30'))
+RESERVATION_SWEEP_INTERVAL_SECONDS = float(os.environ.get('RESERVATION_SWEEP_INTERVAL_SECONDS', '60'))
+RESERVATION_SWEEP_BATCH_SIZE = int(os.environ.get('RESERVATION_SWEEP_BATCH_SIZE', '500'))
+
+async def reserve_cart_domains(db: AsyncIOMotorDatabase, domain_ids: List[str], cart_id: str) -> List[dict]:
+    """Move every domain in ``domain_ids`` from available to pending under ``cart_id``, or none of them.
+
+    One update_many claims whatever is still available. If anything was
+    missing or taken, the claimed domains are put back and the request fails
+    with 409 naming the unavailable ids. Returns the reserved domains.
+    """
+    await db.domains.update_many(
+        {"id": {"$in": domain_ids}, "status": "available"},
+        {"$set": {"status": "pending", "cart_id": cart_id, "updated_at": datetime.utcnow()}}
+    )
+    domains = await db.domains.find({"cart_id": cart_id, "status": "pending"}, {"_id": 0}).to_list(length=None)
+
+    if len(domains) < len(domain_ids):
+        await release_cart_reservations(db, [cart_id])
+        reserved = {domain["id"] for domain in domains}
+        unavailable = [domain_id for domain_id in domain_ids if domain_id not in reserved]
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Domains not available for purchase: {', '.join(unavailable)}"
+        )
+    return domains
+
+async def release_cart_reservations(db: AsyncIOMotorDatabase, cart_ids: List[str], session=None) -> int:
+    """Make the still-pending domains of the given carts available again"""
+    if not cart_ids:
+        return 0
+    result = await db.domains.update_many(
+        {"cart_id": {"$in": cart_ids}, "status": "pending"},
+        {"$set": {"status": "available", "updated_at": datetime.utcnow()}, "$unset": {"cart_id": ""}},
+        session=session
+    )
+    return result.modified_count
+
+async def release_stale_reservations(
+    db: AsyncIOMotorDatabase,
+    hold_minutes: float = RESERVATION_HOLD_MINUTES,
+    batch_size: int = RESERVATION_SWEEP_BATCH_SIZE
+):
+    """Make domains held in ``pending`` for longer than the hold time available again.
+
+    Works through the (status, updated_at) index in batches and expires the
+    pending transactions and payment records of every released domain; the
+    payments' checkout sessions are expired at the provider through the
+    payments.expired event. Every update is conditional on the record still
+    being pending, so a purchase that completes during the sweep is left alone,
+    and holds whose payment is already paid are kept for the handlers that
+    sell them.
+    """
+    started = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(minutes=hold_minutes)
+    stale_query = {"status": "pending", "updated_at": {"$lt": cutoff}}
+
+    domains_released = 0
+    transactions_expired = 0
+    payments_expired = 0
+
+    while True:
+        stale = await db.domains.find(stale_query, {"_id": 0, "id": 1, "cart_id": 1}) \
+            .sort("updated_at", 1).limit(batch_size).to_list(length=batch_size)
+        if not stale:
+            break
+        full_batch = len(stale) == batch_size
+
+        cart_ids = list({domain["cart_id"] for domain in stale if domain.get("cart_id")})
+        now = datetime.utcnow()
+
+        # A paid hold is waiting for its payment.completed handlers to sell it;
+        # refresh it instead of releasing the domains the buyer paid for
+        paid = await db.payment_transactions.find(
+            {"cart_id": {"$in": cart_ids}, "payment_status": "paid"}, {"_id": 0, "cart_id": 1}
+        ).to_list(length=None)
+        if paid:
+            paid_cart_ids = [payment["cart_id"] for payment in paid]
+            await db.domains.update_many(
+                {"cart_id": {"$in": paid_cart_ids}, "status": "pending"},
+                {"$set": {"updated_at": now}}
+            )
+            cart_ids = [cart_id for cart_id in cart_ids if cart_id not in paid_cart_ids]
+            stale = [domain for domain in stale if domain.get("cart_id") not in paid_cart_ids]
+            if not stale:
+                if full_batch:
+                    continue
+                break
+
+        domain_ids = [domain["id"] for domain in stale]
+
+        # Release the domains
+        result = await db.domains.update_many(
+            {"id": {"$in": domain_ids}, **stale_query},
+            {"$set": {"status": "available", "updated_at": now}, "$unset": {"cart_id": ""}}
+        )
+        domains_released += result.modified_count
+
+        # Expire the abandoned purchases that were holding them
+        transactions = await db.transactions.find(
+            {"domain_id": {"$in": domain_ids}, "status": "pending"},
+            {"_id": 0, "id": 1}
+        ).to_list(length=None)
+        if transactions:
+            transaction_ids = [transaction["id"] for transaction in transactions]
+            result = await db.transactions.update_many(
+                {"id": {"$in": transaction_ids}, "status": "pending"},
+                {"$set": {"status": "expired", "updated_at": now}}
+            )
+            transactions_expired += result.modified_count
+            for transaction_id in transaction_ids:
+                transaction_membership_cache.pop(transaction_id)
+            
+            # Report only the ones this sweep expired, not any completed meanwhile
+            expired = await db.transactions.find(
+                {"id": {"$in": transaction_ids}, "status": "expired", "updated_at": now},
+                {"_id": 0, "id": 1, "buyer_id": 1, "seller_id": 1}
+            ).to_list(length=None)
+            if expired:
+                await event_bus.publish(db, "transactions.expired", {"transactions": expired})
+
+        # Cart payments hold their domains through cart_id rather than domain_id
+        payment_holders = [{"domain_id": {"$in": domain_ids}}]
+        if cart_ids:
+            payment_holders.append({"cart_id": {"$in": cart_ids}})
+        result = await db.payment_transactions.update_many(
+            {"$or": payment_holders, "payment_status": "pending"},
+            {"$set": {"payment_status": "expired", "updated_at": now}}
+        )
+        payments_expired += result.modified_count
+        if result.modified_count:
+            # Close their checkout sessions too, so nobody can pay for a released hold
+            expired = await db.payment_transactions.find(
+                {"$or": payment_holders, "payment_status": "expired", "updated_at": now},
+                {"_id": 0, "id": 1, "stripe_session_id": 1, "payment_method": 1}
+            ).to_list(length=None)
+            if expired:
+                await event_bus.publish(db, "payments.expired", {"payments": expired})
+
+        if not full_batch:
+            break
+
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(
+        f"Reservation sweep released {domains_released} domains, expired "
+        f"{transactions_expired} transactions and {payments_expired} payments in {duration_ms} ms"
+    )
+
+    return {
+        "domains_released": domains_released,
+        "transactions_expired": transactions_expired,
+        "payments_expired": payments_expired,
+        "duration_ms": duration_ms
+    }
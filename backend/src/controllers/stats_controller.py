@@ -0,0 +1,194 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict
+from pymongo.errors import DuplicateKeyError
+from ..models.user import UserStats
+from .payment_controller import POST_PAYMENT_STATUSES
+
+logger = logging.getLogger(__name__)
+
+STATS_FIELDS = ["listings", "sales", "revenue", "purchases", "spent", "pending_deals"]
+
+# How many applied operation ids each stats document remembers for deduplication
+APPLIED_OPS_KEPT = 200
+
+async def apply_stats(db, user_id: str, increments: Dict[str, float], op_id: str) -> bool:
+    """Atomically $inc a user's counters once per ``op_id``.
+
+    Event handlers may run more than once, so the stats document remembers the
+    last operation ids it applied and the update only matches if ``op_id`` is
+    not among them. Returns False if it was already applied.
+    """
+    if not user_id:
+        return False
+
+    try:
+        result = await db.user_stats.update_one(
+            {"user_id": user_id, "applied_ops": {"$ne": op_id}},
+            {
+                "$inc": increments,
+                "$push": {"applied_ops": {"$each": [op_id], "$slice": -APPLIED_OPS_KEPT}},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The document exists and already contains op_id, so the upsert collided
+        return False
+    return result.modified_count > 0 or result.upserted_id is not None
+
+async def apply_party_stats(db, transactions, increments_by_role: Dict[str, Dict[str, float]], op_id: str):
+    """Apply per-role increments for every buyer and seller in ``transactions``, summed per user"""
+    totals: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for transaction in transactions:
+        for role, increments in increments_by_role.items():
+            user_id = transaction.get(f"{role}_id")
+            for field, amount in increments.items():
+                totals[user_id][field] += amount
+
+    for user_id, increments in totals.items():
+        await apply_stats(db, user_id, dict(increments), f"{op_id}:{user_id}")
+
+async def get_user_stats(user_id: str, db) -> UserStats:
+    stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0, "applied_ops": 0})
+    if not stats:
+        return UserStats(user_id=user_id)
+    return UserStats(**stats)
+
+async def rebuild_user_stats(db) -> int:
+    """Recompute every user's stats from domains, transactions and payments in one pipeline.
+
+    Results are merged into user_stats, replacing the counters and clearing
+    the applied operation ids; documents of users with no activity left are
+    removed. Returns the number of stats documents written.
+    """
+    rebuilt_at = datetime.utcnow()
+    await db.domains.aggregate([
+        # Listings: the seller's domains that have not been sold
+        {"$match": {"seller_id": {"$ne": None}}},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$seller_id",
+            "listings": {"$cond": [{"$ne": ["$status", "sold"]}, 1, 0]}
+        }},
+        # Deals: pending ones for both parties, completed ones as sales and purchases
+        {"$unionWith": {"coll": "transactions", "pipeline": [
+            {"$project": {
+                "_id": 0,
+                "status": 1,
+                "parties": [
+                    {"user_id": "$seller_id", "role": "seller"},
+                    {"user_id": "$buyer_id", "role": "buyer"}
+                ]
+            }},
+            {"$unwind": "$parties"},
+            {"$project": {
+                "user_id": "$parties.user_id",
+                "pending_deals": {"$cond": [{"$eq": ["$status", "pending"]}, 1, 0]},
+                "sales": {"$cond": [
+                    {"$and": [{"$eq": ["$status", "completed"]}, {"$eq": ["$parties.role", "seller"]}]}, 1, 0
+                ]},
+                "purchases": {"$cond": [
+                    {"$and": [{"$eq": ["$status", "completed"]}, {"$eq": ["$parties.role", "buyer"]}]}, 1, 0
+                ]}
+            }}
+        ]}},
+        # Money: revenue for the seller, spend for the buyer
+        {"$unionWith": {"coll": "payment_transactions", "pipeline": [
+            {"$match": {"payment_status": {"$in": POST_PAYMENT_STATUSES}}},
+            {"$project": {
+                "_id": 0,
+                # Cart payments pay each item's seller separately
+                "parties": {"$concatArrays": [
+                    {"$cond": [
+                        {"$isArray": "$items"},
+                        {"$map": {"input": "$items", "as": "item", "in": {
+                            "user_id": "$$item.seller_id", "role": "seller", "amount": "$$item.amount"
+                        }}},
+                        [{"user_id": "$seller_id", "role": "seller", "amount": "$amount"}]
+                    ]},
+                    [{"user_id": "$buyer_id", "role": "buyer", "amount": "$amount"}]
+                ]}
+            }},
+            {"$unwind": "$parties"},
+            {"$project": {
+                "user_id": "$parties.user_id",
+                "revenue": {"$cond": [{"$eq": ["$parties.role", "seller"]}, "$parties.amount", 0]},
+                "spent": {"$cond": [{"$eq": ["$parties.role", "buyer"]}, "$parties.amount", 0]}
+            }}
+        ]}},
+        {"$match": {"user_id": {"$nin": [None, ""]}}},
+        {"$group": {"_id": "$user_id", **{field: {"$sum": f"${field}"} for field in STATS_FIELDS}}},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id",
+            **{field: 1 for field in STATS_FIELDS},
+            "applied_ops": {"$literal": []},
+            "updated_at": {"$literal": rebuilt_at}
+        }},
+        {"$merge": {"into": "user_stats", "on": "user_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]).to_list(length=None)
+
+    await db.user_stats.delete_many({"updated_at": {"$lt": rebuilt_at}})
+    rebuilt = await db.user_stats.count_documents({})
+    logger.info(f"Rebuilt user stats for {rebuilt} users")
+    return rebuilt
+
+# Event handlers keeping the counters up to date
+
+async def count_new_listing(db, event: dict):
+    payload = event["payload"]
+    await apply_stats(db, payload["seller_id"], {"listings": 1}, event["id"])
+
+async def count_opened_deal(db, event: dict):
+    await apply_party_stats(db, [event["payload"]], {
+        "buyer": {"pending_deals": 1},
+        "seller": {"pending_deals": 1}
+    }, event["id"])
+
+async def count_completed_deal(db, event: dict):
+    payload = event["payload"]
+    seller_increments = {"sales": 1, "pending_deals": -1}
+    if payload.get("domain_sold"):
+        seller_increments["listings"] = -1
+    await apply_party_stats(db, [payload], {
+        "buyer": {"purchases": 1, "pending_deals": -1},
+        "seller": seller_increments
+    }, event["id"])
+
+async def count_expired_deals(db, event: dict):
+    await apply_party_stats(db, event["payload"]["transactions"], {
+        "buyer": {"pending_deals": -1},
+        "seller": {"pending_deals": -1}
+    }, event["id"])
+
+async def count_status_change(db, event: dict):
+    """Move a deal between the counters its old and new status belong to, as the rebuild counts them"""
+    payload = event["payload"]
+    before, after = payload["previous_status"], payload["status"]
+    pending = (after == "pending") - (before == "pending")
+    completed = (after == "completed") - (before == "completed")
+    if not (pending or completed):
+        return
+    await apply_party_stats(db, [payload], {
+        "buyer": {"pending_deals": pending, "purchases": completed},
+        "seller": {"pending_deals": pending, "sales": completed}
+    }, event["id"])
+
+async def count_payment(db, event: dict):
+    payload = event["payload"]
+    if payload.get("items"):
+        # Cart payments: the buyer spends the total, each seller earns their items
+        totals: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        totals[payload.get("buyer_id")]["spent"] += payload["amount"]
+        for item in payload["items"]:
+            totals[item["seller_id"]]["revenue"] += item["amount"]
+        for user_id, increments in totals.items():
+            await apply_stats(db, user_id, dict(increments), f"{event['id']}:{user_id}")
+        return
+
+    await apply_party_stats(db, [payload], {
+        "buyer": {"spent": payload["amount"]},
+        "seller": {"revenue": payload["amount"]}
+    }, event["id"])
@@ -1,12 +1,36 @@
 from fastapi import HTTPException, status, Depends
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from pymongo import ReturnDocument, UpdateOne
+from typing import List, Optional
 from ..models.transaction import Transaction, TransactionCreate
 from ..models.user import User
-from ..config.database import get_database
+from ..config.database import get_database, run_in_transaction
+from ..utils.pagination import encode_cursor, before_cursor_filter, page_sort, merge_descending
+from ..utils.pubsub import hub
+from ..utils.cache import TTLCache
+from ..utils.events import event_bus
+from collections import deque
 from datetime import datetime
+import asyncio
+import logging
+import os
+import time
 import uuid
 
+logger = logging.getLogger(__name__)
+
+CHAT_KEEPALIVE_SECONDS = float(os.environ.get('CHAT_KEEPALIVE_SECONDS', '15'))
+# Each worker re-reads a streamed chat this often to see messages posted through other workers
+CHAT_POLL_SECONDS = float(os.environ.get('CHAT_POLL_SECONDS', '2'))
+CHAT_PAGE_MAX = 1000
+TRANSACTION_MEMBERSHIP_CACHE_TTL = float(os.environ.get('TRANSACTION_MEMBERSHIP_CACHE_TTL', '30'))
+
+# transaction id -> {"buyer_id", "seller_id", "status"}, used for access checks
+transaction_membership_cache = TTLCache(maxsize=50000, ttl=TRANSACTION_MEMBERSHIP_CACHE_TTL)
+
+def chat_topic(transaction_id: str) -> str:
+    return f"transaction_chat:{transaction_id}"
+
 def serialize_mongo_doc(doc):
     """Convert MongoDB document to JSON serializable format"""
     if doc is None:
@@ -28,23 +52,42 @@ async def create_transaction(
     current_user: User, 
     db
 ):
-    # Check if domain exists
-    domain = await db.domains.find_one({"id": transaction_data.domain_id})
-    if not domain:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Domain not found"
-        )
+    # Reserve the domain in a single conditional update, so concurrent buyers
+    # cannot both pass the availability check
+    reserved_at = datetime.utcnow()
+    domain = await db.domains.find_one_and_update(
+        {
+            "id": transaction_data.domain_id,
+            "status": "available",
+            "seller_id": {"$ne": current_user.id}
+        },
+        {"$set": {"status": "pending", "updated_at": reserved_at}},
+        projection={"_id": 0, "id": 1, "seller_id": 1},
+        return_document=ReturnDocument.AFTER
+    )
     
-    # Check if domain is available
-    if domain["status"] != "available":
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Domain is not available for purchase"
+    if not domain:
+        # Reservation failed; look the domain up to report why
+        domain = await db.domains.find_one(
+            {"id": transaction_data.domain_id},
+            {"_id": 0, "status": 1, "seller_id": 1}
         )
-    
-    # Check if user is not buying their own domain
-    if domain["seller_id"] == current_user.id:
+        
+        # Check if domain exists
+        if not domain:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Domain not found"
+            )
+        
+        # Check if domain is available
+        if domain["status"] != "available":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Domain is not available for purchase"
+            )
+        
+        # Otherwise the user is trying to buy their own domain
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="You cannot buy your own domain"
@@ -63,14 +106,25 @@ async def create_transaction(
         transaction_fee=transaction_fee
     )
     
-    # Insert transaction into database
-    await db.transactions.insert_one(transaction.dict())
+    async def insert(session):
+        await db.transactions.insert_one(transaction.dict(), session=session)
+        await event_bus.publish(db, "transaction.created", {
+            "transaction_id": transaction.id,
+            "domain_id": transaction.domain_id,
+            "buyer_id": transaction.buyer_id,
+            "seller_id": transaction.seller_id
+        }, session=session)
     
-    # Update domain status
-    await db.domains.update_one(
-        {"id": transaction_data.domain_id},
-        {"$set": {"status": "pending", "updated_at": datetime.utcnow()}}
-    )
+    # Insert transaction into database
+    try:
+        await run_in_transaction(db, insert)
+    except Exception:
+        # Release our reservation so the domain can be bought again
+        await db.domains.update_one(
+            {"id": transaction_data.domain_id, "status": "pending", "updated_at": reserved_at},
+            {"$set": {"status": "available", "updated_at": datetime.utcnow()}}
+        )
+        raise
     
     return transaction
 
@@ -79,8 +133,63 @@ async def complete_transaction(
     current_user: User, 
     db
 ):
-    # Get transaction
-    transaction_data = await db.transactions.find_one({"id": transaction_id})
+    async def complete(session):
+        completed_at = datetime.utcnow()
+        
+        # Mark the transaction completed; the write itself returns the document
+        transaction_data = await db.transactions.find_one_and_update(
+            {"id": transaction_id, "seller_id": current_user.id, "status": "pending"},
+            {"$set": {"status": "completed", "updated_at": completed_at}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not transaction_data:
+            return None
+        
+        # Update domain status
+        domain_result = await db.domains.update_one(
+            {"id": transaction_data["domain_id"], "status": {"$ne": "sold"}},
+            {"$set": {
+                "status": "sold", 
+                "updated_at": completed_at
+            }},
+            session=session
+        )
+        
+        # Move the domain from the seller's listings to the buyer's portfolio
+        await db.users.bulk_write([
+            UpdateOne(
+                {"id": transaction_data["seller_id"]},
+                {"$pull": {"domains_for_sale": transaction_data["domain_id"]}}
+            ),
+            UpdateOne(
+                {"id": transaction_data["buyer_id"]},
+                {"$addToSet": {"domains_owned": transaction_data["domain_id"]}}
+            )
+        ], ordered=False, session=session)
+        
+        await event_bus.publish(db, "transaction.completed", {
+            "transaction_id": transaction_id,
+            "domain_id": transaction_data["domain_id"],
+            "buyer_id": transaction_data["buyer_id"],
+            "seller_id": transaction_data["seller_id"],
+            "amount": transaction_data["amount"],
+            "domain_sold": domain_result.modified_count > 0
+        }, session=session)
+        
+        return transaction_data
+    
+    # All writes commit together, or none do
+    updated_transaction = await run_in_transaction(db, complete)
+    transaction_membership_cache.pop(transaction_id)
+    if updated_transaction:
+        return Transaction(**serialize_mongo_doc(updated_transaction))
+    
+    # Nothing was updated; look the transaction up to report why
+    transaction_data = await db.transactions.find_one(
+        {"id": transaction_id},
+        {"_id": 0, "seller_id": 1, "status": 1}
+    )
     if not transaction_data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -94,88 +203,87 @@ async def complete_transaction(
             detail="Not authorized to complete this transaction"
         )
     
-    # Check if transaction is pending
-    if transaction_data["status"] != "pending":
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Transaction is not in pending status"
+    )
+
+async def get_user_transactions(
+    current_user: User,
+    db,
+    role: Optional[str] = None,
+    status_filter: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None
+):
+    """Page through the user's transactions, newest first.
+
+    Returns the page and a cursor for the next one (None on the last page).
+    """
+    if role not in (None, "buyer", "seller"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Transaction is not in pending status"
+            detail="role must be 'buyer' or 'seller'"
         )
     
-    # Update transaction status
-    await db.transactions.update_one(
-        {"id": transaction_id},
-        {"$set": {"status": "completed"}}
-    )
-    
-    # Update domain status and owner
-    await db.domains.update_one(
-        {"id": transaction_data["domain_id"]},
-        {"$set": {
-            "status": "sold", 
-            "updated_at": datetime.utcnow()
-        }}
-    )
+    # Query the buyer and seller sides separately so each is served by its own
+    # (party_id, created_at, id) index, then merge them in created_at order
+    fields = ["buyer_id", "seller_id"] if role is None else [f"{role}_id"]
+    cursors = []
+    for field in fields:
+        query = {field: current_user.id, **before_cursor_filter(cursor)}
+        if status_filter:
+            query["status"] = status_filter
+        cursors.append(db.transactions.find(query).sort(page_sort()).limit(limit + 1))
     
-    # Update seller's domains_for_sale list
-    await db.users.update_one(
-        {"id": transaction_data["seller_id"]},
-        {"$pull": {"domains_for_sale": transaction_data["domain_id"]}}
+    transactions = await merge_descending(
+        cursors,
+        limit + 1,
+        key=lambda doc: (doc["created_at"], doc["id"])
     )
     
-    # Update buyer's domains_owned list
-    await db.users.update_one(
-        {"id": transaction_data["buyer_id"]},
-        {"$push": {"domains_owned": transaction_data["domain_id"]}}
-    )
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_cursor(transactions[-1]["created_at"], transactions[-1]["id"])
     
-    # Get updated transaction
-    updated_transaction = await db.transactions.find_one({"id": transaction_id})
-    return Transaction(**serialize_mongo_doc(updated_transaction))
-
-async def get_user_transactions(current_user: User, db):
-    # Get transactions where user is buyer or seller
-    transactions_cursor = db.transactions.find({
-        "$or": [
-            {"buyer_id": current_user.id},
-            {"seller_id": current_user.id}
-        ]
-    })
-    
-    transactions = await transactions_cursor.to_list(length=100)
-    return [Transaction(**serialize_mongo_doc(transaction)) for transaction in transactions]
+    return [Transaction(**serialize_mongo_doc(transaction)) for transaction in transactions], next_cursor
 
 async def update_transaction_status(transaction_id: str, status: str, current_user: User, db: AsyncIOMotorDatabase):
-    # Find transaction
-    transaction = await db.transactions.find_one({"id": transaction_id})
-    if not transaction:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    
     # Check if user is involved in transaction
-    if transaction["buyer_id"] != current_user.id and transaction["seller_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to access this transaction")
+    await ensure_transaction_participant(transaction_id, current_user, db)
     
-    # Update transaction status
-    await db.transactions.update_one(
-        {"id": transaction_id},
-        {
-            "$set": {
-                "status": status,
-                "updated_at": datetime.utcnow()
-            }
-        }
-    )
+    async def update(session):
+        # Update transaction status; the previous document tells the stats what changed
+        previous = await db.transactions.find_one_and_update(
+            {"id": transaction_id},
+            {
+                "$set": {
+                    "status": status,
+                    "updated_at": datetime.utcnow()
+                }
+            },
+            projection={"_id": 0, "buyer_id": 1, "seller_id": 1, "status": 1},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if previous and previous.get("status") != status:
+            await event_bus.publish(db, "transaction.status_changed", {
+                "transaction_id": transaction_id,
+                "buyer_id": previous["buyer_id"],
+                "seller_id": previous["seller_id"],
+                "previous_status": previous.get("status"),
+                "status": status
+            }, session=session)
+    
+    await run_in_transaction(db, update)
+    transaction_membership_cache.pop(transaction_id)
     
     return {"message": "Transaction status updated successfully"}
 
 async def add_transaction_chat_message(transaction_id: str, chat_message, current_user: User, db: AsyncIOMotorDatabase):
-    # Find transaction
-    transaction = await db.transactions.find_one({"id": transaction_id})
-    if not transaction:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    
     # Check if user is involved in transaction
-    if transaction["buyer_id"] != current_user.id and transaction["seller_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to access this transaction")
+    await ensure_transaction_participant(transaction_id, current_user, db)
     
     # Create chat message
     message = {
@@ -191,22 +299,225 @@ async def add_transaction_chat_message(transaction_id: str, chat_message, curren
     # Save to database
     await db.transaction_chats.insert_one(message)
     
+    # Push to clients streaming this chat
+    serialized = serialize_mongo_doc(message)
+    hub.publish(chat_topic(transaction_id), dict(serialized))
+    
     # Return serialized message
-    return serialize_mongo_doc(message)
+    return serialized
 
-async def get_transaction_chat_messages(transaction_id: str, current_user: User, db: AsyncIOMotorDatabase):
-    # Find transaction
-    transaction = await db.transactions.find_one({"id": transaction_id})
+async def get_transaction_chat_messages(
+    transaction_id: str,
+    current_user: User,
+    db: AsyncIOMotorDatabase,
+    after: Optional[str] = None,
+    limit: int = CHAT_PAGE_MAX
+):
+    """Return up to ``limit`` chat messages after ``after`` and whether more remain"""
+    # Check if user is involved in transaction
+    await ensure_transaction_participant(transaction_id, current_user, db)
+    
+    # Get chat messages
+    return await get_chat_messages_after(transaction_id, after, db, limit)
+
+async def get_transaction_membership(transaction_id: str, db: AsyncIOMotorDatabase):
+    """Buyer, seller and status of a transaction, served from a short-lived cache"""
+    membership = transaction_membership_cache.get(transaction_id)
+    if membership is None:
+        membership = await db.transactions.find_one(
+            {"id": transaction_id},
+            {"_id": 0, "buyer_id": 1, "seller_id": 1, "status": 1}
+        )
+        if membership is not None:
+            transaction_membership_cache.set(transaction_id, membership)
+    return membership
+
+async def ensure_transaction_participant(transaction_id: str, current_user: User, db: AsyncIOMotorDatabase):
+    """Raise 404/403 unless the user is the buyer or seller of the transaction"""
+    transaction = await get_transaction_membership(transaction_id, db)
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
-    # Check if user is involved in transaction
     if transaction["buyer_id"] != current_user.id and transaction["seller_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to access this transaction")
     
-    # Get chat messages
-    messages = db.transaction_chats.find({"transaction_id": transaction_id}).sort("timestamp", 1)
-    message_list = await messages.to_list(length=1000)
+    return transaction
+
+async def get_chat_messages_after(
+    transaction_id: str,
+    after: Optional[str],
+    db: AsyncIOMotorDatabase,
+    limit: int = CHAT_PAGE_MAX
+):
+    """Page of messages following ``after`` in (timestamp, id) order, plus a has_more flag.
+
+    ``after`` is either a message id or an ISO timestamp. The timestamp form is
+    answered straight from the (transaction_id, timestamp, id) index; an id
+    costs one extra lookup. Unknown ids start from the beginning.
+    """
+    query = {"transaction_id": transaction_id}
+    
+    if after:
+        try:
+            query["timestamp"] = {"$gt": datetime.fromisoformat(after)}
+        except ValueError:
+            last_message = await db.transaction_chats.find_one(
+                {"transaction_id": transaction_id, "id": after},
+                {"_id": 0, "timestamp": 1}
+            )
+            if last_message:
+                query["$or"] = [
+                    {"timestamp": {"$gt": last_message["timestamp"]}},
+                    {"timestamp": last_message["timestamp"], "id": {"$gt": after}}
+                ]
+    
+    messages = db.transaction_chats.find(query, {"_id": 0}).sort([("timestamp", 1), ("id", 1)]).limit(limit + 1)
+    message_list = await messages.to_list(length=limit + 1)
+    
+    has_more = len(message_list) > limit
+    return [serialize_mongo_doc(message) for message in message_list[:limit]], has_more
+
+class ChatPoller:
+    """Re-reads one chat for every stream of it in this process.
+
+    Messages found after the last one read are published to the chat's hub
+    topic, so the database is polled once per chat and worker however many
+    clients stream it.
+    """
+
+    def __init__(self, transaction_id: str, db: AsyncIOMotorDatabase, interval: float):
+        self.transaction_id = transaction_id
+        self.db = db
+        self.interval = interval
+        self.streams = 0
+        self.ready: Optional[asyncio.Future] = None
+        self._last_message_id: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        # Start after the newest message; streams read their own backlog
+        latest = await self.db.transaction_chats.find(
+            {"transaction_id": self.transaction_id}, {"_id": 0, "id": 1}
+        ).sort([("timestamp", -1), ("id", -1)]).limit(1).to_list(length=1)
+        self._last_message_id = latest[0]["id"] if latest else None
+        self._task = asyncio.create_task(self._run())
+
+    async def poll(self):
+        """Publish messages posted since the last poll"""
+        has_more = True
+        while has_more:
+            page, has_more = await get_chat_messages_after(self.transaction_id, self._last_message_id, self.db)
+            for message in page:
+                hub.publish(chat_topic(self.transaction_id), message)
+            if page:
+                self._last_message_id = page[-1]["id"]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Failed to poll chat {self.transaction_id}: {e}")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+# transaction id -> the poller shared by this process's streams of that chat
+chat_pollers = {}
+
+async def acquire_chat_poller(transaction_id: str, db: AsyncIOMotorDatabase, interval: float) -> ChatPoller:
+    """Join (or start) the chat's shared poller; pair with release_chat_poller"""
+    poller = chat_pollers.get(transaction_id)
+    if poller is None:
+        poller = chat_pollers[transaction_id] = ChatPoller(transaction_id, db, interval)
+        poller.ready = asyncio.ensure_future(poller.start())
+    poller.streams += 1
+    try:
+        await asyncio.shield(poller.ready)
+    except BaseException:
+        release_chat_poller(poller)
+        raise
+    return poller
+
+def release_chat_poller(poller: ChatPoller):
+    poller.streams -= 1
+    if poller.streams == 0:
+        poller.stop()
+        if chat_pollers.get(poller.transaction_id) is poller:
+            del chat_pollers[poller.transaction_id]
+
+async def stream_transaction_chat(
+    transaction_id: str,
+    last_message_id: Optional[str],
+    db: AsyncIOMotorDatabase,
+    keepalive: float = CHAT_KEEPALIVE_SECONDS,
+    poll: float = CHAT_POLL_SECONDS
+):
+    """Yield chat messages after ``last_message_id`` and then live ones as they are posted.
+
+    Live messages come from the hub: those posted through this process at once,
+    others (posted through another worker, or by an outbox handler elsewhere)
+    from the chat's shared ChatPoller every ``poll`` seconds. The stream reads
+    the database itself only for its backlog and after falling behind the hub.
+    Yields None after ``keepalive`` idle seconds so the caller can ping the
+    client. The caller must have checked that the user may read this chat.
+    """
+    # Subscribe and join the poller before reading the backlog so nothing
+    # posted in between is lost
+    subscription = hub.subscribe(chat_topic(transaction_id))
+    poller = None
+    # Ids already sent, so a message seen both on the hub and in a read goes out once
+    sent_ids = set()
+    sent_order = deque()
+    
+    def mark_sent(message_id: str):
+        sent_ids.add(message_id)
+        sent_order.append(message_id)
+        if len(sent_order) > CHAT_PAGE_MAX:
+            sent_ids.discard(sent_order.popleft())
+    
+    async def read_new_messages():
+        nonlocal last_message_id
+        new_messages, has_more = [], True
+        while has_more:
+            page, has_more = await get_chat_messages_after(transaction_id, last_message_id, db)
+            if page:
+                last_message_id = page[-1]["id"]
+            new_messages.extend(page)
+        return new_messages
     
-    # Serialize all messages
-    return [serialize_mongo_doc(message) for message in message_list]
\ No newline at end of file
+    try:
+        poller = await acquire_chat_poller(transaction_id, db, poll)
+        for message in await read_new_messages():
+            mark_sent(message["id"])
+            yield message
+        
+        idle_since = time.monotonic()
+        while True:
+            batch = await subscription.next_batch(timeout=keepalive)
+            if subscription.overflowed:
+                # Fell behind the live feed: catch up from the database
+                subscription.overflowed = False
+                batch = batch + await read_new_messages()
+            
+            delivered = False
+            for message in batch:
+                if message["id"] in sent_ids:
+                    continue
+                mark_sent(message["id"])
+                last_message_id = message["id"]
+                delivered = True
+                yield message
+            
+            if delivered:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= keepalive:
+                idle_since = time.monotonic()
+                yield None
+    finally:
+        hub.unsubscribe(subscription)
+        if poller is not None:
+            release_chat_poller(poller)
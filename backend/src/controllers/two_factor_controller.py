@@ -1,17 +1,36 @@
 import pyotp
 import qrcode
+import qrcode.image.svg
 import secrets
 import string
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 import base64
-from typing import List
+from typing import List, Optional
 from fastapi import HTTPException
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from ..models.user import User
 from ..models.two_factor import TwoFactorSetup, TwoFactorStatus
-from ..utils.security import verify_password
+from ..utils.security import verify_password, hash_backup_code
+from ..utils.totp import totp_verifier, last_used_recorder
+from ..utils.cache import TTLCache
+from ..middleware.auth import get_two_factor_state, record_two_factor_change
 from datetime import datetime
 
+QR_FORMATS = ("png", "svg", "uri")
+QR_RENDER_WORKERS = int(os.environ.get('QR_RENDER_WORKERS', '2'))
+TWO_FACTOR_SETUP_CACHE_TTL = float(os.environ.get('TWO_FACTOR_SETUP_CACHE_TTL', '300'))
+
+# QR rendering is CPU-bound, so it runs off the event loop
+qr_render_executor = ThreadPoolExecutor(max_workers=QR_RENDER_WORKERS, thread_name_prefix="qr-render")
+
+# Pending (not yet enabled) enrollments per user id: secret, hashed backup codes
+# and the QR renders already produced for them. Plaintext backup codes are only
+# ever returned by the call that generated them.
+pending_setup_cache = TTLCache(maxsize=10000, ttl=TWO_FACTOR_SETUP_CACHE_TTL)
+
 def generate_backup_codes(count: int = 10) -> List[str]:
     """Generate backup codes for 2FA recovery"""
     codes = []
@@ -22,17 +41,26 @@ def generate_backup_codes(count: int = 10) -> List[str]:
         codes.append(formatted_code)
     return codes
 
-def generate_qr_code(secret: str, user_email: str) -> str:
-    """Generate QR code for 2FA setup"""
-    totp_uri = pyotp.totp.TOTP(secret).provisioning_uri(
+def get_provisioning_uri(secret: str, user_email: str) -> str:
+    """Build the otpauth:// URI that authenticator apps enroll from"""
+    return pyotp.totp.TOTP(secret).provisioning_uri(
         name=user_email,
         issuer_name="DNGun Marketplace"
     )
+
+def generate_qr_code(secret: str, user_email: str, image_format: str = "png") -> str:
+    """Generate QR code for 2FA setup as a PNG or SVG data URI"""
+    totp_uri = get_provisioning_uri(secret, user_email)
     
     qr = qrcode.QRCode(version=1, box_size=10, border=5)
     qr.add_data(totp_uri)
     qr.make(fit=True)
     
+    if image_format == "svg":
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        img_str = base64.b64encode(img.to_string()).decode()
+        return f"data:image/svg+xml;base64,{img_str}"
+    
     img = qr.make_image(fill_color="black", back_color="white")
     
     # Convert to base64 for frontend display
@@ -42,40 +70,63 @@ def generate_qr_code(secret: str, user_email: str) -> str:
     
     return f"data:image/png;base64,{img_str}"
 
-async def setup_two_factor(user: User, db: AsyncIOMotorDatabase):
+async def render_qr_code(secret: str, user_email: str, image_format: str = "png") -> str:
+    """Render the QR code on the worker pool instead of the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(qr_render_executor, generate_qr_code, secret, user_email, image_format)
+
+async def setup_two_factor(user: User, db: AsyncIOMotorDatabase, qr_format: str = "png"):
     """Initialize 2FA setup for user"""
+    if qr_format not in QR_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported QR format. Use one of: {', '.join(QR_FORMATS)}")
+    
     # Check if 2FA is already set up
     existing_2fa = await db.two_factor_auth.find_one({"user_id": user.id})
     if existing_2fa and existing_2fa.get("is_enabled"):
         raise HTTPException(status_code=400, detail="2FA is already enabled for this account")
     
-    # Generate new secret and backup codes
-    secret = pyotp.random_base32()
-    backup_codes = generate_backup_codes()
-    
-    # Create 2FA setup
-    two_factor_setup = TwoFactorSetup(
-        user_id=user.id,
-        secret=secret,
-        backup_codes=backup_codes,
-        is_enabled=False
-    )
-    
-    # Save to database (replace existing setup if any)
-    await db.two_factor_auth.replace_one(
-        {"user_id": user.id},
-        two_factor_setup.dict(),
-        upsert=True
-    )
+    # Serve repeated calls for the same pending enrollment from the cache
+    pending = pending_setup_cache.get(user.id)
+    recovery_codes = None
+    if not pending or not existing_2fa or existing_2fa.get("secret") != pending["secret"]:
+        # Generate new secret and backup codes
+        secret = pyotp.random_base32()
+        backup_codes = generate_backup_codes()
+        
+        # Create 2FA setup
+        two_factor_setup = TwoFactorSetup(
+            user_id=user.id,
+            secret=secret,
+            backup_codes=[hash_backup_code(code) for code in backup_codes],
+            is_enabled=False
+        )
+        recovery_codes = backup_codes
+        
+        # Save to database (replace existing setup if any)
+        await db.two_factor_auth.replace_one(
+            {"user_id": user.id},
+            two_factor_setup.dict(),
+            upsert=True
+        )
+        await record_two_factor_change(user.id, db)
+        
+        pending = {"secret": secret, "backup_codes": two_factor_setup.backup_codes, "qr_codes": {}}
+        pending_setup_cache.set(user.id, pending)
     
-    # Generate QR code
-    qr_uri = generate_qr_code(secret, user.email)
+    # Generate QR code unless the client renders it from the provisioning URI
+    qr_uri: Optional[str] = None
+    if qr_format != "uri":
+        qr_uri = pending["qr_codes"].get(qr_format)
+        if qr_uri is None:
+            qr_uri = await render_qr_code(pending["secret"], user.email, qr_format)
+            pending["qr_codes"][qr_format] = qr_uri
     
     return TwoFactorStatus(
         is_enabled=False,
-        backup_codes_remaining=len(backup_codes),
+        backup_codes_remaining=len(pending["backup_codes"]),
         setup_qr_uri=qr_uri,
-        recovery_codes=backup_codes
+        provisioning_uri=get_provisioning_uri(pending["secret"], user.email),
+        recovery_codes=recovery_codes
     )
 
 async def enable_two_factor(user: User, totp_code: str, db: AsyncIOMotorDatabase):
@@ -89,8 +140,7 @@ async def enable_two_factor(user: User, totp_code: str, db: AsyncIOMotorDatabase
         raise HTTPException(status_code=400, detail="2FA is already enabled")
     
     # Verify TOTP code
-    totp = pyotp.TOTP(two_factor["secret"])
-    if not totp.verify(totp_code, valid_window=1):
+    if not await totp_verifier.verify(db, user.id, two_factor["secret"], totp_code):
         raise HTTPException(status_code=400, detail="Invalid TOTP code")
     
     # Enable 2FA
@@ -103,49 +153,53 @@ async def enable_two_factor(user: User, totp_code: str, db: AsyncIOMotorDatabase
             }
         }
     )
+    await record_two_factor_change(user.id, db)
+    pending_setup_cache.pop(user.id)
     
     return {"message": "2FA enabled successfully"}
 
 async def verify_two_factor(user: User, totp_code: str, db: AsyncIOMotorDatabase) -> bool:
     """Verify TOTP code for authentication"""
-    two_factor = await db.two_factor_auth.find_one({"user_id": user.id})
-    if not two_factor or not two_factor.get("is_enabled"):
+    # The secret is never cached; read it with the enrollment it belongs to
+    two_factor = await db.two_factor_auth.find_one(
+        {"user_id": user.id, "is_enabled": True}, {"_id": 0, "secret": 1}
+    )
+    if not two_factor:
         return True  # 2FA not enabled, consider verified
     
-    # Check TOTP code
-    totp = pyotp.TOTP(two_factor["secret"])
-    if totp.verify(totp_code, valid_window=1):
-        # Update last used
-        await db.two_factor_auth.update_one(
-            {"user_id": user.id},
-            {"$set": {"last_used": datetime.utcnow()}}
-        )
+    # Check TOTP code; a code is rejected if it was already used in its time step
+    if await totp_verifier.verify(db, user.id, two_factor["secret"], totp_code):
+        # Update last used in the next batched write
+        last_used_recorder.record(user.id)
         return True
     
     return False
 
 async def verify_backup_code(user: User, backup_code: str, db: AsyncIOMotorDatabase) -> bool:
     """Verify backup code for 2FA recovery"""
-    two_factor = await db.two_factor_auth.find_one({"user_id": user.id})
-    if not two_factor or not two_factor.get("is_enabled"):
+    if not backup_code:
         return False
     
-    backup_codes = two_factor.get("backup_codes", [])
-    if backup_code in backup_codes:
-        # Remove used backup code
-        backup_codes.remove(backup_code)
-        await db.two_factor_auth.update_one(
-            {"user_id": user.id},
-            {
-                "$set": {
-                    "backup_codes": backup_codes,
-                    "last_used": datetime.utcnow()
-                }
-            }
-        )
-        return True
+    candidates = [hash_backup_code(backup_code)]
+    # Codes issued before hashing was introduced are still stored in plaintext
+    legacy_code = backup_code.strip().upper()
+    if len(legacy_code) == 9 and legacy_code[4] == "-":
+        candidates.append(legacy_code)
     
-    return False
+    # Match and remove the code in one conditional update, so two concurrent
+    # requests cannot both consume it
+    result = await db.two_factor_auth.update_one(
+        {
+            "user_id": user.id,
+            "is_enabled": True,
+            "backup_codes": {"$in": candidates}
+        },
+        {
+            "$pull": {"backup_codes": {"$in": candidates}},
+            "$set": {"last_used": datetime.utcnow()}
+        }
+    )
+    return result.modified_count > 0
 
 async def disable_two_factor(user: User, password: str, totp_code: str, backup_code: str, db: AsyncIOMotorDatabase):
     """Disable 2FA after verification"""
@@ -153,8 +207,8 @@ async def disable_two_factor(user: User, password: str, totp_code: str, backup_c
     if not verify_password(password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Invalid password")
     
-    two_factor = await db.two_factor_auth.find_one({"user_id": user.id})
-    if not two_factor or not two_factor.get("is_enabled"):
+    two_factor = await get_two_factor_state(user, db)
+    if not two_factor.is_enabled:
         raise HTTPException(status_code=400, detail="2FA is not enabled")
     
     # Verify either TOTP code or backup code
@@ -169,18 +223,16 @@ async def disable_two_factor(user: User, password: str, totp_code: str, backup_c
     
     # Disable 2FA
     await db.two_factor_auth.delete_one({"user_id": user.id})
+    await record_two_factor_change(user.id, db)
+    pending_setup_cache.pop(user.id)
     
     return {"message": "2FA disabled successfully"}
 
 async def get_two_factor_status(user: User, db: AsyncIOMotorDatabase):
     """Get 2FA status for user"""
-    two_factor = await db.two_factor_auth.find_one({"user_id": user.id})
-    
+    two_factor = await db.two_factor_auth.find_one({"user_id": user.id}, {"_id": 0, "is_enabled": 1, "backup_codes": 1})
     if not two_factor:
-        return TwoFactorStatus(
-            is_enabled=False,
-            backup_codes_remaining=0
-        )
+        return TwoFactorStatus(is_enabled=False, backup_codes_remaining=0)
     
     return TwoFactorStatus(
         is_enabled=two_factor.get("is_enabled", False),
@@ -189,8 +241,8 @@ async def get_two_factor_status(user: User, db: AsyncIOMotorDatabase):
 
 async def regenerate_backup_codes(user: User, totp_code: str, db: AsyncIOMotorDatabase):
     """Regenerate backup codes"""
-    two_factor = await db.two_factor_auth.find_one({"user_id": user.id})
-    if not two_factor or not two_factor.get("is_enabled"):
+    two_factor = await get_two_factor_state(user, db)
+    if not two_factor.is_enabled:
         raise HTTPException(status_code=400, detail="2FA is not enabled")
     
     # Verify TOTP code
@@ -202,7 +254,7 @@ async def regenerate_backup_codes(user: User, totp_code: str, db: AsyncIOMotorDa
     
     await db.two_factor_auth.update_one(
         {"user_id": user.id},
-        {"$set": {"backup_codes": new_backup_codes}}
+        {"$set": {"backup_codes": [hash_backup_code(code) for code in new_backup_codes]}}
     )
     
     return {
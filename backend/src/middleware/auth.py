@@ -1,53 +1,94 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from ..utils.security import decode_token
+from ..utils.cache import TTLCache
 from ..models.user import User
+from ..models.two_factor import TwoFactorState
 from ..config.database import get_database
 from motor.motor_asyncio import AsyncIOMotorDatabase
+import os
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token", auto_error=False)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorDatabase = Depends(get_database)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    payload = decode_token(token)
+# 2FA enrollment state per user id. Entries never hold the TOTP secret, only
+# whether 2FA is enabled, stamped with the user's two_factor_version. Every
+# enrollment change bumps that counter on the user document, which the
+# principal lookup reads on each request anyway, so an entry written before a
+# change on any worker stops matching at once. The TTL only bounds memory.
+TWO_FACTOR_CACHE_TTL = float(os.environ.get('TWO_FACTOR_CACHE_TTL', '60'))
+two_factor_state_cache = TTLCache(maxsize=10000, ttl=TWO_FACTOR_CACHE_TTL)
+
+async def get_two_factor_state(user: User, db: AsyncIOMotorDatabase) -> TwoFactorState:
+    """Return the user's 2FA state, reading two_factor_auth only when the cached version is stale"""
+    state = two_factor_state_cache.get(user.id)
+    if state is None or state.version != user.two_factor_version:
+        two_factor = await db.two_factor_auth.find_one({"user_id": user.id}, {"_id": 0, "is_enabled": 1})
+        state = TwoFactorState(
+            is_enabled=bool(two_factor and two_factor.get("is_enabled")),
+            version=user.two_factor_version
+        )
+        two_factor_state_cache.set(user.id, state)
+    return state
+
+async def record_two_factor_change(user_id: str, db: AsyncIOMotorDatabase):
+    """Bump the user's 2FA version after their enrollment changed, invalidating every worker's cache"""
+    await db.users.update_one({"id": user_id}, {"$inc": {"two_factor_version": 1}})
+    two_factor_state_cache.pop(user_id)
+
+async def get_user_from_token(token: str, db: AsyncIOMotorDatabase):
+    """Resolve a bearer token to its User, or None if it is invalid"""
+    payload = decode_token(token) if token else None
     if payload is None:
-        raise credentials_exception
-    
+        return None
+
     user_id = payload.get("sub")
     if user_id is None:
-        raise credentials_exception
-        
+        return None
+
     user_data = await db.users.find_one({"id": user_id})
     if user_data is None:
-        raise credentials_exception
-        
+        return None
+
     return User(**user_data)
 
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorDatabase = Depends(get_database)):
+    user = await get_user_from_token(token, db)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    return user
+
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)):
+    """Operator-only endpoints: metrics, diagnostics and escrow settlement"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
 async def get_current_user_with_2fa_check(current_user: User = Depends(get_current_user), db: AsyncIOMotorDatabase = Depends(get_database)):
     """Enhanced user authentication with 2FA check for sensitive operations"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    
+
     # Check if user has 2FA enabled
-    two_factor = await db.two_factor_auth.find_one({"user_id": current_user.id})
-    if two_factor and two_factor.get("is_enabled"):
+    two_factor = await get_two_factor_state(current_user, db)
+    if two_factor.is_enabled:
         # For sensitive operations, we'll require 2FA verification
         # This will be handled at the route level with specific 2FA checks
         pass
-    
+
     return current_user
 
-async def require_2fa_verification(user_id: str, db: AsyncIOMotorDatabase) -> bool:
+async def require_2fa_verification(user: User, db: AsyncIOMotorDatabase) -> bool:
     """Check if user has 2FA enabled and requires verification"""
-    two_factor = await db.two_factor_auth.find_one({"user_id": user_id})
-    return two_factor is not None and two_factor.get("is_enabled", False)
+    two_factor = await get_two_factor_state(user, db)
+    return two_factor.is_enabled
@@ -1,8 +1,18 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import uuid
 
+class CartItem(BaseModel):
+    domain_id: str
+    domain_name: str
+    seller_id: Optional[str] = None
+    amount: float
+    
+    # Set when the item leaves escrow: released_to_seller or refund_pending
+    escrow_status: Optional[str] = None
+    escrow_batch_id: Optional[str] = None
+
 class PaymentTransactionBase(BaseModel):
     amount: float
     currency: str = "usd"
@@ -12,6 +22,11 @@ class PaymentTransactionBase(BaseModel):
     seller_id: Optional[str] = None
     transaction_id: Optional[str] = None  # Links to main transaction
     metadata: Optional[Dict[str, str]] = None
+    
+    # Reservation holding the payment's domains; cart purchases pay for several
+    # domains at once, priced per item
+    cart_id: Optional[str] = None
+    items: Optional[List[CartItem]] = None
 
 class PaymentTransactionCreate(PaymentTransactionBase):
     stripe_session_id: str
@@ -21,7 +36,7 @@ class PaymentTransaction(PaymentTransactionBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     stripe_session_id: str
     payment_method: str = "stripe_checkout"
-    payment_status: str = "pending"  # pending, paid, failed, canceled, expired
+    payment_status: str = "pending"  # pending, paid, failed, canceled, expired, released_to_seller, refund_pending, partially_refunded
     stripe_payment_status: str = "unpaid"  # Stripe's internal status
     payment_intent_id: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -50,6 +65,54 @@ class StripeCheckoutResponse(BaseModel):
     currency: str
     domain_name: Optional[str] = None
 
+class PaymentSummary(BaseModel):
+    """Payment history row: the fields lists need, without metadata and line items"""
+    id: str
+    stripe_session_id: str
+    amount: float
+    currency: str
+    domain_id: Optional[str] = None
+    domain_name: Optional[str] = None
+    buyer_id: Optional[str] = None
+    seller_id: Optional[str] = None
+    cart_id: Optional[str] = None
+    payment_status: str
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+
+class CartCheckoutRequest(BaseModel):
+    domain_ids: List[str]
+    currency: str = "usd"
+    
+    # URLs from frontend
+    origin_url: str = Field(..., description="Frontend origin URL for building success/cancel URLs")
+    
+    # Additional metadata
+    metadata: Optional[Dict[str, str]] = None
+
+class CartCheckoutResponse(BaseModel):
+    checkout_url: str
+    session_id: str
+    cart_id: str
+    amount: float
+    currency: str
+    items: List[CartItem]
+
+class EscrowBatchRequest(BaseModel):
+    action: str  # release (to the seller) or refund
+    
+    # Reuse a batch_id to resume an interrupted run; a finished batch is not applied again
+    batch_id: Optional[str] = None
+    
+    # Selection: explicit payments, or every paid payment matching the filters
+    payment_ids: Optional[List[str]] = None
+    buyer_id: Optional[str] = None
+    seller_id: Optional[str] = None
+    paid_before: Optional[datetime] = None
+    
+    # Stop after this many payments in this run; rerun with the batch_id for the next ones
+    max_payments: Optional[int] = None
+
 class PaymentStatusResponse(BaseModel):
     payment_id: str
     stripe_session_id: str
@@ -60,4 +123,24 @@ class PaymentStatusResponse(BaseModel):
     domain_name: Optional[str] = None
     created_at: datetime
     completed_at: Optional[datetime] = None
-    metadata: Optional[Dict[str, str]] = None
\ No newline at end of file
+    metadata: Optional[Dict[str, str]] = None
+
+# Provider-neutral checkout types used by the payment providers
+
+class CheckoutSessionRequest(BaseModel):
+    amount: float
+    currency: str = "usd"
+    success_url: str
+    cancel_url: str
+    metadata: Optional[Dict[str, str]] = None
+
+class CheckoutSessionResponse(BaseModel):
+    url: str
+    session_id: str
+
+class CheckoutStatusResponse(BaseModel):
+    status: str  # open, complete, expired
+    payment_status: str  # unpaid, paid, no_payment_required
+    amount_total: int  # in cents
+    currency: str
+    metadata: Optional[Dict[str, str]] = None
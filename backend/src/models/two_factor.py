@@ -6,11 +6,16 @@ import uuid
 class TwoFactorSetup(BaseModel):
     user_id: str
     secret: str
-    backup_codes: List[str]
+    backup_codes: List[str]  # HMAC-SHA256 hashes, see utils.security.hash_backup_code
     is_enabled: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
     last_used: Optional[datetime] = None
 
+class TwoFactorState(BaseModel):
+    """Cached per-user 2FA enrollment state used by the auth middleware"""
+    is_enabled: bool = False
+    version: int = 0  # User.two_factor_version the state was read at
+
 class TwoFactorEnable(BaseModel):
     totp_code: str
 
@@ -29,4 +34,5 @@ class TwoFactorStatus(BaseModel):
     is_enabled: bool
     backup_codes_remaining: int
     setup_qr_uri: Optional[str] = None
+    provisioning_uri: Optional[str] = None
     recovery_codes: Optional[List[str]] = None
\ No newline at end of file
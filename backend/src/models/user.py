@@ -23,6 +23,8 @@ class User(UserBase):
     hashed_password: str
     is_active: bool = True
     is_verified: bool = False
+    is_admin: bool = False  # set directly in the database; never from a request
+    two_factor_version: int = 0  # bumped on every 2FA enrollment change
     domains_owned: List[str] = []
     domains_for_sale: List[str] = []
     
@@ -30,3 +32,13 @@ class UserPublic(UserBase):
     id: str
     full_name: Optional[str] = None
     created_at: datetime
+
+class UserStats(BaseModel):
+    user_id: str
+    listings: int = 0
+    sales: int = 0
+    revenue: float = 0.0
+    purchases: int = 0
+    spent: float = 0.0
+    pending_deals: int = 0
+    updated_at: Optional[datetime] = None
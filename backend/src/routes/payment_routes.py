@@ -1,50 +1,61 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Optional
 from datetime import datetime
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
 from ..config.database import get_database
-from ..middleware.auth import get_current_user
+from ..middleware.auth import get_current_user, get_current_admin_user
 from ..models.user import User
 from ..models.payment import (
     StripeCheckoutRequest,
     StripeCheckoutResponse,
-    PaymentStatusResponse
+    PaymentStatusResponse,
+    CartCheckoutRequest,
+    CartCheckoutResponse,
+    EscrowBatchRequest
 )
-from ..controllers.payment_controller import PaymentController
+from ..controllers import payment_controller
+from ..controllers.escrow_controller import open_escrow_batch
+from ..controllers.payment_controller import PaymentController, payment_client, PAYMENT_DEGRADED_MODE
+from ..utils.payment_providers import FakeCheckoutProvider
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
-async def get_optional_current_user(
-    db: AsyncIOMotorDatabase = Depends(get_database)
-) -> Optional[User]:
-    """Get current user if authenticated, None otherwise"""
-    try:
-        from fastapi.security import OAuth2PasswordBearer
-        from fastapi import Request
-        import jwt
-        from ..utils.security import decode_token
-        
-        # This is a simplified version that doesn't raise exceptions
-        # In a real implementation, you'd want to extract the token properly
-        return None
-    except:
-        return None
-
 @router.post("/checkout/domain", response_model=StripeCheckoutResponse)
 async def create_domain_checkout(
     request: StripeCheckoutRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    current_user: User = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """
     Create a Stripe checkout session for domain purchase.
     
     Security: Domain price is fetched from backend database to prevent price manipulation.
+    The domain is held for the buyer while the session is open, so only signed-in
+    buyers can start one. While the session is open, retries with the same
+    Idempotency-Key and the buyer's repeat requests for the domain return it.
+    """
+    return await PaymentController.create_domain_checkout(request, current_user, db, idempotency_key)
+
+@router.post("/checkout/cart", response_model=CartCheckoutResponse)
+async def create_cart_checkout(
+    request: CartCheckoutRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Reserve several domains and create one checkout session for all of them.
+    
+    Either every domain is reserved or the request fails with 409. The reservations
+    are released again if the checkout session expires unpaid.
     """
-    return await PaymentController.create_domain_checkout(request, None, db)
+    return await PaymentController.create_cart_checkout(request, current_user, db)
 
 @router.get("/status/{session_id}", response_model=PaymentStatusResponse)
 async def get_payment_status(
@@ -58,29 +69,112 @@ async def get_payment_status(
     """
     return await PaymentController.check_payment_status(session_id, db)
 
+@router.get("/status/{session_id}/stream")
+async def stream_payment_status(
+    session_id: str,
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Server-sent events feed of a checkout session's status.
+    
+    Sends the current status, then every transition, and closes once the payment is paid, expired, canceled or failed.
+    """
+    if not await db.payment_transactions.find_one({"stripe_session_id": session_id}, {"_id": 1}):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payment session not found"
+        )
+    
+    async def events():
+        async for payment_status in PaymentController.stream_payment_status(session_id, db):
+            if await request.is_disconnected():
+                break
+            if payment_status is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: status\ndata: {payment_status.json()}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/webhook/stripe")
+async def stripe_webhook(
+    request: Request,
+    stripe_signature: Optional[str] = Header(None),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Receive Stripe checkout events.
+    
+    Deliveries are verified against STRIPE_WEBHOOK_SECRET and applied once per event id.
+    """
+    payload = await request.body()
+    return await PaymentController.handle_stripe_webhook(payload, stripe_signature, db)
+
+@router.get("/provider/metrics")
+async def get_provider_metrics(current_user: User = Depends(get_current_admin_user)):
+    """Circuit breaker state, in-flight calls and per-operation counters of the payment provider client"""
+    return {**payment_client.metrics(), "degraded_mode": PAYMENT_DEGRADED_MODE}
+
 @router.get("/history")
 async def get_payment_history(
+    response: Response,
+    role: str = Query("buyer", description="buyer for payments made, seller for payments received"),
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    detail: bool = Query(False, description="full payment records including metadata and line items"),
     current_user: User = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """Get current user's payment history"""
-    return await PaymentController.get_user_payments(current_user.id, db)
+    """Get current user's payment history, newest first. The next page's cursor is in X-Next-Cursor."""
+    payments, next_cursor = await PaymentController.get_user_payments(
+        current_user.id, db, role, status, limit, cursor, detail
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return payments
 
 @router.post("/escrow/release/{payment_id}")
 async def release_escrow_payment(
     payment_id: str,
     domain_transfer_confirmed: bool,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """
     Release payment from escrow to seller after domain transfer confirmation.
     
-    This would typically be called by admin or automated system after domain transfer verification.
+    Admin only; called after the domain transfer was verified.
     """
-    # TODO: Add admin authorization check
     return await PaymentController.initiate_escrow_release(payment_id, domain_transfer_confirmed, db)
 
+@router.post("/escrow/batch")
+async def process_escrow_batch(
+    request: EscrowBatchRequest,
+    current_user: User = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Release or refund many escrowed payments at once.
+    
+    Streams one NDJSON line per selected payment (per line item for carts), then a
+    summary line. Only payments still paid are changed, and only those whose escrow
+    transaction completed are released. Rerunning with the same batch_id resumes an
+    interrupted batch. Admin only.
+    """
+    results = await open_escrow_batch(db, request)
+    
+    async def ndjson():
+        async for result in results:
+            yield json.dumps(result, default=str) + "\n"
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 @router.post("/mock/complete/{session_id}")
 async def complete_mock_payment(
     session_id: str,
@@ -103,40 +197,47 @@ async def complete_mock_payment(
         if payment_record.get("payment_status") == "paid":
             return {"status": "success", "message": "Payment already completed"}
         
-        # Update payment status to completed
-        update_data = {
-            "payment_status": "paid",
-            "stripe_payment_status": "paid",
-            "completed_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }
-        
-        update_result = await db.payment_transactions.update_one(
-            {"stripe_session_id": session_id},
-            {"$set": update_data}
-        )
-        
-        logger.info(f"Payment update result: modified_count={update_result.modified_count}")
-        
-        # Mark domain as sold
-        if payment_record.get("domain_id"):
-            domain_update_result = await db.domains.update_one(
-                {"id": payment_record["domain_id"]},
-                {"$set": {"status": "sold", "updated_at": datetime.utcnow()}}
+        payment_method = payment_record.get("payment_method")
+        if payment_method not in ("stripe_checkout_mock", FakeCheckoutProvider.payment_method):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Only mock and fake checkout sessions can be completed here"
             )
-            logger.info(f"Domain update result: modified_count={domain_update_result.modified_count}")
         
-        # Verify the update worked
-        updated_payment = await db.payment_transactions.find_one({"stripe_session_id": session_id})
+        if payment_method == FakeCheckoutProvider.payment_method:
+            provider = payment_controller.checkout_provider
+            if not isinstance(provider, FakeCheckoutProvider):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="The fake checkout provider is not enabled"
+                )
+            if not await provider.complete_session(session_id):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Checkout session is no longer open"
+                )
+            # The fake provider pays the session and sends checkout.session.completed,
+            # which goes through the regular webhook handler
+            updated_payment = await db.payment_transactions.find_one({"stripe_session_id": session_id})
+            if updated_payment.get("payment_status") == "pending":
+                return {"status": "processing", "message": "Payment completed; waiting for the provider webhook"}
+        else:
+            # Degraded-mode sessions; the domain is marked sold by the payment.completed event handlers
+            updated_payment = await PaymentController.mark_payment_paid(session_id, db)
+            if updated_payment is None:
+                return {"status": "success", "message": "Payment already completed"}
+        
         logger.info(f"Updated payment status: {updated_payment.get('payment_status')}")
         
         return {
             "status": "success", 
             "message": "Mock payment completed successfully",
             "payment_status": updated_payment.get('payment_status'),
-            "updated_count": update_result.modified_count
+            "updated_count": 1
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in mock payment completion: {str(e)}")
         raise HTTPException(
@@ -1,5 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, Request, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+import asyncio
+import json
+import logging
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from ..models.transaction import Transaction, TransactionCreate
 from ..models.user import User
@@ -9,12 +13,16 @@ from ..controllers.transaction_controller import (
     get_user_transactions,
     update_transaction_status,
     add_transaction_chat_message,
-    get_transaction_chat_messages
+    get_transaction_chat_messages,
+    ensure_transaction_participant,
+    stream_transaction_chat
 )
 from ..controllers.two_factor_controller import verify_two_factor, verify_backup_code
-from ..middleware.auth import get_current_active_user, require_2fa_verification
+from ..middleware.auth import get_current_active_user, get_user_from_token, require_2fa_verification
 from ..config.database import get_database
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/transactions", tags=["Transactions"])
 
@@ -35,7 +43,7 @@ class TransactionWith2FA(BaseModel):
 
 async def verify_2fa_for_transaction(user: User, totp_code: str, backup_code: str, db):
     """Verify 2FA for transaction if enabled"""
-    if await require_2fa_verification(user.id, db):
+    if await require_2fa_verification(user, db):
         if totp_code:
             is_valid = await verify_two_factor(user, totp_code, db)
         elif backup_code:
@@ -103,14 +111,112 @@ async def add_chat_message(
 @router.get("/{transaction_id}/chat")
 async def get_chat_messages(
     transaction_id: str,
+    response: Response,
+    after: Optional[str] = Query(None, description="Message id or ISO timestamp to continue after"),
+    limit: int = Query(1000, ge=1, le=1000),
+    current_user: User = Depends(get_current_active_user),
+    db = Depends(get_database)
+):
+    """Chat messages in order. X-Has-More is "true" when another page follows."""
+    messages, has_more = await get_transaction_chat_messages(transaction_id, current_user, db, after, limit)
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    return messages
+
+@router.get("/{transaction_id}/chat/stream")
+async def stream_chat_messages(
+    transaction_id: str,
+    request: Request,
+    last_id: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
     current_user: User = Depends(get_current_active_user),
     db = Depends(get_database)
 ):
-    return await get_transaction_chat_messages(transaction_id, current_user, db)
+    """Server-sent events feed of chat messages, resuming after last_id / Last-Event-ID"""
+    await ensure_transaction_participant(transaction_id, current_user, db)
+    
+    async def events():
+        async for message in stream_transaction_chat(transaction_id, last_event_id or last_id, db):
+            if await request.is_disconnected():
+                break
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"id: {message['id']}\nevent: message\ndata: {json.dumps(message)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/{transaction_id}/chat/ws")
+async def chat_websocket(
+    websocket: WebSocket,
+    transaction_id: str,
+    token: str = Query(..., description="Bearer access token"),
+    last_id: Optional[str] = None,
+    db = Depends(get_database)
+):
+    """Bidirectional chat: pushes messages after last_id and accepts new ones as JSON"""
+    current_user = await get_user_from_token(token, db)
+    if current_user is None or not current_user.is_active:
+        await websocket.close(code=1008)
+        return
+    
+    try:
+        await ensure_transaction_participant(transaction_id, current_user, db)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    
+    async def push_messages():
+        async for message in stream_transaction_chat(transaction_id, last_id, db):
+            if message is not None:
+                await websocket.send_json(message)
+    
+    async def receive_messages():
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                return
+            try:
+                chat_message = ChatMessage(**json.loads(frame.get("text") or ""))
+            except (ValueError, ValidationError, TypeError):
+                await websocket.send_json({"error": "Invalid chat message"})
+                continue
+            await add_transaction_chat_message(transaction_id, chat_message, current_user, db)
+    
+    # Whichever side ends first ends the connection; a failure in either closes it
+    pusher = asyncio.create_task(push_messages())
+    receiver = asyncio.create_task(receive_messages())
+    done, pending = await asyncio.wait({pusher, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    
+    for task in done:
+        error = task.exception()
+        if error is not None and not isinstance(error, WebSocketDisconnect):
+            logger.error(f"Chat WebSocket for transaction {transaction_id} failed: {error!r}")
+            try:
+                await websocket.close(code=1011)
+            except (RuntimeError, WebSocketDisconnect):
+                pass  # Already closed
 
 @router.get("", response_model=List[Transaction])
 async def get_transactions(
+    response: Response,
+    role: Optional[str] = Query(None, description="buyer or seller; both when omitted"),
+    status: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=200),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_active_user),
     db = Depends(get_database)
 ):
-    return await get_user_transactions(current_user, db)
+    """List the user's transactions, newest first. The next page's cursor is in X-Next-Cursor."""
+    transactions, next_cursor = await get_user_transactions(current_user, db, role, status, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return transactions
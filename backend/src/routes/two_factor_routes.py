@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from ..models.user import User
 from ..models.two_factor import (
@@ -32,11 +32,12 @@ async def get_2fa_status(
 
 @router.post("/setup", response_model=TwoFactorStatus)
 async def setup_2fa(
+    qr_format: str = Query("png", alias="format", description="png, svg, or uri to skip server-side rendering"),
     current_user: User = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Initialize 2FA setup - generates QR code and backup codes"""
-    return await setup_two_factor(current_user, db)
+    return await setup_two_factor(current_user, db, qr_format)
 
 @router.post("/enable")
 async def enable_2fa(
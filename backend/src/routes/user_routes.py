@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import List
-from ..models.user import User, UserPublic
+from ..models.user import User, UserPublic, UserStats
 from ..models.domain import Domain
 from ..middleware.auth import get_current_active_user
 from ..config.database import get_database
+from ..controllers.stats_controller import get_user_stats
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
@@ -20,6 +21,13 @@ async def get_current_user_info(
         created_at=current_user.created_at
     )
 
+@router.get("/me/stats", response_model=UserStats)
+async def get_my_stats(
+    current_user: User = Depends(get_current_active_user),
+    db = Depends(get_database)
+):
+    return await get_user_stats(current_user.id, db)
+
 @router.get("/me/domains", response_model=List[Domain])
 async def get_my_domains(
     current_user: User = Depends(get_current_active_user),
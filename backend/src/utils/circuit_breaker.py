@@ -0,0 +1,61 @@
+import time
+
+class CircuitBreaker:
+    """Stop calling a failing dependency for a while, then probe it before trusting it again.
+
+    ``closed``: calls go through; ``failure_threshold`` consecutive failures
+    open the circuit. ``open``: calls are refused until ``recovery_timeout``
+    seconds have passed. ``half_open``: up to ``half_open_max_calls`` probe
+    calls go through; a success closes the circuit, a failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._probes = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets a probe through"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; counts half-open probes"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+            self._probes += 1
+            return True
+        return False
+
+    def release(self):
+        """A permitted call ended without an outcome (e.g. it was cancelled); free its probe slot"""
+        if self._state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self):
+        self.failures = 0
+        self._state = self.CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._state = self.OPEN
+            self.opened_at = time.monotonic()
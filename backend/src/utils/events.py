@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+EVENT_WORKERS = int(os.environ.get('EVENT_WORKERS', '4'))
+EVENT_POLL_SECONDS = float(os.environ.get('EVENT_POLL_SECONDS', '1'))
+EVENT_LEASE_SECONDS = float(os.environ.get('EVENT_LEASE_SECONDS', '60'))
+EVENT_MAX_ATTEMPTS = int(os.environ.get('EVENT_MAX_ATTEMPTS', '10'))
+
+Handler = Callable[..., Awaitable]
+
+class EventBus:
+    """Domain event bus backed by a transactional outbox.
+
+    ``publish`` inserts the event into the ``outbox`` collection, ideally in the
+    same Mongo transaction as the state change it describes. Workers claim
+    due events, run every handler registered for the event type and mark the
+    event done. A failed event is retried with exponential backoff. An event
+    whose worker died is reclaimed once its lease expires. Delivery is
+    at-least-once, so handlers must be idempotent.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        poll_interval: float = 1.0,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 10
+    ):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._db = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def register(self, event_type: str, handler: Handler):
+        """Call ``handler(db, event)`` for every event of this type"""
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    async def publish(self, db, event_type: str, payload: dict, session=None) -> str:
+        """Write the event to the outbox; pass the session of the surrounding transaction"""
+        now = datetime.utcnow()
+        event = {
+            "id": str(uuid.uuid4()),
+            "type": event_type,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "available_at": now,
+            "created_at": now
+        }
+        await db.outbox.insert_one(event, session=session)
+
+        # Nudge the local workers; other processes pick it up on their next poll
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return event["id"]
+
+    async def _claim(self, db):
+        """Lease the next due event. available_at doubles as the lease expiry while processing."""
+        now = datetime.utcnow()
+        return await db.outbox.find_one_and_update(
+            {"status": {"$in": ["pending", "processing"]}, "available_at": {"$lte": now}},
+            {
+                "$set": {"status": "processing", "available_at": now + timedelta(seconds=self.lease_seconds)},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def dispatch(self, db, event: dict):
+        """Run the handlers for one claimed event and record the outcome"""
+        try:
+            for handler in self._handlers.get(event["type"], []):
+                await handler(db, event)
+        except Exception as e:
+            attempts = event.get("attempts", 1)
+            failed = attempts >= self.max_attempts
+            logger.exception(f"Handler for event {event['type']} {event['id']} failed (attempt {attempts})")
+            await db.outbox.update_one(
+                {"id": event["id"]},
+                {"$set": {
+                    "status": "failed" if failed else "pending",
+                    "available_at": datetime.utcnow() + timedelta(seconds=min(2 ** attempts, 300)),
+                    "last_error": str(e)
+                }}
+            )
+            return False
+
+        await db.outbox.update_one(
+            {"id": event["id"]},
+            {"$set": {"status": "done", "processed_at": datetime.utcnow()}}
+        )
+        return True
+
+    async def _worker(self, db):
+        while not self._stopping:
+            try:
+                event = await self._claim(db)
+            except Exception:
+                logger.exception("Failed to claim outbox event")
+                event = None
+
+            if event is not None:
+                await self.dispatch(db, event)
+                continue
+
+            # Nothing due; sleep until published to or the next poll
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self, db=None) -> int:
+        """Dispatch due events inline until none are left; returns how many were handled"""
+        db = db if db is not None else self._db
+        handled = 0
+        while True:
+            event = await self._claim(db)
+            if event is None:
+                return handled
+            await self.dispatch(db, event)
+            handled += 1
+
+    def start(self, db):
+        self._db = db
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(db)) for _ in range(self.workers)]
+
+    async def stop(self, grace: float = 0.0):
+        """Stop the workers, letting them finish the events in hand for up to ``grace`` seconds.
+
+        Events still unfinished stay leased and are picked up again by another
+        worker once the lease expires.
+        """
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._tasks and grace > 0:
+            await asyncio.wait(self._tasks, timeout=grace)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+event_bus = EventBus(
+    workers=EVENT_WORKERS,
+    poll_interval=EVENT_POLL_SECONDS,
+    lease_seconds=EVENT_LEASE_SECONDS,
+    max_attempts=EVENT_MAX_ATTEMPTS
+)
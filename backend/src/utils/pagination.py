@@ -0,0 +1,62 @@
+import base64
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Tuple
+from fastapi import HTTPException, status
+
+def encode_cursor(created_at: datetime, doc_id: str) -> str:
+    """Opaque cursor pointing just past the given (created_at, id) position"""
+    raw = f"{created_at.isoformat()}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, doc_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), doc_id
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
+def before_cursor_filter(cursor: Optional[str]) -> dict:
+    """Query clause selecting documents after the cursor in (created_at, id) descending order"""
+    if not cursor:
+        return {}
+
+    created_at, doc_id = decode_cursor(cursor)
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": doc_id}}
+    ]}
+
+def page_sort() -> List[tuple]:
+    return [("created_at", -1), ("id", -1)]
+
+async def merge_descending(cursors: List[Any], limit: int, key: Callable[[dict], Any]) -> List[dict]:
+    """Merge cursors that are each sorted descending by ``key``, stopping after ``limit`` documents.
+
+    Documents are pulled one at a time, so each cursor is only read as far as
+    the merged page needs. Documents returned by more than one cursor are
+    yielded once.
+    """
+    iterators = [cursor.__aiter__() for cursor in cursors]
+    heads = [await anext(iterator, None) for iterator in iterators]
+
+    merged: List[dict] = []
+    seen = set()
+    while len(merged) < limit:
+        candidates = [i for i, head in enumerate(heads) if head is not None]
+        if not candidates:
+            break
+
+        index = max(candidates, key=lambda i: key(heads[i]))
+        doc = heads[index]
+        heads[index] = await anext(iterators[index], None)
+
+        if doc["id"] in seen:
+            continue
+        seen.add(doc["id"])
+        merged.append(doc)
+
+    return merged
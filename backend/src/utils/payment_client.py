@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+from .circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+class PaymentProviderError(Exception):
+    """A provider call did not produce a result.
+
+    ``reason`` is one of ``not_configured``, ``circuit_open``, ``bulkhead_full``,
+    ``timeout`` or ``provider_error``.
+    """
+
+    def __init__(self, reason: str, message: str = "", retry_after: float = 0.0):
+        super().__init__(message or reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class PaymentProviderClient:
+    """Guards calls to a checkout provider so a slow or failing provider cannot stall the API.
+
+    Every call gets a deadline. At most ``max_concurrency`` calls are in
+    flight; further calls are refused instead of queueing (bulkhead).
+    Failures and timeouts feed a circuit breaker that refuses calls while
+    open. Counters and latencies per operation are kept for ``metrics()``.
+    """
+
+    def __init__(
+        self,
+        provider = None,
+        create_timeout: float = 10.0,
+        status_timeout: float = 5.0,
+        max_concurrency: int = 20,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.provider = provider
+        self.timeouts = {
+            "create_checkout_session": create_timeout,
+            "get_checkout_status": status_timeout,
+            "expire_checkout_session": status_timeout
+        }
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self._metrics: Dict[str, Dict[str, float]] = {}
+
+    @property
+    def configured(self) -> bool:
+        return self.provider is not None
+
+    async def create_checkout_session(self, checkout_request):
+        return await self._call("create_checkout_session", checkout_request)
+
+    async def get_checkout_status(self, session_id: str):
+        return await self._call("get_checkout_status", session_id)
+
+    async def expire_checkout_session(self, session_id: str):
+        return await self._call("expire_checkout_session", session_id)
+
+    async def _call(self, operation: str, *args):
+        metrics = self._metrics.setdefault(operation, {
+            "calls": 0, "succeeded": 0, "failed": 0, "timed_out": 0,
+            "rejected": 0, "latency_ms_total": 0.0, "latency_ms_max": 0.0
+        })
+        metrics["calls"] += 1
+
+        if self.provider is None:
+            metrics["rejected"] += 1
+            raise PaymentProviderError("not_configured", "Payment provider not configured")
+
+        if self.in_flight >= self.max_concurrency:
+            metrics["rejected"] += 1
+            raise PaymentProviderError("bulkhead_full", "Too many payment provider calls in flight", retry_after=1.0)
+
+        if not self.breaker.allow():
+            metrics["rejected"] += 1
+            raise PaymentProviderError(
+                "circuit_open", "Payment provider is failing; calls are paused", retry_after=self.breaker.retry_after()
+            )
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(getattr(self.provider, operation)(*args), self.timeouts[operation])
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            metrics["timed_out"] += 1
+            self.breaker.record_failure()
+            raise PaymentProviderError(
+                "timeout", f"Payment provider did not answer {operation} within {self.timeouts[operation]:g}s"
+            )
+        except Exception as e:
+            metrics["failed"] += 1
+            self.breaker.record_failure()
+            logger.warning(f"Payment provider {operation} failed: {e}")
+            raise PaymentProviderError("provider_error", str(e)) from e
+        finally:
+            self.in_flight -= 1
+            latency_ms = (time.perf_counter() - started) * 1000
+            metrics["latency_ms_total"] += latency_ms
+            metrics["latency_ms_max"] = max(metrics["latency_ms_max"], latency_ms)
+
+        metrics["succeeded"] += 1
+        self.breaker.record_success()
+        return result
+
+    def metrics(self) -> dict:
+        operations = {}
+        for operation, counts in self._metrics.items():
+            completed = counts["succeeded"] + counts["failed"] + counts["timed_out"]
+            operations[operation] = {
+                **{key: value for key, value in counts.items() if key != "latency_ms_total"},
+                "latency_ms_avg": round(counts["latency_ms_total"] / completed, 1) if completed else 0.0,
+                "latency_ms_max": round(counts["latency_ms_max"], 1)
+            }
+        return {
+            "configured": self.configured,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "operations": operations
+        }
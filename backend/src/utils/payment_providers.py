@@ -0,0 +1,224 @@
+import asyncio
+import json
+import logging
+import random
+import time
+import urllib.request
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlsplit
+from pymongo import ReturnDocument
+from ..models.payment import CheckoutSessionRequest, CheckoutSessionResponse, CheckoutStatusResponse
+from .webhooks import sign_payload
+
+logger = logging.getLogger(__name__)
+
+WebhookHandler = Callable[[bytes, str], Awaitable]
+
+class CheckoutProvider:
+    """Interface of a hosted checkout provider.
+
+    ``payment_method`` is recorded on payment_transactions created through it.
+    """
+
+    name = "base"
+    payment_method = "checkout"
+
+    async def create_checkout_session(self, request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        raise NotImplementedError
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        raise NotImplementedError
+
+    async def expire_checkout_session(self, session_id: str) -> bool:
+        """Close an open session so it can no longer be paid; False if it was not open"""
+        raise NotImplementedError
+
+class StripeCheckoutProvider(CheckoutProvider):
+    """Stripe Checkout through the emergentintegrations client"""
+
+    name = "stripe"
+    payment_method = "stripe_checkout"
+
+    def __init__(self, api_key: str):
+        # Imported here so the fake provider works without the Stripe client installed
+        from emergentintegrations.payments.stripe import checkout
+        import stripe
+        self._checkout = checkout
+        self._client = checkout.StripeCheckout(api_key=api_key)
+        self._stripe = stripe
+        self._api_key = api_key
+
+    async def create_checkout_session(self, request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        session = await self._client.create_checkout_session(self._checkout.CheckoutSessionRequest(
+            amount=request.amount,
+            currency=request.currency,
+            success_url=request.success_url,
+            cancel_url=request.cancel_url,
+            metadata=request.metadata
+        ))
+        return CheckoutSessionResponse(url=session.url, session_id=session.session_id)
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        checkout_status = await self._client.get_checkout_status(session_id)
+        return CheckoutStatusResponse(
+            status=checkout_status.status,
+            payment_status=checkout_status.payment_status,
+            amount_total=checkout_status.amount_total,
+            currency=checkout_status.currency,
+            metadata=checkout_status.metadata
+        )
+
+    async def expire_checkout_session(self, session_id: str) -> bool:
+        # Expiring goes to the Stripe SDK directly
+        try:
+            await asyncio.to_thread(self._stripe.checkout.Session.expire, session_id, api_key=self._api_key)
+        except self._stripe.error.InvalidRequestError as e:
+            # Stripe refuses to expire a session that is already complete or expired
+            logger.info(f"Stripe session {session_id} was not expired: {e}")
+            return False
+        return True
+
+class FakeCheckoutError(Exception):
+    pass
+
+# Fields of a stored fake session that Stripe reports for a checkout session
+SESSION_PROJECTION = {"_id": 0, "status": 1, "payment_status": 1, "amount_total": 1, "currency": 1, "metadata": 1}
+
+class FakeCheckoutProvider(CheckoutProvider):
+    """In-process stand-in for Stripe Checkout, for local runs, tests and benchmarks.
+
+    Every call waits ``latency_ms`` (jittered +-50%) and fails with probability
+    ``failure_rate``. Sessions are kept in the ``fake_checkout_sessions``
+    collection of ``db``, so every worker sees the same ones, and are paid or
+    expired with ``complete_session`` / ``expire_session``, which emit signed
+    ``checkout.session.*`` webhook events like Stripe does: posted to
+    ``webhook_url`` if set, otherwise handed to ``webhook_handler`` in
+    process. Checkout URLs point at the frontend's mock checkout page.
+    """
+
+    name = "fake"
+    payment_method = "fake_checkout"
+
+    def __init__(
+        self,
+        db = None,
+        latency_ms: float = 0.0,
+        failure_rate: float = 0.0,
+        webhook_secret: str = "",
+        webhook_url: Optional[str] = None,
+        webhook_handler: Optional[WebhookHandler] = None,
+        webhook_delay_ms: float = 0.0
+    ):
+        self.db = db
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.webhook_secret = webhook_secret
+        self.webhook_url = webhook_url
+        self.webhook_handler = webhook_handler
+        self.webhook_delay_ms = webhook_delay_ms
+        self._deliveries = set()
+
+    @property
+    def sessions(self):
+        if self.db is None:
+            raise FakeCheckoutError("Fake checkout provider has no database")
+        return self.db.fake_checkout_sessions
+
+    async def _simulate_call(self):
+        if self.latency_ms:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency_ms / 1000)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise FakeCheckoutError("Simulated checkout provider failure")
+
+    async def create_checkout_session(self, request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        await self._simulate_call()
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        await self.sessions.insert_one({
+            "id": session_id,
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": int(round(request.amount * 100)),
+            "currency": request.currency,
+            "metadata": request.metadata,
+            "created_at": datetime.utcnow()
+        })
+
+        origin = urlsplit(request.success_url)
+        url = f"{origin.scheme}://{origin.netloc}/#/mock-stripe-checkout?session_id={session_id}"
+        return CheckoutSessionResponse(url=url, session_id=session_id)
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        await self._simulate_call()
+        session = await self.sessions.find_one({"id": session_id}, SESSION_PROJECTION)
+        if session is None:
+            # Sessions are purged after a week; report them like an abandoned Stripe session
+            return CheckoutStatusResponse(status="expired", payment_status="unpaid", amount_total=0, currency="usd")
+        return CheckoutStatusResponse(**session)
+
+    async def expire_checkout_session(self, session_id: str) -> bool:
+        await self._simulate_call()
+        return await self.expire_session(session_id)
+
+    async def complete_session(self, session_id: str) -> bool:
+        """Pay an open session and emit checkout.session.completed; False if it was not open"""
+        return await self._close_session(session_id, "complete", "paid", "checkout.session.completed")
+
+    async def expire_session(self, session_id: str) -> bool:
+        """Expire an open session and emit checkout.session.expired; False if it was not open"""
+        return await self._close_session(session_id, "expired", "unpaid", "checkout.session.expired")
+
+    async def _close_session(self, session_id: str, status: str, payment_status: str, event_type: str) -> bool:
+        # Conditional on the session still being open, so only one close wins
+        session = await self.sessions.find_one_and_update(
+            {"id": session_id, "status": "open"},
+            {"$set": {"status": status, "payment_status": payment_status}},
+            projection=SESSION_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if session is None:
+            return False
+
+        event = {
+            "id": f"evt_fake_{uuid.uuid4().hex}",
+            "object": "event",
+            "type": event_type,
+            "created": int(time.time()),
+            "data": {"object": {"id": session_id, "object": "checkout.session", **session}}
+        }
+        if self.webhook_delay_ms:
+            # Deliver later, like Stripe; keep a reference so the task is not collected
+            task = asyncio.create_task(self._deliver(event, self.webhook_delay_ms / 1000))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        else:
+            await self._deliver(event)
+        return True
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Wait for webhooks still scheduled for delivery, e.g. before shutting down"""
+        if self._deliveries:
+            await asyncio.wait(set(self._deliveries), timeout=timeout)
+
+    async def _deliver(self, event: dict, delay: float = 0.0):
+        if delay:
+            await asyncio.sleep(delay)
+
+        payload = json.dumps(event).encode()
+        signature = sign_payload(payload, self.webhook_secret)
+        try:
+            if self.webhook_url:
+                await asyncio.to_thread(self._post, payload, signature)
+            elif self.webhook_handler is not None:
+                await self.webhook_handler(payload, signature)
+        except Exception as e:
+            logger.warning(f"Fake checkout webhook {event['type']} for {event['data']['object']['id']} failed: {e}")
+
+    def _post(self, payload: bytes, signature: str):
+        request = urllib.request.Request(self.webhook_url, data=payload, method="POST", headers={
+            "Content-Type": "application/json",
+            "Stripe-Signature": signature
+        })
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
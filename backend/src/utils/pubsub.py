@@ -0,0 +1,78 @@
+import asyncio
+from collections import deque
+from typing import Any, Dict, List, Optional, Set
+
+class Subscription:
+    """A subscriber's buffer of messages published to one topic.
+
+    A subscriber that falls more than ``maxsize`` messages behind has its buffer
+    dropped and ``overflowed`` set, and should re-read from the database.
+    """
+
+    def __init__(self, topic: str, maxsize: int):
+        self.topic = topic
+        self.maxsize = maxsize
+        self.overflowed = False
+        self._buffer: deque = deque()
+        self._ready = asyncio.Event()
+
+    def deliver(self, message: Any):
+        if len(self._buffer) >= self.maxsize:
+            self._buffer.clear()
+            self.overflowed = True
+        else:
+            self._buffer.append(message)
+        self._ready.set()
+
+    async def next_batch(self, timeout: Optional[float] = None) -> List[Any]:
+        """Wait for messages and return everything buffered; empty list on timeout"""
+        if not self._buffer and not self.overflowed:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+
+        self._ready.clear()
+        batch = list(self._buffer)
+        self._buffer.clear()
+        return batch
+
+class PubSubHub:
+    """In-process publish/subscribe hub.
+
+    Delivery is local to the worker process and best effort. Subscribers are
+    expected to catch up from the database after (re)subscribing.
+    """
+
+    def __init__(self, buffer_size: int = 256):
+        self.buffer_size = buffer_size
+        self._topics: Dict[str, Set[Subscription]] = {}
+
+    def subscribe(self, topic: str) -> Subscription:
+        subscription = Subscription(topic, self.buffer_size)
+        self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._topics.get(subscription.topic)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._topics[subscription.topic]
+
+    def publish(self, topic: str, message: Any) -> int:
+        """Deliver to every current subscriber of the topic; returns how many there were"""
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return 0
+        for subscription in subscribers:
+            subscription.deliver(message)
+        return len(subscribers)
+
+    def subscriber_count(self, topic: Optional[str] = None) -> int:
+        if topic is not None:
+            return len(self._topics.get(topic, ()))
+        return sum(len(subscribers) for subscribers in self._topics.values())
+
+hub = PubSubHub()
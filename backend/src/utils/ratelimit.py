@@ -0,0 +1,29 @@
+import asyncio
+import time
+from typing import Optional
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` acquisitions per second, in bursts of up to ``burst``"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it; a rate of 0 or less means unlimited"""
+        if self.rate <= 0:
+            return
+
+        # Callers queue on the lock, so tokens are handed out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
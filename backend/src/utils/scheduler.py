@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process as a lease holder
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+async def acquire_lease(db, name: str, seconds: float) -> bool:
+    """Hold the named lease for ``seconds`` if it is free, expired or already ours.
+
+    Leases live in ``job_checkpoints`` as ``lease:{name}``; the unique id
+    index makes a concurrent claim by another process fail with a duplicate key.
+    """
+    now = datetime.utcnow()
+    try:
+        await db.job_checkpoints.update_one(
+            {
+                "id": f"lease:{name}",
+                "$or": [{"lease_until": {"$lte": now}}, {"owner": WORKER_ID}]
+            },
+            {"$set": {"owner": WORKER_ID, "lease_until": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+class Job:
+    def __init__(self, name: str, interval: float, func: Callable[..., Awaitable], args: tuple):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.task: Optional[asyncio.Task] = None
+
+    async def run_once(self):
+        started = time.perf_counter()
+        try:
+            result = await self.func(*self.args)
+        except Exception:
+            logger.exception(f"Scheduled job {self.name} failed")
+            return None
+        logger.debug(f"Scheduled job {self.name} finished in {(time.perf_counter() - started) * 1000:.1f} ms: {result}")
+        return result
+
+    async def run_forever(self, stopping: asyncio.Event, lease_db=None):
+        while True:
+            try:
+                await asyncio.wait_for(stopping.wait(), self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if lease_db is not None:
+                try:
+                    if not await acquire_lease(lease_db, self.name, self.interval):
+                        continue
+                except Exception:
+                    logger.exception(f"Could not take the lease for scheduled job {self.name}")
+                    continue
+            await self.run_once()
+
+class Scheduler:
+    """Runs registered coroutine functions every ``interval`` seconds on the event loop.
+
+    Started with a database, a job only runs in the process holding its
+    lease, so several workers do not all run it every interval.
+    """
+
+    def __init__(self):
+        self._jobs: List[Job] = []
+        self._stopping: Optional[asyncio.Event] = None
+
+    def add_job(self, name: str, interval: float, func: Callable[..., Awaitable], *args):
+        """Register a job; an interval of 0 or less disables it"""
+        if interval <= 0:
+            logger.info(f"Scheduled job {name} is disabled")
+            return
+        self._jobs.append(Job(name, interval, func, args))
+
+    def start(self, lease_db=None):
+        self._stopping = asyncio.Event()
+        for job in self._jobs:
+            if job.task is None:
+                job.task = asyncio.create_task(job.run_forever(self._stopping, lease_db))
+
+    async def stop(self, grace: float = 0.0):
+        """Stop the jobs, giving a run in progress up to ``grace`` seconds to finish"""
+        if self._stopping is not None:
+            self._stopping.set()
+        tasks = [job.task for job in self._jobs if job.task is not None]
+        if tasks and grace > 0:
+            await asyncio.wait(tasks, timeout=grace)
+        for task in tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for job in self._jobs:
+            job.task = None
+        self._jobs.clear()
+
+scheduler = Scheduler()
@@ -2,6 +2,8 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
+import hashlib
+import hmac
 import os
 from dotenv import load_dotenv
 
@@ -38,3 +40,12 @@ def decode_token(token: str):
         return payload
     except JWTError:
         return None
+
+def hash_backup_code(code: str) -> str:
+    """Keyed hash of a 2FA backup code; deterministic so it can be matched in a query"""
+    normalized = code.strip().upper()
+    return hmac.new(SECRET_KEY.encode(), normalized.encode(), hashlib.sha256).hexdigest()
+
+def derive_secret(purpose: str) -> str:
+    """Secret for ``purpose`` derived from SECRET_KEY, so every worker computes the same one"""
+    return hmac.new(SECRET_KEY.encode(), purpose.encode(), hashlib.sha256).hexdigest()
@@ -0,0 +1,33 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one in-flight call.
+
+    The first caller for a key starts ``func``; callers arriving before it
+    finishes await the same result (or exception). Nothing is remembered
+    once the call completes, so combine with TTLCache for caching.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable], *args) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args))
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+
+        # A caller that goes away must not cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, done: asyncio.Future):
+        if self._calls.get(key) is done:
+            del self._calls[key]
+        if not done.cancelled():
+            # Mark the exception retrieved even if every waiter was cancelled
+            done.exception()
+
+    def __len__(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import pyotp
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+TOTP_VALID_WINDOW = int(os.environ.get('TOTP_VALID_WINDOW', '1'))
+TOTP_LAST_USED_FLUSH_SECONDS = float(os.environ.get('TOTP_LAST_USED_FLUSH_SECONDS', '30'))
+
+class TOTPVerifier:
+    """Verify TOTP codes and reject any code already accepted for the same time step.
+
+    Used (user, time step) pairs are claimed in the ``totp_used_codes``
+    collection, whose unique id turns a second claim into a duplicate key
+    error in every worker process; a TTL index drops them once the step is
+    out of the window. Claims seen by this process are also remembered in
+    memory so obvious replays skip the round trip.
+    """
+
+    def __init__(self, valid_window: int = 1, interval: int = 30):
+        self.valid_window = valid_window
+        self.interval = interval
+        # A step can only match while it is inside the window, so remembering
+        # it for the whole window is enough to stop replays.
+        self.replay_ttl = (2 * valid_window + 1) * interval
+        self._used_steps = TTLCache(maxsize=100000, ttl=self.replay_ttl)
+
+    def match_time_step(self, secret: str, totp_code: str, for_time: Optional[float] = None) -> Optional[int]:
+        """Return the time step the code is valid for, or None"""
+        if not totp_code:
+            return None
+
+        totp = pyotp.TOTP(secret, interval=self.interval)
+        current_step = totp.timecode(datetime.fromtimestamp(for_time or time.time()))
+        for offset in range(-self.valid_window, self.valid_window + 1):
+            step = current_step + offset
+            if pyotp.utils.strings_equal(str(totp_code), totp.generate_otp(step)):
+                return step
+        return None
+
+    async def _claim_step(self, db, user_id: str, step: int) -> bool:
+        key = (user_id, step)
+        if key in self._used_steps:
+            return False
+
+        # Remember the step only once the database has it; after any other
+        # error the code can be tried again
+        try:
+            await db.totp_used_codes.insert_one({
+                "id": f"{user_id}:{step}",
+                "user_id": user_id,
+                "step": step,
+                "expires_at": datetime.utcnow() + timedelta(seconds=self.replay_ttl)
+            })
+        except DuplicateKeyError:
+            self._used_steps.set(key, True)
+            return False
+        self._used_steps.set(key, True)
+        return True
+
+    async def verify(self, db, user_id: str, secret: str, totp_code: str) -> bool:
+        """Check the code and consume its time step so it cannot be used again"""
+        step = self.match_time_step(secret, totp_code)
+        if step is None:
+            return False
+        return await self._claim_step(db, user_id, step)
+
+class LastUsedRecorder:
+    """Buffer 2FA ``last_used`` timestamps and write them to Mongo in periodic bulk updates"""
+
+    def __init__(self, interval: float = 30.0):
+        self.interval = interval
+        self._pending: Dict[str, datetime] = {}
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: str, used_at: Optional[datetime] = None):
+        self._pending[user_id] = used_at or datetime.utcnow()
+
+    async def flush(self, db=None) -> int:
+        """Write buffered timestamps; returns the number of users flushed"""
+        db = db if db is not None else self._db
+        if db is None or not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        operations = [
+            UpdateOne({"user_id": user_id}, {"$max": {"last_used": used_at}})
+            for user_id, used_at in pending.items()
+        ]
+        try:
+            await db.two_factor_auth.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to flush 2FA last_used updates: {e}")
+            # Put the entries back unless a newer timestamp arrived meanwhile
+            for user_id, used_at in pending.items():
+                if used_at > self._pending.get(user_id, datetime.min):
+                    self._pending[user_id] = used_at
+            return 0
+
+        return len(operations)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self, db):
+        self._db = db
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+totp_verifier = TOTPVerifier(valid_window=TOTP_VALID_WINDOW)
+last_used_recorder = LastUsedRecorder(interval=TOTP_LAST_USED_FLUSH_SECONDS)
@@ -0,0 +1,38 @@
+import hashlib
+import hmac
+import time
+from typing import Optional
+
+def sign_payload(payload: bytes, secret: str, timestamp: Optional[int] = None) -> str:
+    """Build a Stripe-Signature header value for ``payload``"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signed = f"{timestamp}.".encode() + payload
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+def verify_signature(payload: bytes, header: Optional[str], secret: str, tolerance: float = 300) -> bool:
+    """Check a Stripe-Signature header: an HMAC-SHA256 of ``"{t}.{payload}"`` under the endpoint secret.
+
+    Any v1 signature may match, which lets Stripe roll secrets. Timestamps
+    older than ``tolerance`` seconds are rejected to limit replays.
+    """
+    if not header or not secret:
+        return False
+
+    timestamp = None
+    signatures = []
+    for part in header.split(","):
+        key, _, value = part.strip().partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        return False
+    if tolerance and abs(time.time() - int(timestamp)) > tolerance:
+        return False
+
+    signed = f"{timestamp}.".encode() + payload
+    expected = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return any(hmac.compare_digest(expected, signature) for signature in signatures)
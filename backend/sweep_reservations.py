@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Add current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+from src.config.database import get_database, close_mongo_connection
+from src.controllers.reservation_controller import (
+    release_stale_reservations,
+    RESERVATION_HOLD_MINUTES,
+    RESERVATION_SWEEP_BATCH_SIZE
+)
+
+async def sweep(hold_minutes: float, batch_size: int):
+    """Run the stale reservation sweep once, outside the API process"""
+
+    try:
+        # Get database
+        db = await get_database()
+
+        result = await release_stale_reservations(db, hold_minutes, batch_size)
+
+        print(f"✅ Released {result['domains_released']} domains held longer than {hold_minutes:g} minutes")
+        print(f"   Expired transactions: {result['transactions_expired']}")
+        print(f"   Expired payments: {result['payments_expired']}")
+        print(f"   Took {result['duration_ms']} ms")
+
+    except Exception as e:
+        print(f"❌ Error sweeping reservations: {e}")
+
+    finally:
+        # Close database connection
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Release domains stuck in pending")
+    parser.add_argument("--hold-minutes", type=float, default=RESERVATION_HOLD_MINUTES)
+    parser.add_argument("--batch-size", type=int, default=RESERVATION_SWEEP_BATCH_SIZE)
+    args = parser.parse_args()
+
+    asyncio.run(sweep(args.hold_minutes, args.batch_size))
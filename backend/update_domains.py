@@ -5,7 +5,7 @@ from pathlib import Path
 # Add current directory to Python path
 sys.path.append(str(Path(__file__).parent))
 
-from src.config.database import get_database, client
+from src.config.database import get_database, close_mongo_connection
 from datetime import datetime
 
 async def update_domain_statuses():
@@ -56,8 +56,7 @@ async def update_domain_statuses():
     
     finally:
         # Close database connection
-        if client:
-            client.close()
+        await close_mongo_connection()
 
 if __name__ == "__main__":
     asyncio.run(update_domain_statuses())
\ No newline at end of file
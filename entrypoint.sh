@@ -4,25 +4,44 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
-echo "Starting FastAPI backend"
+# One worker process per CPU core unless WEB_CONCURRENCY says otherwise. Each
+# worker runs the app lifespan and opens its own MongoDB connection pool.
+WORKERS="${WEB_CONCURRENCY:-$(nproc)}"
+# Seconds open requests get to finish on shutdown before workers are stopped
+GRACEFUL_SHUTDOWN_SECONDS="${GRACEFUL_SHUTDOWN_SECONDS:-30}"
+# How long to wait for the backend to report ready at startup
+STARTUP_TIMEOUT_SECONDS="${STARTUP_TIMEOUT_SECONDS:-60}"
+
+echo "Starting FastAPI backend with $WORKERS worker(s)"
 # Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
+uvicorn server:app --host 0.0.0.0 --port 8001 \
+    --workers "$WORKERS" \
+    --timeout-graceful-shutdown "$GRACEFUL_SHUTDOWN_SECONDS" &
 BACKEND_PID=$!
 
-echo "Waiting for backend to start..."
-sleep 30
-
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
-fi
+echo "Waiting for backend to become ready..."
+WAITED=0
+until wget -q -O /dev/null http://127.0.0.1:8001/readyz 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ "$WAITED" -ge "$STARTUP_TIMEOUT_SECONDS" ]; then
+        echo "Backend not ready after ${STARTUP_TIMEOUT_SECONDS}s, exiting"
+        kill $BACKEND_PID
+        exit 1
+    fi
+    sleep 1
+    WAITED=$((WAITED + 1))
+done
+echo "Backend is ready"
 
 # Start Nginx
 nginx -g 'daemon off;' &
 NGINX_PID=$!
 
-# Handle termination signals
-trap 'kill $BACKEND_PID $NGINX_PID; exit 0' SIGTERM SIGINT
+# Handle termination signals: stop taking traffic, then let the backend drain
+trap 'kill $NGINX_PID 2>/dev/null || true; kill -TERM $BACKEND_PID 2>/dev/null || true; wait $BACKEND_PID || true; exit 0' SIGTERM SIGINT
 
 # Check if processes are still running
 while kill -0 $BACKEND_PID 2>/dev/null && kill -0 $NGINX_PID 2>/dev/null; do
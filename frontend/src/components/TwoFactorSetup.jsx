@@ -16,7 +16,8 @@ const TwoFactorSetup = ({ isOpen, onClose, onSuccess }) => {
     try {
       const response = await authAPI.setup2FA();
       setQrCode(response.setup_qr_uri);
-      setBackupCodes(response.recovery_codes);
+      // Only the call that generated the codes returns them
+      setBackupCodes(response.recovery_codes || []);
       setStep('setup');
     } catch (error) {
       setError(error.response?.data?.detail || 'Failed to setup 2FA');
@@ -149,32 +150,40 @@ const TwoFactorSetup = ({ isOpen, onClose, onSuccess }) => {
               
               <div className="bg-yellow-50 border border-yellow-200 rounded-lg p-4 mb-6">
                 <h4 className="font-semibold text-yellow-800 mb-2">⚠️ Save Backup Codes</h4>
-                <p className="text-yellow-700 mb-3">
-                  Save these backup codes in a secure location. You can use them to access your account if you lose your authenticator device.
-                </p>
-                
-                <div className="bg-white border border-gray-200 rounded p-3 mb-3">
-                  <div className="grid grid-cols-2 gap-2 text-sm font-mono">
-                    {backupCodes.map((code, index) => (
-                      <div key={index} className="text-gray-800">{code}</div>
-                    ))}
-                  </div>
-                </div>
-                
-                <div className="flex space-x-2">
-                  <button
-                    onClick={copyBackupCodes}
-                    className="bg-yellow-600 hover:bg-yellow-700 text-white text-sm px-3 py-1 rounded"
-                  >
-                    📋 Copy
-                  </button>
-                  <button
-                    onClick={downloadBackupCodes}
-                    className="bg-yellow-600 hover:bg-yellow-700 text-white text-sm px-3 py-1 rounded"
-                  >
-                    💾 Download
-                  </button>
-                </div>
+                {backupCodes.length > 0 ? (
+                  <>
+                    <p className="text-yellow-700 mb-3">
+                      Save these backup codes in a secure location. You can use them to access your account if you lose your authenticator device.
+                    </p>
+                    
+                    <div className="bg-white border border-gray-200 rounded p-3 mb-3">
+                      <div className="grid grid-cols-2 gap-2 text-sm font-mono">
+                        {backupCodes.map((code, index) => (
+                          <div key={index} className="text-gray-800">{code}</div>
+                        ))}
+                      </div>
+                    </div>
+                    
+                    <div className="flex space-x-2">
+                      <button
+                        onClick={copyBackupCodes}
+                        className="bg-yellow-600 hover:bg-yellow-700 text-white text-sm px-3 py-1 rounded"
+                      >
+                        📋 Copy
+                      </button>
+                      <button
+                        onClick={downloadBackupCodes}
+                        className="bg-yellow-600 hover:bg-yellow-700 text-white text-sm px-3 py-1 rounded"
+                      >
+                        💾 Download
+                      </button>
+                    </div>
+                  </>
+                ) : (
+                  <p className="text-yellow-700">
+                    Your backup codes were shown when you started this setup and are not shown again. If you did not save them, regenerate them once 2FA is enabled.
+                  </p>
+                )}
               </div>
             </div>
             
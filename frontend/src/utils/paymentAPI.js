@@ -1,5 +1,43 @@
 import axios from 'axios';
 
+// One Idempotency-Key per checkout attempt and domain, so double clicks and
+// retries of a failed request get the same checkout session back. The key is
+// dropped once the attempt is over: when the server answered it, or when the
+// page comes back from the browser's cache after leaving for the checkout.
+let checkoutKeys = {};
+
+const checkoutKeyFor = (domainId) => {
+  if (!checkoutKeys[domainId]) {
+    checkoutKeys[domainId] = window.crypto?.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+  }
+  return checkoutKeys[domainId];
+};
+
+const endCheckoutAttempt = (domainId, key) => {
+  if (checkoutKeys[domainId] === key) {
+    delete checkoutKeys[domainId];
+  }
+};
+
+// Keep the key only for retryable failures: no response, a server error, or a
+// 409 while the first request is still creating the session
+const isRetryable = (error) =>
+  !error.response || error.response.status >= 500 || error.response.status === 409;
+
+window.addEventListener('pageshow', (event) => {
+  if (event.persisted) {
+    checkoutKeys = {};
+  }
+});
+
+// Checkouts hold domains for the signed-in buyer, so they need the bearer token
+const authHeaders = () => {
+  const token = localStorage.getItem('token');
+  return token ? { Authorization: `Bearer ${token}` } : {};
+};
+
 // Payment API utilities for Stripe integration
 export const paymentAPI = {
   
@@ -7,15 +45,42 @@ export const paymentAPI = {
   createDomainCheckout: async (domainId, domainName) => {
     const originUrl = window.location.origin;
     
-    const response = await axios.post('/payments/checkout/domain', {
-      domain_id: domainId,
-      domain_name: domainName,
-      origin_url: originUrl,
+    const idempotencyKey = checkoutKeyFor(domainId);
+    try {
+      const response = await axios.post('/payments/checkout/domain', {
+        domain_id: domainId,
+        domain_name: domainName,
+        origin_url: originUrl,
+        currency: 'usd',
+        metadata: {
+          source: 'domain_marketplace',
+          timestamp: new Date().toISOString()
+        }
+      }, {
+        headers: { ...authHeaders(), 'Idempotency-Key': idempotencyKey }
+      });
+      endCheckoutAttempt(domainId, idempotencyKey);
+      return response.data;
+    } catch (error) {
+      if (!isRetryable(error)) {
+        endCheckoutAttempt(domainId, idempotencyKey);
+      }
+      throw error;
+    }
+  },
+
+  // Create one checkout session for several domains; fails with 409 if any is taken
+  createCartCheckout: async (domainIds) => {
+    const response = await axios.post('/payments/checkout/cart', {
+      domain_ids: domainIds,
+      origin_url: window.location.origin,
       currency: 'usd',
       metadata: {
         source: 'domain_marketplace',
         timestamp: new Date().toISOString()
       }
+    }, {
+      headers: authHeaders()
     });
     
     return response.data;
@@ -35,14 +100,64 @@ export const paymentAPI = {
     }
   },
 
-  // Get user's payment history
-  getPaymentHistory: async () => {
-    const response = await axios.get('/payments/history');
-    return response.data;
+  // Get a page of the user's payment history; params: role, status, limit, cursor, detail.
+  // The next page's cursor is returned as nextCursor (null on the last page)
+  getPaymentHistory: async (params = {}) => {
+    const response = await axios.get('/payments/history', { params, headers: authHeaders() });
+    return { payments: response.data, nextCursor: response.headers['x-next-cursor'] || null };
   },
 
-  // Poll payment status with retry logic
+  // Stream payment status over server-sent events until it is final or timeoutMs passes
+  watchPaymentStatus: (sessionId, timeoutMs = 30000) => {
+    return new Promise((resolve, reject) => {
+      if (typeof EventSource === 'undefined') {
+        reject(new Error('EventSource not supported'));
+        return;
+      }
+
+      const source = new EventSource(`${axios.defaults.baseURL || ''}/payments/status/${sessionId}/stream`);
+      let lastStatus = null;
+
+      const finish = (result) => {
+        clearTimeout(timer);
+        source.close();
+        resolve(result);
+      };
+
+      const timer = setTimeout(() => {
+        finish({ success: false, status: lastStatus, error: 'Payment status check timed out' });
+      }, timeoutMs);
+
+      source.addEventListener('status', (event) => {
+        lastStatus = JSON.parse(event.data);
+        console.log('📊 Payment status update:', lastStatus);
+
+        if (lastStatus.payment_status === 'paid') {
+          finish({ success: true, status: lastStatus });
+        } else if (['failed', 'expired', 'canceled'].includes(lastStatus.payment_status)) {
+          finish({ success: false, status: lastStatus });
+        }
+      });
+
+      source.onerror = () => {
+        // Nothing received yet means the stream is unavailable; let the caller poll instead
+        if (lastStatus === null) {
+          clearTimeout(timer);
+          source.close();
+          reject(new Error('Payment status stream unavailable'));
+        }
+      };
+    });
+  },
+
+  // Wait for the payment status, streaming it when possible and polling otherwise
   pollPaymentStatus: async (sessionId, maxAttempts = 10, interval = 2000) => {
+    try {
+      return await paymentAPI.watchPaymentStatus(sessionId, maxAttempts * interval);
+    } catch (error) {
+      console.warn('Falling back to polling payment status:', error.message);
+    }
+
     let attempts = 0;
     
     const poll = async () => {
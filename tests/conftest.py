@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import mongomock.collection
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+# The backend is not an installed package; import it the way server.py does
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+_find_and_modify = mongomock.collection.Collection._find_and_modify
+
+def _find_and_modify_by_id(self, query, projection=None, update=None, upsert=False, sort=None, *args, **kwargs):
+    # mongomock re-reads the AFTER document with the original filter unless the
+    # projection keeps _id, so a write that changes a filtered field returns
+    # None; pin the match by _id first like the server does
+    match = self.find_one(query, projection={"_id": 1}, sort=sort)
+    if match:
+        query = {"_id": match["_id"]}
+    return _find_and_modify(self, query, projection, update, upsert, sort, *args, **kwargs)
+
+mongomock.collection.Collection._find_and_modify = _find_and_modify_by_id
+
+@pytest.fixture
+def db():
+    """Fresh in-memory Mongo database per test"""
+    return AsyncMongoMockClient()["dngun_test"]
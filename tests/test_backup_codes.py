@@ -0,0 +1,58 @@
+import asyncio
+
+from src.controllers.two_factor_controller import pending_setup_cache, setup_two_factor, verify_backup_code
+from src.models.user import User
+from src.utils.security import hash_backup_code
+
+
+def make_user():
+    return User(email="alice@example.com", username="alice", hashed_password="x")
+
+
+async def enrolled(db, user, backup_codes):
+    await db.two_factor_auth.insert_one(
+        {"user_id": user.id, "secret": "S", "is_enabled": True, "backup_codes": backup_codes}
+    )
+
+
+def test_concurrent_requests_consume_a_code_once(db):
+    user = make_user()
+
+    async def scenario():
+        await enrolled(db, user, [hash_backup_code("ABCD-EFGH"), hash_backup_code("IJKL-MNOP")])
+        results = await asyncio.gather(*(verify_backup_code(user, "ABCD-EFGH", db) for _ in range(5)))
+        assert results.count(True) == 1
+        two_factor = await db.two_factor_auth.find_one({"user_id": user.id})
+        assert two_factor["backup_codes"] == [hash_backup_code("IJKL-MNOP")]
+
+    asyncio.run(scenario())
+
+
+def test_legacy_plaintext_code_is_consumed(db):
+    user = make_user()
+
+    async def scenario():
+        await enrolled(db, user, ["ABCD-EFGH"])
+        assert await verify_backup_code(user, "abcd-efgh", db)
+        assert not await verify_backup_code(user, "ABCD-EFGH", db)
+        assert (await db.two_factor_auth.find_one({"user_id": user.id}))["backup_codes"] == []
+
+    asyncio.run(scenario())
+
+
+def test_setup_shows_plaintext_codes_once(db):
+    pending_setup_cache.clear()
+    user = make_user()
+
+    async def scenario():
+        await db.users.insert_one(user.dict())
+        first = await setup_two_factor(user, db, qr_format="uri")
+        assert len(first.recovery_codes) == 10
+        cached = pending_setup_cache.get(user.id)
+        assert not set(first.recovery_codes) & set(cached["backup_codes"])
+
+        again = await setup_two_factor(user, db, qr_format="uri")
+        assert again.recovery_codes is None
+        assert (again.provisioning_uri, again.backup_codes_remaining) == (first.provisioning_uri, 10)
+
+    asyncio.run(scenario())
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from src.utils import cache
+from src.utils.cache import TTLCache
+from src.utils.singleflight import SingleFlight
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def test_entries_expire_after_their_ttl(clock):
+    entries = TTLCache(ttl=10)
+    entries.set("a", 1)
+    entries.set("b", 2, ttl=30)
+    clock.now += 11
+    assert entries.get("a") is None
+    assert "a" not in entries
+    assert entries.get("b") == 2
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    entries = TTLCache(maxsize=2)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.get("a")
+    entries.set("c", 3)
+    assert "b" not in entries
+    assert entries.get("a") == 1 and entries.get("c") == 3
+
+
+def test_falsy_values_are_cached(clock):
+    entries = TTLCache()
+    entries.set("zero", 0)
+    assert "zero" in entries
+    assert entries.pop("zero") == 0
+    assert entries.pop("zero", "gone") == "gone"
+
+
+def test_concurrent_calls_share_one_flight():
+    flight = SingleFlight()
+    calls = []
+
+    async def lookup(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"value-{key}"
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do("k", lookup, "k") for _ in range(10)), flight.do("other", lookup, "other"))
+        assert len(flight) == 0
+        return results
+
+    results = asyncio.run(scenario())
+    assert results == ["value-k"] * 10 + ["value-other"]
+    assert calls == ["k", "other"]
+
+
+def test_errors_reach_every_waiter_and_are_not_remembered():
+    flight = SingleFlight()
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("provider down")
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        with pytest.raises(RuntimeError):
+            await flight.do("k", failing)
+
+    asyncio.run(scenario())
+    assert len(attempts) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    flight = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def scenario():
+        impatient = asyncio.ensure_future(flight.do("k", slow))
+        patient = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        return await patient
+
+    assert asyncio.run(scenario()) == "done"
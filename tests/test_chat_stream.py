@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.config.database import get_database
+from src.controllers.transaction_controller import chat_pollers, stream_transaction_chat
+from src.models.user import User
+from src.routes.transaction_routes import router
+from src.utils.security import create_access_token
+
+
+def chat_message(transaction_id, message_id, text):
+    return {
+        "id": message_id, "transaction_id": transaction_id, "user_id": "u", "username": "u",
+        "message": text, "sender_type": "user", "timestamp": datetime.utcnow()
+    }
+
+
+def test_stream_picks_up_messages_written_by_another_worker(db):
+    async def scenario():
+        await db.transaction_chats.insert_one(chat_message("t1", "m1", "backlog"))
+        stream = stream_transaction_chat("t1", None, db, keepalive=60, poll=0.05)
+        assert (await stream.__anext__())["id"] == "m1"
+
+        # Inserted without publishing to this process's hub
+        await db.transaction_chats.insert_one(chat_message("t1", "m2", "from elsewhere"))
+        message = await asyncio.wait_for(stream.__anext__(), 2)
+        await stream.aclose()
+        return message
+
+    assert asyncio.run(scenario())["id"] == "m2"
+
+
+def test_streams_of_a_chat_share_one_poller(db):
+    async def scenario():
+        await db.transaction_chats.insert_one(chat_message("t1", "m1", "backlog"))
+        streams = [stream_transaction_chat("t1", "m1", db, keepalive=60, poll=0.05) for _ in range(3)]
+        readers = [asyncio.ensure_future(stream.__anext__()) for stream in streams]
+        while chat_pollers.get("t1") is None or chat_pollers["t1"].streams < 3:
+            await asyncio.sleep(0.01)
+        assert list(chat_pollers) == ["t1"]
+
+        await db.transaction_chats.insert_one(chat_message("t1", "m2", "from elsewhere"))
+        messages = await asyncio.wait_for(asyncio.gather(*readers), 2)
+        for stream in streams:
+            await stream.aclose()
+        assert "t1" not in chat_pollers
+        return messages
+
+    assert [message["id"] for message in asyncio.run(scenario())] == ["m2"] * 3
+
+
+def test_stream_yields_keepalive_when_idle(db):
+    async def scenario():
+        stream = stream_transaction_chat("t1", None, db, keepalive=0.1, poll=0.05)
+        message = await asyncio.wait_for(stream.__anext__(), 2)
+        await stream.aclose()
+        return message
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_websocket_rejects_malformed_frames_and_echoes_messages(db):
+    buyer = User(email="b@example.com", username="buyer", hashed_password="x")
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+
+    async def database():
+        return db
+    app.dependency_overrides[get_database] = database
+
+    with TestClient(app) as client:
+        client.portal.call(db.users.insert_one, buyer.dict())
+        client.portal.call(db.transactions.insert_one, {"id": "t1", "buyer_id": buyer.id, "seller_id": "s", "status": "pending"})
+        token = create_access_token({"sub": buyer.id})
+
+        with client.websocket_connect(f"/api/transactions/t1/chat/ws?token={token}") as ws:
+            ws.send_text("not json")
+            assert ws.receive_json() == {"error": "Invalid chat message"}
+            ws.send_bytes(b"\x00")
+            assert ws.receive_json() == {"error": "Invalid chat message"}
+            ws.send_json({"message": "hello"})
+            assert ws.receive_json()["message"] == "hello"
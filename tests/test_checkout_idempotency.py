@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.controllers import payment_controller
+from src.controllers.payment_controller import PaymentController
+from src.controllers.reservation_controller import release_cart_reservations
+from src.models.domain import Domain
+from src.models.payment import StripeCheckoutRequest
+from src.models.user import User
+from src.utils.cache import TTLCache
+from src.utils.payment_client import PaymentProviderClient
+from src.utils.payment_providers import FakeCheckoutProvider
+
+
+@pytest.fixture
+def provider(db, monkeypatch):
+    provider = FakeCheckoutProvider(db)
+    monkeypatch.setattr(payment_controller, "payment_client", PaymentProviderClient(provider))
+    monkeypatch.setattr(payment_controller, "checkout_idempotency_cache", TTLCache(maxsize=100, ttl=60))
+    return provider
+
+
+async def listed_domain(db, name="idem"):
+    domain = Domain(name=name, extension=".com", price=25, category="tech", seller_id="seller")
+    await db.domains.insert_one(domain.dict())
+    return domain
+
+
+def checkout(db, buyer, domain, key):
+    request = StripeCheckoutRequest(domain_id=domain.id, origin_url="http://shop")
+    return PaymentController.create_domain_checkout(request, buyer, db, key)
+
+
+def test_retry_with_the_same_key_replays_the_session(db, provider):
+    buyer = User(email="buyer@example.com", username="buyer", hashed_password="x")
+
+    async def scenario():
+        domain = await listed_domain(db)
+        first = await checkout(db, buyer, domain, "key-1")
+        second = await checkout(db, buyer, domain, "key-1")
+        assert second.session_id == first.session_id
+        assert await db.payment_transactions.count_documents({}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_new_key_reuses_the_buyers_open_session(db, provider):
+    buyer = User(email="buyer@example.com", username="buyer", hashed_password="x")
+
+    async def scenario():
+        domain = await listed_domain(db)
+        first = await checkout(db, buyer, domain, "click-1")
+        second = await checkout(db, buyer, domain, "click-2")
+        assert second.session_id == first.session_id
+        # The second key now replays that session too
+        assert (await checkout(db, buyer, domain, "click-2")).session_id == first.session_id
+        assert await db.payment_transactions.count_documents({}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_clicks_open_one_session(db, provider):
+    buyer = User(email="buyer@example.com", username="buyer", hashed_password="x")
+
+    async def scenario():
+        domain = await listed_domain(db)
+        results = await asyncio.gather(
+            *(checkout(db, buyer, domain, f"click-{i}") for i in range(5)), return_exceptions=True
+        )
+        sessions = {result.session_id for result in results if not isinstance(result, Exception)}
+        assert len(sessions) == 1
+        assert all(result.status_code == 409 for result in results if isinstance(result, HTTPException))
+        assert await db.payment_transactions.count_documents({}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_key_reused_for_another_request_is_rejected(db, provider):
+    buyer = User(email="buyer@example.com", username="buyer", hashed_password="x")
+
+    async def scenario():
+        await checkout(db, buyer, await listed_domain(db, "one"), "key-1")
+        with pytest.raises(HTTPException) as error:
+            await checkout(db, buyer, await listed_domain(db, "two"), "key-1")
+        assert error.value.status_code == 422
+
+    asyncio.run(scenario())
+
+
+def test_closed_session_is_not_reused(db, provider):
+    buyer = User(email="buyer@example.com", username="buyer", hashed_password="x")
+
+    async def scenario():
+        domain = await listed_domain(db)
+        first = await checkout(db, buyer, domain, "click-1")
+        payment = await db.payment_transactions.find_one_and_update(
+            {"stripe_session_id": first.session_id}, {"$set": {"payment_status": "expired"}}
+        )
+        await release_cart_reservations(db, [payment["cart_id"]])
+        second = await checkout(db, buyer, domain, "click-2")
+        assert second.session_id != first.session_id
+        # A retry with the first key gets the open session, not the closed one
+        assert (await checkout(db, buyer, domain, "click-1")).session_id == second.session_id
+        assert await db.payment_transactions.count_documents({}) == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,29 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.config import database
+
+
+class FlakyAdmin:
+    def __init__(self):
+        self.calls = 0
+
+    async def command(self, name):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("server starting")
+        return {"setName": "rs0"}
+
+
+def test_failed_transaction_probe_is_retried(monkeypatch):
+    monkeypatch.setattr(database, "_transactions_supported", None)
+    admin = FlakyAdmin()
+    db = SimpleNamespace(client=SimpleNamespace(admin=admin))
+
+    async def scenario():
+        assert await database.supports_transactions(db) is False
+        assert await database.supports_transactions(db) is True
+        assert await database.supports_transactions(db) is True
+
+    asyncio.run(scenario())
+    assert admin.calls == 2
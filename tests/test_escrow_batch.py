@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.controllers.escrow_controller import open_escrow_batch
+from src.middleware.auth import get_current_admin_user
+from src.models.payment import CartItem, EscrowBatchRequest, PaymentTransaction
+from src.routes.payment_routes import router
+
+
+async def paid_payments(db, count, transaction_status="completed", **fields):
+    start = datetime.utcnow() - timedelta(days=1)
+    payments = [
+        PaymentTransaction(amount=10, stripe_session_id=f"cs_{i}", payment_status="paid",
+                           created_at=start + timedelta(seconds=i), **fields).dict()
+        for i in range(count)
+    ]
+    await db.payment_transactions.insert_many(payments)
+    # The escrow transactions opened for them, one per domain of a cart
+    await db.transactions.insert_many([
+        {"id": f"{payment['id']}:{item['domain_id']}", "payment_id": payment["id"],
+         "domain_id": item["domain_id"], "status": transaction_status}
+        for payment in payments
+        for item in payment["items"] or [{"domain_id": payment["domain_id"]}]
+    ])
+    return [payment["id"] for payment in payments]
+
+
+def cart_items():
+    return [
+        CartItem(domain_id="d1", domain_name="one.com", seller_id="seller", amount=5),
+        CartItem(domain_id="d2", domain_name="two.com", seller_id="other", amount=5)
+    ]
+
+
+async def run_batch(db, request):
+    return [result async for result in await open_escrow_batch(db, request)]
+
+
+def test_run_that_uses_up_the_selection_is_completed(db):
+    async def scenario():
+        await paid_payments(db, 4, seller_id="seller")
+        request = EscrowBatchRequest(action="release", batch_id="b1", seller_id="seller", max_payments=2)
+        first = (await run_batch(db, request))[-1]["summary"]
+        assert (first["applied"], first["completed"]) == (2, False)
+
+        second = (await run_batch(db, request))[-1]["summary"]
+        assert (second["applied"], second["completed"]) == (4, True)
+        assert await db.payment_transactions.count_documents({"payment_status": "released_to_seller"}) == 4
+
+    asyncio.run(scenario())
+
+
+def test_release_needs_a_completed_escrow_transaction(db):
+    async def scenario():
+        [open_payment] = await paid_payments(db, 1, transaction_status="pending", seller_id="seller")
+        results = await run_batch(db, EscrowBatchRequest(action="release", seller_id="seller"))
+        assert results[0] == {"payment_id": open_payment, "result": "skipped",
+                              "payment_status": "paid", "transaction_status": "pending"}
+        assert results[-1]["summary"]["applied"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_seller_filter_settles_only_that_sellers_cart_items(db):
+    async def scenario():
+        await paid_payments(db, 1, seller_id="seller")
+        [cart_payment] = await paid_payments(db, 1, cart_id="cart", items=cart_items())
+        await paid_payments(db, 1, seller_id="other")
+
+        results = await run_batch(db, EscrowBatchRequest(action="release", seller_id="seller"))
+        assert results[-1]["summary"]["applied"] == 2
+        assert {"payment_id": cart_payment, "domain_id": "d1", "result": "applied",
+                "escrow_status": "released_to_seller"} in results
+
+        cart = await db.payment_transactions.find_one({"id": cart_payment})
+        assert cart["payment_status"] == "paid"
+        assert [item["escrow_status"] for item in cart["items"]] == ["released_to_seller", None]
+
+        # The other seller's refund settles the rest of the cart
+        results = await run_batch(db, EscrowBatchRequest(action="refund", payment_ids=[cart_payment]))
+        assert results[-1]["summary"]["applied"] == 0
+        await db.transactions.update_one({"domain_id": "d2"}, {"$set": {"status": "failed"}})
+        results = await run_batch(db, EscrowBatchRequest(action="refund", payment_ids=[cart_payment]))
+        assert results[-1]["summary"]["applied"] == 1
+        cart = await db.payment_transactions.find_one({"id": cart_payment})
+        assert cart["payment_status"] == "partially_refunded"
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("path", ["/payments/escrow/batch", "/payments/escrow/release/{payment_id}"])
+def test_escrow_routes_need_an_admin(path):
+    route = next(route for route in router.routes if route.path == path)
+    assert get_current_admin_user in [dependency.call for dependency in route.dependant.dependencies]
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+from src.config.indexes import ensure_indexes
+from src.models.payment import CheckoutSessionRequest
+from src.utils.payment_providers import FakeCheckoutProvider
+from src.utils.security import derive_secret
+from src.utils.webhooks import verify_signature
+
+SECRET = derive_secret("fake-checkout-webhooks")
+
+
+class Recorder:
+    def __init__(self):
+        self.deliveries = []
+
+    async def __call__(self, payload, signature):
+        self.deliveries.append((payload, signature))
+
+
+async def open_session(provider, amount=12.5):
+    return (await provider.create_checkout_session(CheckoutSessionRequest(
+        amount=amount, currency="usd", success_url="http://shop/ok?x=1", cancel_url="http://shop/cancel",
+        metadata={"domain_id": "d1"}
+    ))).session_id
+
+
+def test_webhook_secret_is_the_same_in_every_worker():
+    assert derive_secret("fake-checkout-webhooks") == SECRET
+    assert derive_secret("something-else") != SECRET
+
+
+def test_completed_session_sends_a_signed_webhook(db):
+    recorder = Recorder()
+    provider = FakeCheckoutProvider(db, webhook_secret=SECRET, webhook_handler=recorder)
+
+    async def scenario():
+        session_id = await open_session(provider)
+        assert await provider.complete_session(session_id)
+        # A closed session cannot be paid or expired again
+        assert not await provider.complete_session(session_id)
+        assert not await provider.expire_session(session_id)
+        return session_id
+
+    session_id = asyncio.run(scenario())
+    assert len(recorder.deliveries) == 1
+    payload, signature = recorder.deliveries[0]
+    assert verify_signature(payload, signature, SECRET)
+    assert not verify_signature(payload, signature, "whsec_other")
+    event = json.loads(payload)
+    assert event["type"] == "checkout.session.completed"
+    assert event["data"]["object"]["id"] == session_id
+    assert event["data"]["object"]["payment_status"] == "paid"
+    assert event["data"]["object"]["amount_total"] == 1250
+    assert event["data"]["object"]["metadata"] == {"domain_id": "d1"}
+
+
+def test_sessions_are_shared_between_workers(db):
+    first, second = FakeCheckoutProvider(db), FakeCheckoutProvider(db)
+
+    async def scenario():
+        await ensure_indexes(db)
+        session_id = await open_session(first)
+        status = await second.get_checkout_status(session_id)
+        assert (status.status, status.payment_status) == ("open", "unpaid")
+
+        assert await second.expire_checkout_session(session_id)
+        assert not await first.complete_session(session_id)
+        assert (await first.get_checkout_status(session_id)).status == "expired"
+
+    asyncio.run(scenario())
+
+
+def test_only_one_concurrent_close_wins(db):
+    recorder = Recorder()
+    provider = FakeCheckoutProvider(db, webhook_secret=SECRET, webhook_handler=recorder)
+
+    async def scenario():
+        session_id = await open_session(provider)
+        results = await asyncio.gather(
+            provider.complete_session(session_id), provider.expire_session(session_id),
+            provider.complete_session(session_id)
+        )
+        assert results.count(True) == 1
+
+    asyncio.run(scenario())
+    assert len(recorder.deliveries) == 1
+
+
+def test_unknown_session_reads_as_expired(db):
+    status = asyncio.run(FakeCheckoutProvider(db).get_checkout_status("cs_fake_missing"))
+    assert (status.status, status.payment_status) == ("expired", "unpaid")
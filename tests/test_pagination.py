@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from src.controllers.payment_controller import PaymentController
+from src.controllers.transaction_controller import get_user_transactions
+from src.models.payment import CartItem, PaymentTransaction
+from src.models.transaction import Transaction
+from src.models.user import User
+from src.utils.pagination import before_cursor_filter, decode_cursor, encode_cursor, merge_descending
+
+
+class AsyncList:
+    """Async-iterable stand-in for a Motor cursor that counts reads"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.read = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.read >= len(self.docs):
+            raise StopAsyncIteration
+        self.read += 1
+        return self.docs[self.read - 1]
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123000)
+    assert decode_cursor(encode_cursor(created_at, "abc|def")) == (created_at, "abc|def")
+
+
+def test_invalid_cursor_is_a_bad_request():
+    with pytest.raises(HTTPException) as error:
+        before_cursor_filter("not a cursor")
+    assert error.value.status_code == 400
+
+
+def test_no_cursor_selects_everything():
+    assert before_cursor_filter(None) == {}
+
+
+def test_merge_descending_interleaves_dedupes_and_reads_lazily():
+    left = AsyncList([{"id": "5"}, {"id": "3"}, {"id": "1"}])
+    right = AsyncList([{"id": "4"}, {"id": "3"}, {"id": "2"}, {"id": "0"}])
+
+    merged = asyncio.run(merge_descending([left, right], 3, key=lambda doc: doc["id"]))
+
+    assert [doc["id"] for doc in merged] == ["5", "4", "3"]
+    # Only one document past the page is buffered per cursor
+    assert right.read < len(right.docs)
+
+
+def test_transaction_pages_cover_both_roles_without_gaps(db):
+    user = User(email="u@example.com", username="u", hashed_password="x")
+    base = datetime(2024, 1, 1)
+    transactions = []
+    for i in range(25):
+        role = {"buyer_id": user.id, "seller_id": "other"} if i % 2 else {"buyer_id": "other", "seller_id": user.id}
+        # Pairs share a timestamp so the id tie-breaker is exercised
+        transactions.append(Transaction(
+            domain_id=f"d{i}", amount=1, transaction_fee=0.1,
+            created_at=base + timedelta(minutes=i // 2), **role
+        ))
+    unrelated = Transaction(domain_id="x", amount=1, transaction_fee=0.1, buyer_id="a", seller_id="b")
+
+    async def scenario():
+        await db.transactions.insert_many([t.dict() for t in transactions + [unrelated]])
+        pages, cursor = [], None
+        while True:
+            page, cursor = await get_user_transactions(user, db, limit=10, cursor=cursor)
+            pages.append(page)
+            if cursor is None:
+                return pages
+
+    pages = asyncio.run(scenario())
+    ids = [t.id for page in pages for t in page]
+    expected = [t.id for t in sorted(transactions, key=lambda t: (t.created_at, t.id), reverse=True)]
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert ids == expected
+
+
+def test_seller_payment_history_shows_only_their_share_of_carts(db):
+    async def scenario():
+        await db.payment_transactions.insert_many([
+            PaymentTransaction(amount=10, stripe_session_id="cs_single", seller_id="seller",
+                               created_at=datetime.utcnow() - timedelta(minutes=1)).dict(),
+            PaymentTransaction(amount=35, stripe_session_id="cs_cart", cart_id="cart", items=[
+                CartItem(domain_id="d1", domain_name="one.com", seller_id="seller", amount=5),
+                CartItem(domain_id="d2", domain_name="two.com", seller_id="other", amount=30)
+            ]).dict()
+        ])
+        summaries, _ = await PaymentController.get_user_payments("seller", db, role="seller")
+        details, _ = await PaymentController.get_user_payments("seller", db, role="seller", detail=True)
+        return summaries, details
+
+    summaries, details = asyncio.run(scenario())
+    assert [(payment.amount, payment.domain_name) for payment in summaries] == [(5, "one.com"), (10, None)]
+    assert [item.domain_id for item in details[0].items] == ["d1"]
+    assert details[0].amount == 5
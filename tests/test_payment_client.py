@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.middleware.auth import get_current_admin_user
+from src.models.user import User
+from src.utils import circuit_breaker
+from src.utils.circuit_breaker import CircuitBreaker
+from src.utils.payment_client import PaymentProviderClient, PaymentProviderError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return clock
+
+
+class Provider:
+    """Answers status lookups after ``delay`` seconds, or fails while ``failing`` is set"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.failing = False
+        self.release = None
+
+    async def get_checkout_status(self, session_id):
+        if self.release is not None:
+            await self.release.wait()
+        await asyncio.sleep(self.delay)
+        if self.failing:
+            raise RuntimeError("provider down")
+        return session_id
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.retry_after() == 20
+
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    # A cancelled probe frees its slot
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == 30
+
+
+def test_bulkhead_refuses_calls_beyond_the_limit():
+    provider = Provider()
+    client = PaymentProviderClient(provider, max_concurrency=2)
+
+    async def scenario():
+        provider.release = asyncio.Event()
+        calls = [asyncio.create_task(client.get_checkout_status(f"cs_{i}")) for i in range(2)]
+        await asyncio.sleep(0)
+        assert client.in_flight == 2
+        with pytest.raises(PaymentProviderError) as error:
+            await client.get_checkout_status("cs_extra")
+        assert error.value.reason == "bulkhead_full"
+        provider.release.set()
+        assert await asyncio.gather(*calls) == ["cs_0", "cs_1"]
+        assert client.in_flight == 0
+        # Capacity is back once the calls finished
+        assert await client.get_checkout_status("cs_2") == "cs_2"
+
+    asyncio.run(scenario())
+    operation = client.metrics()["operations"]["get_checkout_status"]
+    assert operation["calls"] == 4
+    assert operation["succeeded"] == 3
+    assert operation["rejected"] == 1
+
+
+def test_failures_and_timeouts_open_the_circuit():
+    provider = Provider(delay=0.05)
+    client = PaymentProviderClient(provider, status_timeout=0.01, breaker=CircuitBreaker(failure_threshold=2))
+
+    async def scenario():
+        with pytest.raises(PaymentProviderError) as error:
+            await client.get_checkout_status("cs_1")
+        assert error.value.reason == "timeout"
+
+        provider.delay = 0.0
+        provider.failing = True
+        with pytest.raises(PaymentProviderError) as error:
+            await client.get_checkout_status("cs_2")
+        assert error.value.reason == "provider_error"
+
+        # The provider is not called while the circuit is open
+        provider.failing = False
+        with pytest.raises(PaymentProviderError) as error:
+            await client.get_checkout_status("cs_3")
+        assert error.value.reason == "circuit_open"
+        assert error.value.retry_after > 0
+
+    asyncio.run(scenario())
+    metrics = client.metrics()
+    assert metrics["circuit"] == CircuitBreaker.OPEN
+    assert metrics["operations"]["get_checkout_status"]["timed_out"] == 1
+    assert metrics["operations"]["get_checkout_status"]["failed"] == 1
+
+
+def test_unconfigured_client_refuses_calls():
+    client = PaymentProviderClient(None)
+    with pytest.raises(PaymentProviderError) as error:
+        asyncio.run(client.get_checkout_status("cs_1"))
+    assert error.value.reason == "not_configured"
+
+
+def test_provider_metrics_need_an_admin():
+    user = User(email="user@example.com", username="user", hashed_password="x")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(get_current_admin_user(user))
+    assert error.value.status_code == 403
+
+    admin = User(email="admin@example.com", username="admin", hashed_password="x", is_admin=True)
+    assert asyncio.run(get_current_admin_user(admin)) is admin
@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.controllers import payment_controller
+from src.controllers.event_handlers import register_event_handlers
+from src.controllers.payment_controller import PaymentController
+from src.controllers.reservation_controller import release_cart_reservations
+from src.models.domain import Domain
+from src.models.payment import CartCheckoutRequest, StripeCheckoutRequest
+from src.models.user import User
+from src.utils.cache import TTLCache
+from src.utils.events import EventBus
+from src.utils.payment_client import PaymentProviderClient
+from src.utils.payment_providers import FakeCheckoutProvider
+
+
+@pytest.fixture
+def buyer(db, monkeypatch):
+    provider = FakeCheckoutProvider(db)
+    monkeypatch.setattr(payment_controller, "payment_client", PaymentProviderClient(provider))
+    monkeypatch.setattr(payment_controller, "checkout_idempotency_cache", TTLCache(maxsize=100, ttl=60))
+    return User(email="buyer@example.com", username="buyer", hashed_password="x")
+
+
+async def listed_domains(db, count=1, seller_id="seller"):
+    domains = [Domain(name=f"paid{i}", extension=".com", price=40, category="tech", seller_id=seller_id)
+               for i in range(count)]
+    await db.domains.insert_many([domain.dict() for domain in domains])
+    return domains
+
+
+async def pay(db, session_id):
+    payment = await PaymentController.mark_payment_paid(session_id, db)
+    bus = EventBus()
+    register_event_handlers(bus)
+    await bus.drain(db)
+    return payment
+
+
+async def steal(db, domain_id, cart_id):
+    """Release a checkout's hold and let another buyer reserve the domain"""
+    await release_cart_reservations(db, [cart_id])
+    await db.domains.update_one({"id": domain_id}, {"$set": {"status": "pending", "cart_id": "someone-else"}})
+
+
+def test_paid_checkout_sells_the_held_domain(db, buyer):
+    async def scenario():
+        [domain] = await listed_domains(db)
+        session = await PaymentController.create_domain_checkout(
+            StripeCheckoutRequest(domain_id=domain.id, origin_url="http://shop"), buyer, db
+        )
+        held = await db.domains.find_one({"id": domain.id})
+        assert held["status"] == "pending" and held["cart_id"]
+
+        await pay(db, session.session_id)
+        sold = await db.domains.find_one({"id": domain.id})
+        assert sold["status"] == "sold"
+        assert await db.transactions.count_documents({"domain_id": domain.id, "buyer_id": buyer.id}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_payment_that_lost_its_hold_is_refunded(db, buyer):
+    async def scenario():
+        [domain] = await listed_domains(db)
+        session = await PaymentController.create_domain_checkout(
+            StripeCheckoutRequest(domain_id=domain.id, origin_url="http://shop"), buyer, db
+        )
+        payment = await db.payment_transactions.find_one({"stripe_session_id": session.session_id})
+        await steal(db, domain.id, payment["cart_id"])
+
+        await pay(db, session.session_id)
+        assert (await db.domains.find_one({"id": domain.id}))["status"] == "pending"
+        payment = await db.payment_transactions.find_one({"stripe_session_id": session.session_id})
+        assert payment["payment_status"] == "refund_pending"
+        assert await db.transactions.count_documents({"payment_id": payment["id"]}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_cart_with_a_lost_hold_sells_nothing(db, buyer):
+    async def scenario():
+        first, second = await listed_domains(db, 2)
+        cart = await PaymentController.create_cart_checkout(
+            CartCheckoutRequest(domain_ids=[first.id, second.id], origin_url="http://shop"), buyer, db
+        )
+        await db.domains.update_one({"id": second.id}, {"$set": {"cart_id": "someone-else"}})
+
+        await pay(db, cart.session_id)
+        assert (await db.domains.find_one({"id": first.id}))["status"] == "available"
+        assert (await db.domains.find_one({"id": second.id}))["cart_id"] == "someone-else"
+        payment = await db.payment_transactions.find_one({"stripe_session_id": cart.session_id})
+        assert payment["payment_status"] == "refund_pending"
+        assert await db.transactions.count_documents({"payment_id": payment["id"]}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_payment_after_expiry_is_refunded_not_paid(db, buyer):
+    async def scenario():
+        [domain] = await listed_domains(db)
+        session = await PaymentController.create_domain_checkout(
+            StripeCheckoutRequest(domain_id=domain.id, origin_url="http://shop"), buyer, db
+        )
+        await db.payment_transactions.update_one(
+            {"stripe_session_id": session.session_id}, {"$set": {"payment_status": "expired"}}
+        )
+
+        payment = await pay(db, session.session_id)
+        assert payment["payment_status"] == "refund_pending"
+        assert await db.outbox.count_documents({"type": "payment.completed"}) == 0
+        # Nothing further happens on a repeated notification
+        assert await PaymentController.mark_payment_paid(session.session_id, db) is None
+
+    asyncio.run(scenario())
+
+
+def test_buyers_cannot_check_out_their_own_domains(db, buyer):
+    async def scenario():
+        [listed] = await listed_domains(db, seller_id=buyer.id)
+        [owned] = await listed_domains(db)
+        buyer.domains_owned = [owned.id]
+
+        with pytest.raises(HTTPException) as error:
+            await PaymentController.create_domain_checkout(
+                StripeCheckoutRequest(domain_id=listed.id, origin_url="http://shop"), buyer, db
+            )
+        assert error.value.status_code == 400
+
+        with pytest.raises(HTTPException) as error:
+            await PaymentController.create_cart_checkout(
+                CartCheckoutRequest(domain_ids=[listed.id, owned.id], origin_url="http://shop"), buyer, db
+            )
+        assert error.value.status_code == 400
+        assert listed.id in error.value.detail and owned.id in error.value.detail
+        assert await db.domains.count_documents({"status": "pending"}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_anonymous_callers_cannot_hold_a_domain(db, buyer):
+    async def scenario():
+        [domain] = await listed_domains(db)
+        with pytest.raises(HTTPException) as error:
+            await PaymentController.create_domain_checkout(
+                StripeCheckoutRequest(domain_id=domain.id, origin_url="http://shop"), None, db, "key-1"
+            )
+        assert error.value.status_code == 401
+        assert (await db.domains.find_one({"id": domain.id}))["status"] == "available"
+
+    asyncio.run(scenario())
+
+
+def test_hold_is_released_when_the_payment_cannot_be_recorded(db, buyer, monkeypatch):
+    collection_type = type(db.payment_transactions)
+    insert_one = collection_type.insert_one
+
+    async def failing_insert(collection, document, *args, **kwargs):
+        if collection.name == "payment_transactions":
+            raise RuntimeError("write failed")
+        return await insert_one(collection, document, *args, **kwargs)
+
+    async def scenario():
+        first, second = await listed_domains(db, 2)
+        monkeypatch.setattr(collection_type, "insert_one", failing_insert)
+        with pytest.raises(RuntimeError):
+            await PaymentController.create_domain_checkout(
+                StripeCheckoutRequest(domain_id=first.id, origin_url="http://shop"), buyer, db
+            )
+        with pytest.raises(RuntimeError):
+            await PaymentController.create_cart_checkout(
+                CartCheckoutRequest(domain_ids=[first.id, second.id], origin_url="http://shop"), buyer, db
+            )
+        assert await db.domains.count_documents({"status": "available", "cart_id": {"$exists": False}}) == 2
+
+    asyncio.run(scenario())
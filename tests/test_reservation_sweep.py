@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.controllers import payment_controller
+from src.controllers.event_handlers import register_event_handlers
+from src.controllers.payment_controller import PaymentController
+from src.controllers.reservation_controller import release_stale_reservations
+from src.models.domain import Domain
+from src.models.payment import CheckoutSessionRequest, PaymentTransaction, StripeCheckoutRequest
+from src.models.user import User
+from src.utils.events import EventBus
+from src.utils.payment_client import PaymentProviderClient
+from src.utils.payment_providers import FakeCheckoutProvider
+
+
+async def abandoned_checkout(db, provider):
+    """A domain held by an open checkout since well before the hold time"""
+    domain = Domain(name="held", extension=".com", price=50, category="tech", seller_id="seller", status="pending",
+                    updated_at=datetime.utcnow() - timedelta(hours=2))
+    session = await provider.create_checkout_session(CheckoutSessionRequest(
+        amount=50, currency="usd", success_url="http://shop/ok", cancel_url="http://shop/cancel", metadata={}
+    ))
+    payment = PaymentTransaction(amount=50, domain_id=domain.id, seller_id="seller", buyer_id="buyer",
+                                 stripe_session_id=session.session_id, payment_method=provider.payment_method)
+    await db.domains.insert_one(domain.dict())
+    await db.payment_transactions.insert_one(payment.dict())
+    return domain, session.session_id
+
+
+def sweep_and_dispatch(db):
+    async def run():
+        result = await release_stale_reservations(db)
+        bus = EventBus()
+        register_event_handlers(bus)
+        await bus.drain(db)
+        return result
+    return run()
+
+
+def test_sweep_expires_the_provider_session(db, monkeypatch):
+    provider = FakeCheckoutProvider(db)
+    monkeypatch.setattr(payment_controller, "payment_client", PaymentProviderClient(provider))
+
+    async def scenario():
+        domain, session_id = await abandoned_checkout(db, provider)
+        result = await sweep_and_dispatch(db)
+        assert result["payments_expired"] == 1
+        assert (await provider.get_checkout_status(session_id)).status == "expired"
+        # A payment attempt after the sweep is refused by the provider
+        assert not await provider.complete_session(session_id)
+        assert (await db.domains.find_one({"id": domain.id}))["status"] == "available"
+
+    asyncio.run(scenario())
+
+
+def test_session_paid_before_the_sweep_is_recorded(db, monkeypatch):
+    provider = FakeCheckoutProvider(db)
+    monkeypatch.setattr(payment_controller, "payment_client", PaymentProviderClient(provider))
+
+    async def scenario():
+        _, session_id = await abandoned_checkout(db, provider)
+        # Paid at the provider, but the webhook never arrived
+        await provider.complete_session(session_id)
+        await sweep_and_dispatch(db)
+        payment = await db.payment_transactions.find_one({"stripe_session_id": session_id})
+        # The hold is gone, so the money goes back to the buyer
+        assert payment["payment_status"] == "refund_pending"
+
+    asyncio.run(scenario())
+
+
+async def paid_checkout(db, provider, age_before_payment: bool):
+    """A checkout paid while its payment.completed event is still in the outbox"""
+    domain = Domain(name="bought", extension=".com", price=50, category="tech", seller_id="seller")
+    await db.domains.insert_one(domain.dict())
+    buyer = User(email="buyer@example.com", username="buyer", hashed_password="x")
+    session = await PaymentController.create_domain_checkout(
+        StripeCheckoutRequest(domain_id=domain.id, origin_url="http://shop"), buyer, db
+    )
+    stale = {"$set": {"updated_at": datetime.utcnow() - timedelta(hours=2)}}
+    if age_before_payment:
+        await db.domains.update_one({"id": domain.id}, stale)
+    await PaymentController.mark_payment_paid(session.session_id, db)
+    if not age_before_payment:
+        # The outbox has been failing for longer than the hold time
+        await db.domains.update_one({"id": domain.id}, stale)
+    return domain, session.session_id
+
+
+@pytest.mark.parametrize("age_before_payment", [True, False])
+def test_sweep_keeps_holds_of_paid_payments(db, monkeypatch, age_before_payment):
+    provider = FakeCheckoutProvider(db)
+    monkeypatch.setattr(payment_controller, "payment_client", PaymentProviderClient(provider))
+
+    async def scenario():
+        domain, session_id = await paid_checkout(db, provider, age_before_payment)
+        result = await sweep_and_dispatch(db)
+        assert result["domains_released"] == 0
+        assert (await db.domains.find_one({"id": domain.id}))["status"] == "sold"
+        payment = await db.payment_transactions.find_one({"stripe_session_id": session_id})
+        assert payment["payment_status"] == "paid"
+
+    asyncio.run(scenario())
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.controllers.transaction_controller import create_transaction
+from src.models.domain import Domain
+from src.models.transaction import TransactionCreate
+from src.models.user import User
+
+
+def make_user(name):
+    return User(email=f"{name}@example.com", username=name, hashed_password="x")
+
+
+def test_concurrent_buyers_reserve_a_domain_once(db):
+    seller = make_user("seller")
+    buyers = [make_user(f"buyer{i}") for i in range(10)]
+    domain = Domain(name="example", extension=".com", price=100, category="tech", seller_id=seller.id)
+
+    async def scenario():
+        await db.domains.insert_one(domain.dict())
+        request = TransactionCreate(domain_id=domain.id, amount=100)
+        return await asyncio.gather(
+            *(create_transaction(request, buyer, db) for buyer in buyers),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    winners = [r for r in results if not isinstance(r, Exception)]
+    losers = [r for r in results if isinstance(r, HTTPException)]
+    assert len(winners) == 1
+    assert len(losers) == 9 and all(e.status_code == 400 for e in losers)
+
+    async def check():
+        assert (await db.domains.find_one({"id": domain.id}))["status"] == "pending"
+        assert await db.transactions.count_documents({"domain_id": domain.id}) == 1
+
+    asyncio.run(check())
+
+
+def test_seller_cannot_reserve_own_domain(db):
+    seller = make_user("seller")
+    domain = Domain(name="mine", extension=".com", price=10, category="tech", seller_id=seller.id)
+
+    async def scenario():
+        await db.domains.insert_one(domain.dict())
+        with pytest.raises(HTTPException) as error:
+            await create_transaction(TransactionCreate(domain_id=domain.id, amount=10), seller, db)
+        assert error.value.detail == "You cannot buy your own domain"
+        assert (await db.domains.find_one({"id": domain.id}))["status"] == "available"
+
+    asyncio.run(scenario())
+
+
+def test_unknown_domain_is_not_found(db):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(create_transaction(TransactionCreate(domain_id="missing", amount=10), make_user("b"), db))
+    assert error.value.status_code == 404
@@ -0,0 +1,59 @@
+import asyncio
+
+import pyotp
+import pytest
+from pymongo.errors import AutoReconnect
+
+from src.config.indexes import ensure_indexes
+from src.utils.totp import TOTPVerifier
+
+
+def test_code_is_accepted_once_across_workers(db):
+    secret = pyotp.random_base32()
+    code = pyotp.TOTP(secret).now()
+    worker_a, worker_b = TOTPVerifier(), TOTPVerifier()
+
+    async def scenario():
+        await ensure_indexes(db)
+        assert await worker_a.verify(db, "u1", secret, code)
+        assert not await worker_a.verify(db, "u1", secret, code)
+        # Another process has an empty local cache; the database claim still rejects it
+        assert not await worker_b.verify(db, "u1", secret, code)
+        # The same code is independent per user
+        assert await worker_b.verify(db, "u2", secret, code)
+
+    asyncio.run(scenario())
+
+
+def test_wrong_code_is_rejected_without_a_claim(db):
+    secret = pyotp.random_base32()
+
+    async def scenario():
+        await ensure_indexes(db)
+        assert not await TOTPVerifier().verify(db, "u1", secret, "not-a-code")
+        assert await db.totp_used_codes.count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_code_can_be_retried_after_a_failed_claim(db, monkeypatch):
+    secret = pyotp.random_base32()
+    code = pyotp.TOTP(secret).now()
+    verifier = TOTPVerifier()
+    collection_type = type(db.totp_used_codes)
+    insert_one = collection_type.insert_one
+
+    async def unreachable(collection, document, *args, **kwargs):
+        raise AutoReconnect("primary stepped down")
+
+    async def scenario():
+        await ensure_indexes(db)
+        monkeypatch.setattr(collection_type, "insert_one", unreachable)
+        with pytest.raises(AutoReconnect):
+            await verifier.verify(db, "u1", secret, code)
+
+        monkeypatch.setattr(collection_type, "insert_one", insert_one)
+        assert await verifier.verify(db, "u1", secret, code)
+        assert not await verifier.verify(db, "u1", secret, code)
+
+    asyncio.run(scenario())
@@ -0,0 +1,57 @@
+import asyncio
+
+import pyotp
+
+from src.controllers.two_factor_controller import verify_two_factor
+from src.middleware.auth import get_two_factor_state, get_user_from_token, two_factor_state_cache
+from src.models.user import User
+from src.utils.security import create_access_token
+
+
+def make_user():
+    return User(email="alice@example.com", username="alice", hashed_password="x")
+
+
+def test_not_enabled_state_is_cached_until_the_version_changes(db):
+    two_factor_state_cache.clear()
+    user = make_user()
+    token = create_access_token({"sub": user.id})
+
+    async def scenario():
+        await db.users.insert_one(user.dict())
+        principal = await get_user_from_token(token, db)
+        assert not (await get_two_factor_state(principal, db)).is_enabled
+        assert not two_factor_state_cache.get(user.id).is_enabled
+
+        # Enabled on another worker: only the version on the user document changes here
+        await db.two_factor_auth.insert_one({"user_id": user.id, "secret": "S", "is_enabled": True, "backup_codes": []})
+        await db.users.update_one({"id": user.id}, {"$inc": {"two_factor_version": 1}})
+        assert user.id in two_factor_state_cache
+
+        # The next request carries the bumped version and sees the change
+        principal = await get_user_from_token(token, db)
+        assert principal.two_factor_version == 1
+        assert (await get_two_factor_state(principal, db)).is_enabled
+
+    asyncio.run(scenario())
+
+
+def test_cached_state_never_holds_the_secret(db):
+    two_factor_state_cache.clear()
+    user = make_user()
+
+    async def scenario():
+        await db.users.insert_one(user.dict())
+        await db.two_factor_auth.insert_one({"user_id": user.id, "secret": "S", "is_enabled": True, "backup_codes": []})
+        state = await get_two_factor_state(user, db)
+        assert state.is_enabled
+        assert "secret" not in state.dict()
+
+        # A replaced secret is rejected at once, whatever this worker has cached
+        old_secret, new_secret = pyotp.random_base32(), pyotp.random_base32()
+        await db.two_factor_auth.update_one({"user_id": user.id}, {"$set": {"secret": old_secret}})
+        await db.two_factor_auth.update_one({"user_id": user.id}, {"$set": {"secret": new_secret}})
+        assert not await verify_two_factor(user, pyotp.TOTP(old_secret).now(), db)
+        assert await verify_two_factor(user, pyotp.TOTP(new_secret).now(), db)
+
+    asyncio.run(scenario())
@@ -0,0 +1,42 @@
+import asyncio
+
+from src.controllers.event_handlers import register_event_handlers
+from src.controllers.stats_controller import get_user_stats
+from src.controllers.transaction_controller import create_transaction, update_transaction_status
+from src.models.domain import Domain
+from src.models.transaction import TransactionCreate
+from src.models.user import User
+from src.utils.events import EventBus
+
+
+def test_status_changes_keep_pending_deals_in_step(db):
+    seller = User(email="s@example.com", username="seller", hashed_password="x")
+    buyer = User(email="b@example.com", username="buyer", hashed_password="x")
+    domain = Domain(name="deal", extension=".com", price=10, category="tech", seller_id=seller.id)
+    bus = EventBus()
+    register_event_handlers(bus)
+
+    async def counters(user):
+        await bus.drain(db)
+        stats = await get_user_stats(user.id, db)
+        return stats.pending_deals, stats.sales, stats.purchases
+
+    async def scenario():
+        await db.domains.insert_one(domain.dict())
+        transaction = await create_transaction(TransactionCreate(domain_id=domain.id, amount=10), buyer, db)
+        assert await counters(seller) == (1, 0, 0)
+
+        await update_transaction_status(transaction.id, "cancelled", seller, db)
+        assert await counters(seller) == (0, 0, 0)
+        assert await counters(buyer) == (0, 0, 0)
+
+        # Setting the same status again changes nothing
+        await update_transaction_status(transaction.id, "cancelled", seller, db)
+        await update_transaction_status(transaction.id, "pending", seller, db)
+        assert await counters(buyer) == (1, 0, 0)
+
+        await update_transaction_status(transaction.id, "completed", seller, db)
+        assert await counters(seller) == (0, 1, 0)
+        assert await counters(buyer) == (0, 0, 1)
+
+    asyncio.run(scenario())
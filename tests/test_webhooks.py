@@ -0,0 +1,76 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from src.config.indexes import ensure_indexes
+from src.controllers import payment_controller
+from src.controllers.payment_controller import PaymentController
+from src.models.payment import PaymentTransaction
+from src.utils.webhooks import sign_payload, verify_signature
+
+SECRET = "whsec_test"
+
+
+def completed_event(session_id, event_id="evt_1"):
+    return json.dumps({
+        "id": event_id,
+        "type": "checkout.session.completed",
+        "data": {"object": {"id": session_id, "payment_status": "paid"}}
+    }).encode()
+
+
+def test_signature_round_trip_and_tolerance():
+    payload = b'{"id": "evt_1"}'
+    assert verify_signature(payload, sign_payload(payload, SECRET), SECRET)
+    assert not verify_signature(payload, sign_payload(payload, "other"), SECRET)
+    assert not verify_signature(payload + b" ", sign_payload(payload, SECRET), SECRET)
+    stale = sign_payload(payload, SECRET, timestamp=int(time.time()) - 600)
+    assert not verify_signature(payload, stale, SECRET, tolerance=300)
+
+
+def test_redelivered_event_is_applied_once(db, monkeypatch):
+    monkeypatch.setattr(payment_controller, "STRIPE_WEBHOOK_SECRET", SECRET)
+    payment = PaymentTransaction(amount=20, domain_id="d1", buyer_id="b", seller_id="s", stripe_session_id="cs_1")
+
+    async def scenario():
+        await ensure_indexes(db)
+        await db.payment_transactions.insert_one(payment.dict())
+        payload = completed_event("cs_1")
+
+        first = await PaymentController.handle_stripe_webhook(payload, sign_payload(payload, SECRET), db)
+        second = await PaymentController.handle_stripe_webhook(payload, sign_payload(payload, SECRET), db)
+
+        assert first == {"received": True, "duplicate": False}
+        assert second == {"received": True, "duplicate": True}
+        assert (await db.payment_transactions.find_one({"id": payment.id}))["payment_status"] == "paid"
+        assert await db.outbox.count_documents({"type": "payment.completed"}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_deliveries_are_applied_once(db, monkeypatch):
+    monkeypatch.setattr(payment_controller, "STRIPE_WEBHOOK_SECRET", SECRET)
+    payment = PaymentTransaction(amount=20, domain_id="d1", buyer_id="b", seller_id="s", stripe_session_id="cs_1")
+
+    async def scenario():
+        await ensure_indexes(db)
+        await db.payment_transactions.insert_one(payment.dict())
+        payload = completed_event("cs_1", "evt_2")
+        results = await asyncio.gather(*(
+            PaymentController.handle_stripe_webhook(payload, sign_payload(payload, SECRET), db) for _ in range(5)
+        ))
+        assert sum(not result["duplicate"] for result in results) == 1
+        assert await db.outbox.count_documents({"type": "payment.completed"}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_bad_signature_is_rejected(db, monkeypatch):
+    monkeypatch.setattr(payment_controller, "STRIPE_WEBHOOK_SECRET", SECRET)
+    payload = completed_event("cs_1")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(PaymentController.handle_stripe_webhook(payload, sign_payload(payload, "wrong"), db))
+    assert error.value.status_code == 400